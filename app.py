@@ -31,6 +31,13 @@ def start_channel(channel_name: str):
                         "wechatcom_service", "gewechat", "web", const.FEISHU, const.DINGTALK]:
         PluginManager().load_plugins()
 
+    if conf().get("metrics_port"):
+        try:
+            from common.metrics_server import start_metrics_server
+            start_metrics_server(conf().get("metrics_port"))
+        except Exception as e:
+            logger.warning("[Metrics] failed to start metrics server: {}".format(e))
+
     if conf().get("use_linkai"):
         try:
             from common import linkai_client
@@ -15,3 +15,17 @@ class Bot(object):
         :return: reply content
         """
         raise NotImplementedError
+
+
+class AsyncBot(Bot):
+    """
+    支持协程调用的bot，在异步模式下由共享事件循环直接调用areply，不占用处理线程
+    """
+
+    async def areply(self, query, context: Context = None) -> Reply:
+        """
+        bot auto-reply content in coroutine
+        :param req: received message
+        :return: reply content
+        """
+        raise NotImplementedError
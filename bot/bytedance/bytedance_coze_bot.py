@@ -56,6 +56,8 @@ class ByteDanceCozeBot(Bot):
             session = self.sessions.session_query(query, user_id, session_id)
             logger.debug(f"[COZE] session={session} query={query}")
             reply, err = self._reply(query, session, context)
+            # conversation_id、消息计数等在请求过程中更新，写回会话存储
+            self.sessions.save_session(session)
             if err != None:
                 error_msg = conf().get("error_reply", "我暂时遇到了一些问题，请您稍后重试~")
                 reply = Reply(ReplyType.TEXT, error_msg)
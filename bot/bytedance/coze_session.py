@@ -1,6 +1,6 @@
-from common.expired_dict import ExpiredDict
-from config import conf
 from common.log import logger
+from common.session_store import create_session_store
+from config import conf
 
 
 class CozeSession(object):
@@ -63,14 +63,24 @@ class CozeSession(object):
 
         self.__user_message_counter += 1
 
+    def dump(self) -> dict:
+        """
+        导出会话状态，用于持久化存储
+        """
+        state = dict(self.__dict__)
+        state.pop("_CozeSession__session_id", None)
+        return state
+
+    def load(self, state: dict):
+        """
+        从dump()导出的状态恢复会话
+        """
+        self.__dict__.update(state)
+
 
 class CozeSessionManager(object):
     def __init__(self, sessioncls, **session_args):
-        if conf().get("expires_in_seconds"):
-            sessions = ExpiredDict(conf().get("expires_in_seconds"))
-        else:
-            sessions = dict()
-        self.sessions = sessions
+        self.sessions = create_session_store(sessioncls.__name__, lambda session_id: sessioncls(session_id, None, **session_args))
         self.sessioncls = sessioncls
         self.session_args = session_args
 
@@ -81,14 +91,23 @@ class CozeSessionManager(object):
         if session_id is None:
             return self.sessioncls(session_id, user_id, system_prompt, **self.session_args)
 
-        if session_id not in self.sessions:
-            self.sessions[session_id] = self.sessioncls(session_id, user_id, system_prompt, **self.session_args)
-        session = self.sessions[session_id]
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self.sessioncls(session_id, user_id, system_prompt, **self.session_args)
+            self.sessions[session_id] = session
         return session
 
+    def save_session(self, session: CozeSession):
+        """
+        会话修改后写回存储，持久化存储时必须调用
+        """
+        if session.get_session_id() is not None:
+            self.sessions[session.get_session_id()] = session
+
     def session_query(self, query, user_id, session_id):
         session = self._build_session(session_id, user_id)
         session.add_query(query)
+        self.save_session(session)
         # try:
         #     max_tokens = conf().get("conversation_max_tokens", 1000)
         #     total_tokens = session.discard_exceeding(max_tokens, None)
@@ -106,6 +125,7 @@ class CozeSessionManager(object):
             logger.debug("raw total_tokens={}, savesession tokens={}".format(total_tokens, tokens_cnt))
         except Exception as e:
             logger.warning("Exception when counting tokens precisely for session: {}".format(str(e)))
+        self.save_session(session)
         return session
 
     # def get_session(self, session_id, user_id):
@@ -1,5 +1,6 @@
 # encoding:utf-8
 
+import asyncio
 import base64
 import time
 
@@ -7,21 +8,23 @@ import openai
 import openai.error
 import requests
 from common import const
-from bot.bot import Bot
+from bot.bot import AsyncBot
 from bot.chatgpt.chat_gpt_session import ChatGPTSession
 from bot.openai.open_ai_image import OpenAIImage
 from bot.openai.open_ai_vision import OpenAIVision
 from bot.session_manager import SessionManager
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
+from common.async_loop import AsyncLoop
 from common.log import logger
+from common.thread_pool import get_thread_pool
 from common.token_bucket import TokenBucket
 from common import memory, utils, const
 from config import conf, load_config
 from bot.baidu.baidu_wenxin_session import BaiduWenxinSession
 
 # OpenAI对话模型API (可用)
-class ChatGPTBot(Bot, OpenAIImage, OpenAIVision):
+class ChatGPTBot(AsyncBot, OpenAIImage, OpenAIVision):
     def __init__(self):
         super().__init__()
         # set the default api_key
@@ -60,50 +63,20 @@ class ChatGPTBot(Bot, OpenAIImage, OpenAIVision):
             logger.info("[CHATGPT] query={}".format(query))
 
             session_id = context["session_id"]
-            reply = None
-            clear_memory_commands = conf().get("clear_memory_commands", ["#清除记忆"])
-            if query in clear_memory_commands:
-                self.sessions.clear_session(session_id)
-                reply = Reply(ReplyType.INFO, "记忆已清除")
-            elif query == "#清除所有":
-                self.sessions.clear_all_session()
-                reply = Reply(ReplyType.INFO, "所有人记忆已清除")
-            elif query == "#更新配置":
-                load_config()
-                reply = Reply(ReplyType.INFO, "配置已更新")
+            reply = self._handle_command(query, session_id)
             if reply:
                 return reply
             session = self.sessions.session_query(query, session_id)
             logger.debug("[CHATGPT] session query={}".format(session.messages))
 
             api_key = context.get("openai_api_key")
-            model = context.get("gpt_model")
-            new_args = None
-            if model:
-                new_args = self.args.copy()
-                new_args["model"] = model
+            new_args = self._build_args(context)
             # if context.get('stream'):
             #     # reply in stream
             #     return self.reply_text_stream(query, new_query, session_id)
 
             reply_content = self.reply_text(session_id, session, api_key, args=new_args)
-            logger.debug(
-                "[CHATGPT] new_query={}, session_id={}, reply_cont={}, completion_tokens={}".format(
-                    session.messages,
-                    session_id,
-                    reply_content["content"],
-                    reply_content["completion_tokens"],
-                )
-            )
-            if reply_content["completion_tokens"] == 0 and len(reply_content["content"]) > 0:
-                reply = Reply(ReplyType.ERROR, reply_content["content"])
-            elif reply_content["completion_tokens"] > 0:
-                self.sessions.session_reply(reply_content["content"], session_id, reply_content["total_tokens"])
-                reply = Reply(ReplyType.TEXT, reply_content["content"])
-            else:
-                reply = Reply(ReplyType.ERROR, reply_content["content"])
-                logger.debug("[CHATGPT] reply {} used 0 tokens.".format(reply_content))
-            return reply
+            return self._build_reply(session_id, session, reply_content)
 
         elif context.type == ContextType.IMAGE_CREATE:
             ok, retstring = self.create_img(query, 0, context=context)
@@ -117,6 +90,64 @@ class ChatGPTBot(Bot, OpenAIImage, OpenAIVision):
             reply = Reply(ReplyType.ERROR, "Bot不支持处理{}类型的消息".format(context.type))
             return reply
 
+    async def areply(self, query, context=None):
+        if context.type != ContextType.TEXT:
+            # 图片生成等请求仍使用同步实现
+            return await asyncio.get_running_loop().run_in_executor(get_thread_pool("chat"), self.reply, query, context)
+        logger.info("[CHATGPT] async query={}".format(query))
+        session_id = context["session_id"]
+        # sqlite会话存储的读写是阻塞的，会话相关的操作放到线程池中执行，不阻塞共享事件循环
+        loop = asyncio.get_running_loop()
+        pool = get_thread_pool("chat")
+        reply = await loop.run_in_executor(pool, self._handle_command, query, session_id)
+        if reply:
+            return reply
+        session = await loop.run_in_executor(pool, self.sessions.session_query, query, session_id)
+        logger.debug("[CHATGPT] session query={}".format(session.messages))
+        reply_content = await self.areply_text(session_id, session, context.get("openai_api_key"), args=self._build_args(context))
+        return await loop.run_in_executor(pool, self._build_reply, session_id, session, reply_content)
+
+    def _handle_command(self, query, session_id):
+        reply = None
+        clear_memory_commands = conf().get("clear_memory_commands", ["#清除记忆"])
+        if query in clear_memory_commands:
+            self.sessions.clear_session(session_id)
+            reply = Reply(ReplyType.INFO, "记忆已清除")
+        elif query == "#清除所有":
+            self.sessions.clear_all_session()
+            reply = Reply(ReplyType.INFO, "所有人记忆已清除")
+        elif query == "#更新配置":
+            load_config()
+            reply = Reply(ReplyType.INFO, "配置已更新")
+        return reply
+
+    def _build_args(self, context):
+        model = context.get("gpt_model")
+        new_args = None
+        if model:
+            new_args = self.args.copy()
+            new_args["model"] = model
+        return new_args
+
+    def _build_reply(self, session_id, session, reply_content) -> Reply:
+        logger.debug(
+            "[CHATGPT] new_query={}, session_id={}, reply_cont={}, completion_tokens={}".format(
+                session.messages,
+                session_id,
+                reply_content["content"],
+                reply_content["completion_tokens"],
+            )
+        )
+        if reply_content["completion_tokens"] == 0 and len(reply_content["content"]) > 0:
+            reply = Reply(ReplyType.ERROR, reply_content["content"])
+        elif reply_content["completion_tokens"] > 0:
+            self.sessions.session_reply(reply_content["content"], session_id, reply_content["total_tokens"])
+            reply = Reply(ReplyType.TEXT, reply_content["content"])
+        else:
+            reply = Reply(ReplyType.ERROR, reply_content["content"])
+            logger.debug("[CHATGPT] reply {} used 0 tokens.".format(reply_content))
+        return reply
+
     def reply_text(self, session_id: str, session: ChatGPTSession, api_key=None, args=None, retry_count=0) -> dict:
         """
         call openai's ChatCompletion to get the answer
@@ -135,89 +166,127 @@ class ChatGPTBot(Bot, OpenAIImage, OpenAIVision):
             if res:
                 return res
             response = openai.ChatCompletion.create(api_key=api_key, messages=session.messages, **args)
-            # logger.debug("[CHATGPT] response={}".format(response))
-            # logger.info("[ChatGPT] reply={}, total_tokens={}".format(response.choices[0]['message']['content'], response["usage"]["total_tokens"]))
-            content = response.choices[0]["message"]["content"]
-            # fastgpt工具调用格式处理
-            if isinstance(content, list):
-                # {
-                #     "id": "",
-                #     "model": "",
-                #     "usage": {},
-                #     "choices": [
-                #         {
-                #             "message": {
-                #                 "role": "assistant",
-                #                 "content": [
-                #                     {
-                #                         "type": "tool",
-                #                         "tools": [
-                #                             {
-                #                                 "id": "xx",
-                #                                 "toolName": "HTTP请求",
-                #                                 "toolAvatar": "xx",
-                #                                 "functionName": "xx",
-                #                                 "params": "{\"key1\":\"xx\",\"key2\":\"xxx"}",
-                #                                 "response": "xxx"
-                #                             }
-                #                         ]
-                #                     },
-                #                     {
-                #                         "type": "text",
-                #                         "text": {
-                #                             "content": "xxx"
-                #                         }
-                #                     }
-                #                 ]
-                #             },
-                #             "finish_reason": "stop",
-                #             "index": 0
-                #         }
-                #     ]
-                # }
-                for item in content:
-                    if item["type"] == "text":
-                        content = item["text"]["content"]
-                        break
-            return {
-                "total_tokens": response["usage"]["total_tokens"],
-                "completion_tokens": response["usage"]["completion_tokens"],
-                "content": content,
-            }
+            return self._parse_response(response)
         except Exception as e:
-            need_retry = retry_count < 2
-            result = {"completion_tokens": 0, "content": "我现在有点累了，等会再来吧"}
-            if isinstance(e, openai.error.RateLimitError):
-                logger.warn("[CHATGPT] RateLimitError: {}".format(e))
-                result["content"] = "提问太快啦，请休息一下再问我吧"
-                if need_retry:
-                    time.sleep(20)
-            elif isinstance(e, openai.error.Timeout):
-                logger.warn("[CHATGPT] Timeout: {}".format(e))
-                result["content"] = "我没有收到你的消息"
-                if need_retry:
-                    time.sleep(5)
-            elif isinstance(e, openai.error.APIError):
-                logger.warn("[CHATGPT] Bad Gateway: {}".format(e))
-                result["content"] = "请再问我一次"
-                if need_retry:
-                    time.sleep(10)
-            elif isinstance(e, openai.error.APIConnectionError):
-                logger.warn("[CHATGPT] APIConnectionError: {}".format(e))
-                result["content"] = "我连接不到你的网络"
-                if need_retry:
-                    time.sleep(5)
+            need_retry, result, wait_seconds = self._handle_exception(e, session, retry_count)
+            if need_retry:
+                time.sleep(wait_seconds)
+                logger.warn("[CHATGPT] 第{}次重试".format(retry_count + 1))
+                return self.reply_text(session_id, session, api_key, args, retry_count + 1)
             else:
-                logger.exception("[CHATGPT] Exception: {}".format(e))
-                need_retry = False
-                self.sessions.clear_session(session.session_id)
+                return result
 
+    async def areply_text(self, session_id: str, session: ChatGPTSession, api_key=None, args=None, retry_count=0) -> dict:
+        """
+        reply_text的协程版本，请求通过共享事件循环的aiohttp连接池发送
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            if conf().get("rate_limit_chatgpt") and not await loop.run_in_executor(get_thread_pool("chat"), self.tb4chatgpt.get_token):
+                raise openai.error.RateLimitError("RateLimitError: rate limit exceeded")
+            if args is None:
+                args = self.args
+            if memory.USER_IMAGE_CACHE.get(session_id) and conf().get("image_recognition"):
+                res = await loop.run_in_executor(get_thread_pool("chat"), self.do_vision_completion_if_need, session_id, session.messages[-1]['content'])
+                if res:
+                    return res
+            openai.aiosession.set(AsyncLoop().http_session())
+            response = await openai.ChatCompletion.acreate(api_key=api_key, messages=session.messages, **args)
+            return self._parse_response(response)
+        except Exception as e:
+            need_retry, result, wait_seconds = self._handle_exception(e, session, retry_count)
             if need_retry:
+                await asyncio.sleep(wait_seconds)
                 logger.warn("[CHATGPT] 第{}次重试".format(retry_count + 1))
-                return self.reply_text(session_id, session, api_key, args, retry_count + 1)
+                return await self.areply_text(session_id, session, api_key, args, retry_count + 1)
             else:
                 return result
 
+    def _parse_response(self, response) -> dict:
+        # logger.debug("[CHATGPT] response={}".format(response))
+        # logger.info("[ChatGPT] reply={}, total_tokens={}".format(response.choices[0]['message']['content'], response["usage"]["total_tokens"]))
+        content = response.choices[0]["message"]["content"]
+        # fastgpt工具调用格式处理
+        if isinstance(content, list):
+            # {
+            #     "id": "",
+            #     "model": "",
+            #     "usage": {},
+            #     "choices": [
+            #         {
+            #             "message": {
+            #                 "role": "assistant",
+            #                 "content": [
+            #                     {
+            #                         "type": "tool",
+            #                         "tools": [
+            #                             {
+            #                                 "id": "xx",
+            #                                 "toolName": "HTTP请求",
+            #                                 "toolAvatar": "xx",
+            #                                 "functionName": "xx",
+            #                                 "params": "{\"key1\":\"xx\",\"key2\":\"xxx"}",
+            #                                 "response": "xxx"
+            #                             }
+            #                         ]
+            #                     },
+            #                     {
+            #                         "type": "text",
+            #                         "text": {
+            #                             "content": "xxx"
+            #                         }
+            #                     }
+            #                 ]
+            #             },
+            #             "finish_reason": "stop",
+            #             "index": 0
+            #         }
+            #     ]
+            # }
+            for item in content:
+                if item["type"] == "text":
+                    content = item["text"]["content"]
+                    break
+        return {
+            "total_tokens": response["usage"]["total_tokens"],
+            "completion_tokens": response["usage"]["completion_tokens"],
+            "content": content,
+        }
+
+    def _handle_exception(self, e, session, retry_count):
+        """
+        处理请求异常
+        :return: (是否重试, 不重试时返回的结果, 重试前等待的秒数)
+        """
+        need_retry = retry_count < 2
+        wait_seconds = 0
+        result = {"completion_tokens": 0, "content": "我现在有点累了，等会再来吧"}
+        if isinstance(e, openai.error.RateLimitError):
+            logger.warn("[CHATGPT] RateLimitError: {}".format(e))
+            result["content"] = "提问太快啦，请休息一下再问我吧"
+            if need_retry:
+                wait_seconds = 20
+        elif isinstance(e, openai.error.Timeout):
+            logger.warn("[CHATGPT] Timeout: {}".format(e))
+            result["content"] = "我没有收到你的消息"
+            if need_retry:
+                wait_seconds = 5
+        elif isinstance(e, openai.error.APIError):
+            logger.warn("[CHATGPT] Bad Gateway: {}".format(e))
+            result["content"] = "请再问我一次"
+            if need_retry:
+                wait_seconds = 10
+        elif isinstance(e, openai.error.APIConnectionError):
+            logger.warn("[CHATGPT] APIConnectionError: {}".format(e))
+            result["content"] = "我连接不到你的网络"
+            if need_retry:
+                wait_seconds = 5
+        else:
+            logger.exception("[CHATGPT] Exception: {}".format(e))
+            need_retry = False
+            self.sessions.clear_session(session.session_id)
+        return need_retry, result, wait_seconds
+
 
 class AzureChatGPTBot(ChatGPTBot):
     def __init__(self):
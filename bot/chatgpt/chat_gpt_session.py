@@ -1,3 +1,5 @@
+import functools
+
 from bot.session_manager import Session
 from common.log import logger
 from common import const
@@ -16,8 +18,26 @@ class ChatGPTSession(Session):
     def __init__(self, session_id, system_prompt=None, model="gpt-3.5-turbo"):
         super().__init__(session_id, system_prompt)
         self.model = model
+        self.message_tokens = []  # 与messages一一对应的token数缓存，每条消息只计算一次
+        self.counted_messages = []  # 计数时消息的浅拷贝，与message_tokens一一对应，用于发现被修改或替换的消息
         self.reset()
 
+    def reset(self):
+        super().reset()
+        self.message_tokens = []
+        self.counted_messages = []
+
+    def dump(self) -> dict:
+        self._sync_token_cache()
+        state = super().dump()
+        state.pop("counted_messages", None)
+        return state
+
+    def load(self, state: dict):
+        super().load(state)
+        # dump时缓存已与messages校验过，恢复后直接沿用
+        self.counted_messages = [dict(message) for message in self.messages[: len(self.message_tokens)]]
+
     def discard_exceeding(self, max_tokens, cur_tokens=None):
         precise = True
         try:
@@ -29,13 +49,10 @@ class ChatGPTSession(Session):
             logger.debug("Exception when counting tokens precisely for query: {}".format(e))
         while cur_tokens > max_tokens:
             if len(self.messages) > 2:
-                self.messages.pop(1)
+                discarded = self._pop_message(1)
             elif len(self.messages) == 2 and self.messages[1]["role"] == "assistant":
-                self.messages.pop(1)
-                if precise:
-                    cur_tokens = self.calc_tokens()
-                else:
-                    cur_tokens = cur_tokens - max_tokens
+                discarded = self._pop_message(1)
+                cur_tokens = cur_tokens - discarded if precise else cur_tokens - max_tokens
                 break
             elif len(self.messages) == 2 and self.messages[1]["role"] == "user":
                 logger.warn("user message exceed max_tokens. total_tokens={}".format(cur_tokens))
@@ -43,39 +60,67 @@ class ChatGPTSession(Session):
             else:
                 logger.debug("max_tokens={}, total_tokens={}, len(messages)={}".format(max_tokens, cur_tokens, len(self.messages)))
                 break
-            if precise:
-                cur_tokens = self.calc_tokens()
-            else:
-                cur_tokens = cur_tokens - max_tokens
+            cur_tokens = cur_tokens - discarded if precise else cur_tokens - max_tokens
         return cur_tokens
 
+    def _pop_message(self, index):
+        """
+        删除一条消息，返回它的token数(未缓存时为0)
+        """
+        self.messages.pop(index)
+        if len(self.message_tokens) > index:
+            self.counted_messages.pop(index)
+            return self.message_tokens.pop(index)
+        return 0
+
+    def _sync_token_cache(self):
+        """
+        messages可能被外部修改(重新赋值、插件改写system prompt等)，从第一条不一致的消息起丢弃缓存
+        """
+        count = min(len(self.message_tokens), len(self.counted_messages), len(self.messages))
+        index = 0
+        while index < count and self.counted_messages[index] == self.messages[index]:
+            index += 1
+        del self.message_tokens[index:]
+        del self.counted_messages[index:]
+
     def calc_tokens(self):
-        return num_tokens_from_messages(self.messages, self.model)
+        count_message, reply_tokens = get_message_counter(self.model)
+        self._sync_token_cache()
+        # 只计算新增或修改过的消息
+        for message in self.messages[len(self.message_tokens):]:
+            self.message_tokens.append(count_message(message))
+            self.counted_messages.append(dict(message))
+        return sum(self.message_tokens) + reply_tokens
 
 
 # refer to https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
 def num_tokens_from_messages(messages, model):
     """Returns the number of tokens used by a list of messages."""
+    count_message, reply_tokens = get_message_counter(model)
+    return sum(count_message(message) for message in messages) + reply_tokens
+
 
+@functools.lru_cache(maxsize=None)
+def get_message_counter(model):
+    """
+    按模型解析一次计数方式并缓存，避免每次计数都重新查找tiktoken编码
+    :return: (单条消息的token计数函数, 回复前缀的token数)
+    """
     if model in ["wenxin", "xunfei"] or model.startswith(const.GEMINI):
-        return num_tokens_by_character(messages)
+        return _num_tokens_by_character, 0
 
     import tiktoken
 
     if model in ["gpt-3.5-turbo-0301", "gpt-35-turbo", "gpt-3.5-turbo-1106", "moonshot", const.LINKAI_35]:
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo")
+        return get_message_counter(model="gpt-3.5-turbo")
     elif model in ["gpt-4-0314", "gpt-4-0613", "gpt-4-32k", "gpt-4-32k-0613", "gpt-3.5-turbo-0613",
                    "gpt-3.5-turbo-16k", "gpt-3.5-turbo-16k-0613", "gpt-35-turbo-16k", "gpt-4-turbo-preview",
                    "gpt-4-1106-preview", const.GPT4_TURBO_PREVIEW, const.GPT4_VISION_PREVIEW, const.GPT4_TURBO_01_25,
                    const.GPT_4o, const.GPT_4O_0806, const.GPT_4o_MINI, const.LINKAI_4o, const.LINKAI_4_TURBO]:
-        return num_tokens_from_messages(messages, model="gpt-4")
+        return get_message_counter(model="gpt-4")
     elif model.startswith("claude-3"):
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo")
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        logger.debug("Warning: model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
+        return get_message_counter(model="gpt-3.5-turbo")
     if model == "gpt-3.5-turbo":
         tokens_per_message = 4  # every message follows <|start|>{role/name}\n{content}<|end|>\n
         tokens_per_name = -1  # if there's a name, the role is omitted
@@ -84,16 +129,27 @@ def num_tokens_from_messages(messages, model):
         tokens_per_name = 1
     else:
         logger.debug(f"num_tokens_from_messages() is not implemented for model {model}. Returning num tokens assuming gpt-3.5-turbo.")
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo")
-    num_tokens = 0
-    for message in messages:
-        num_tokens += tokens_per_message
+        return get_message_counter(model="gpt-3.5-turbo")
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except KeyError:
+        logger.debug("Warning: model not found. Using cl100k_base encoding.")
+        encoding = tiktoken.get_encoding("cl100k_base")
+
+    def count_message(message):
+        num_tokens = tokens_per_message
         for key, value in message.items():
             num_tokens += len(encoding.encode(value))
             if key == "name":
                 num_tokens += tokens_per_name
-    num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
-    return num_tokens
+        return num_tokens
+
+    # every reply is primed with <|start|>assistant<|message|>
+    return count_message, 3
+
+
+def _num_tokens_by_character(message):
+    return len(message["content"])
 
 
 def num_tokens_by_character(messages):
@@ -1,4 +1,5 @@
 # encoding:utf-8
+import asyncio
 import io
 import os
 import mimetypes
@@ -6,75 +7,114 @@ import threading
 import json
 
 
+import aiohttp
 import requests
 from urllib.parse import urlparse, unquote
 
-from bot.bot import Bot
-from lib.dify.dify_client import DifyClient, ChatClient
+from bot.bot import AsyncBot
+from lib.dify.dify_client import DifyClient, ChatClient, DifyClientPool
 from bot.dify.dify_session import DifySession, DifySessionManager
+from bot.dify.dify_stream import DifyStreamSplitter
 from bridge.context import ContextType, Context
 from bridge.reply import Reply, ReplyType
+from common.async_loop import AsyncLoop
 from common.log import logger
 from common import const, memory
+from common.thread_pool import get_thread_pool
 from common.utils import parse_markdown_text, print_red
 from common.tmp_dir import TmpDir
-from config import conf
+from config import conf, config_snapshot
 
 UNKNOWN_ERROR_MSG = "我暂时遇到了一些问题，请您稍后重试~"
 
-class DifyBot(Bot):
+class DifyBot(AsyncBot):
     def __init__(self):
         super().__init__()
         self.sessions = DifySessionManager(DifySession, model=conf().get("model", const.DIFY))
+        self.client_pool = DifyClientPool(
+            pool_size=conf().get("dify_http_pool_size", 10),
+            max_retries=conf().get("dify_max_retries", 2),
+            backoff_factor=conf().get("dify_retry_backoff", 0.5),
+            timeout=(conf().get("dify_connect_timeout", 10), conf().get("dify_read_timeout", 180)),
+        )
 
     def reply(self, query, context: Context=None):
         # acquire reply content
         if context.type == ContextType.TEXT or context.type == ContextType.IMAGE_CREATE:
-            if context.type == ContextType.IMAGE_CREATE:
-                query = conf().get('image_create_prefix', ['画'])[0] + query
-            logger.info("[DIFY] query={}".format(query))
-            session_id = context["session_id"]
-            # TODO: 适配除微信以外的其他channel
-            channel_type = conf().get("channel_type", "wx")
-            user = None
-            if channel_type in ["wx", "wework", "gewechat"]:
-                user = context["msg"].other_user_nickname if context.get("msg") else "default"
-            elif channel_type in ["wechatcom_app", "wechatmp", "wechatmp_service", "wechatcom_service", "web"]:
-                user = context["msg"].other_user_id if context.get("msg") else "default"
-            else:
-                return Reply(ReplyType.ERROR, f"unsupported channel type: {channel_type}, now dify only support wx, wechatcom_app, wechatmp, wechatmp_service channel")
-            logger.debug(f"[DIFY] dify_user={user}")
-            user = user if user else "default" # 防止用户名为None，当被邀请进的群未设置群名称时用户名为None
-            session = self.sessions.get_session(session_id, user)
-            if context.get("isgroup", False):
-                # 群聊：根据是否是共享会话群来决定是否设置用户信息
-                if not context.get("is_shared_session_group", False):
-                    # 非共享会话群：设置发送者信息
-                    session.set_user_info(context["msg"].actual_user_id, context["msg"].actual_user_nickname)
-                else:
-                    # 共享会话群：不设置用户信息
-                    session.set_user_info('', '')
-                # 设置群聊信息
-                session.set_room_info(context["msg"].other_user_id, context["msg"].other_user_nickname)
-            else:
-                # 私聊：使用发送者信息作为用户信息，房间信息留空
-                session.set_user_info(context["msg"].other_user_id, context["msg"].other_user_nickname)
-                session.set_room_info('', '')
-
-            # 打印设置的session信息
-            logger.debug(f"[DIFY] Session user and room info - user_id: {session.get_user_id()}, user_name: {session.get_user_name()}, room_id: {session.get_room_id()}, room_name: {session.get_room_name()}")
-            logger.debug(f"[DIFY] session={session} query={query}")
-
+            query, session, reply = self._prepare_session(query, context)
+            if reply:
+                return reply
             reply, err = self._reply(query, session, context)
-            if err != None:
-                dify_error_reply = conf().get("dify_error_reply", None)
-                error_msg = dify_error_reply if dify_error_reply else err
-                reply = Reply(ReplyType.TEXT, error_msg)
+            self.sessions.save_session(session)
+            return self._build_reply(reply, err)
+        else:
+            reply = Reply(ReplyType.ERROR, "Bot不支持处理{}类型的消息".format(context.type))
             return reply
+
+    async def areply(self, query, context: Context=None):
+        if context.type == ContextType.TEXT or context.type == ContextType.IMAGE_CREATE:
+            # sqlite会话存储的读写是阻塞的，放到线程池中执行，不阻塞共享事件循环
+            loop = asyncio.get_running_loop()
+            pool = get_thread_pool("chat")
+            query, session, reply = await loop.run_in_executor(pool, self._prepare_session, query, context)
+            if reply:
+                return reply
+            reply, err = await self._areply(query, session, context)
+            await loop.run_in_executor(pool, self.sessions.save_session, session)
+            return self._build_reply(reply, err)
         else:
             reply = Reply(ReplyType.ERROR, "Bot不支持处理{}类型的消息".format(context.type))
             return reply
 
+    def _build_reply(self, reply, err):
+        if err != None:
+            dify_error_reply = config_snapshot().dify_error_reply
+            error_msg = dify_error_reply if dify_error_reply else err
+            reply = Reply(ReplyType.TEXT, error_msg)
+        return reply
+
+    def _prepare_session(self, query, context: Context):
+        """
+        获取会话并设置用户、群聊信息
+        :return: (query, session, 不支持的channel时返回的错误回复)
+        """
+        cfg = config_snapshot()
+        if context.type == ContextType.IMAGE_CREATE:
+            query = cfg.get('image_create_prefix', ['画'])[0] + query
+        logger.info("[DIFY] query={}".format(query))
+        session_id = context["session_id"]
+        # TODO: 适配除微信以外的其他channel
+        channel_type = cfg.get("channel_type", "wx")
+        user = None
+        if channel_type in ["wx", "wework", "gewechat"]:
+            user = context["msg"].other_user_nickname if context.get("msg") else "default"
+        elif channel_type in ["wechatcom_app", "wechatmp", "wechatmp_service", "wechatcom_service", "web"]:
+            user = context["msg"].other_user_id if context.get("msg") else "default"
+        else:
+            return query, None, Reply(ReplyType.ERROR, f"unsupported channel type: {channel_type}, now dify only support wx, wechatcom_app, wechatmp, wechatmp_service channel")
+        logger.debug(f"[DIFY] dify_user={user}")
+        user = user if user else "default" # 防止用户名为None，当被邀请进的群未设置群名称时用户名为None
+        session = self.sessions.get_session(session_id, user)
+        if context.get("isgroup", False):
+            # 群聊：根据是否是共享会话群来决定是否设置用户信息
+            if not context.get("is_shared_session_group", False):
+                # 非共享会话群：设置发送者信息
+                session.set_user_info(context["msg"].actual_user_id, context["msg"].actual_user_nickname)
+            else:
+                # 共享会话群：不设置用户信息
+                session.set_user_info('', '')
+            # 设置群聊信息
+            session.set_room_info(context["msg"].other_user_id, context["msg"].other_user_nickname)
+        else:
+            # 私聊：使用发送者信息作为用户信息，房间信息留空
+            session.set_user_info(context["msg"].other_user_id, context["msg"].other_user_nickname)
+            session.set_room_info('', '')
+
+        # 打印设置的session信息
+        logger.debug(f"[DIFY] Session user and room info - user_id: {session.get_user_id()}, user_name: {session.get_user_name()}, room_id: {session.get_room_id()}, room_name: {session.get_room_name()}")
+        logger.debug(f"[DIFY] session={session} query={query}")
+        return query, session, None
+
     # TODO: delete this function
     def _get_payload(self, query, session: DifySession, response_mode):
         # 输入的变量参考 wechat-assistant-pro：https://github.com/leochen-g/wechat-assistant-pro/issues/76
@@ -92,7 +132,15 @@ class DifyBot(Bot):
         }
 
     def _get_dify_conf(self, context: Context, key, default=None):
-        return context.get(key, conf().get(key, default))
+        return context.get(key, config_snapshot().get(key, default))
+
+    def _get_client(self, context: Context, client_cls=DifyClient):
+        """
+        获取缓存的dify客户端，不同群可能路由到不同的dify应用，按(api_base, api_key)分别缓存
+        """
+        api_key = self._get_dify_conf(context, "dify_api_key", '')
+        api_base = self._get_dify_conf(context, "dify_api_base", "https://api.dify.ai/v1")
+        return self.client_pool.get_client(client_cls, api_key, api_base)
 
     def _reply(self, query: str, session: DifySession, context: Context):
         try:
@@ -113,10 +161,102 @@ class DifyBot(Bot):
             logger.exception(error_info)
             return None, UNKNOWN_ERROR_MSG
 
-    def _handle_chatbot(self, query: str, session: DifySession, context: Context):
+    async def _areply(self, query: str, session: DifySession, context: Context):
+        try:
+            session.count_user_message() # 限制一个conversation中消息数，防止conversation过长
+            dify_app_type = self._get_dify_conf(context, "dify_app_type", 'chatbot')
+            if dify_app_type == 'chatbot' or dify_app_type == 'chatflow':
+                return await self._ahandle_chatbot(query, session, context)
+            elif dify_app_type == 'agent':
+                return await self._ahandle_agent(query, session, context)
+            elif dify_app_type == 'workflow':
+                return await self._ahandle_workflow(query, session, context)
+            else:
+                friendly_error_msg = "[DIFY] 请检查 config.json 中的 dify_app_type 设置，目前仅支持 agent, chatbot, chatflow, workflow"
+                return None, friendly_error_msg
+
+        except Exception as e:
+            error_info = f"[DIFY] Exception: {e}"
+            logger.exception(error_info)
+            return None, UNKNOWN_ERROR_MSG
+
+    def _async_post(self, context: Context, endpoint: str, data: dict):
         api_key = self._get_dify_conf(context, "dify_api_key", '')
         api_base = self._get_dify_conf(context, "dify_api_base", "https://api.dify.ai/v1")
-        chat_client = ChatClient(api_key, api_base)
+        headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+        timeout = aiohttp.ClientTimeout(sock_connect=conf().get("dify_connect_timeout", 10), sock_read=conf().get("dify_read_timeout", 180))
+        return AsyncLoop().http_session().post(f"{api_base}{endpoint}", json=data, headers=headers, timeout=timeout)
+
+    async def _aget_upload_files(self, session: DifySession, context: Context):
+        if not memory.USER_IMAGE_CACHE.get(session.get_session_id()):
+            return None
+        return await asyncio.get_running_loop().run_in_executor(get_thread_pool("chat"), self._get_upload_files, session, context)
+
+    async def _ahandle_chatbot(self, query: str, session: DifySession, context: Context):
+        payload = self._get_payload(query, session, 'blocking')
+        files = await self._aget_upload_files(session, context)
+        data = ChatClient.build_chat_message_data(payload['inputs'], payload['query'], payload['user'], payload['response_mode'], payload['conversation_id'], files)
+        async with self._async_post(context, "/chat-messages", data) as response:
+            status_code = response.status
+            response_text = await response.text()
+        if status_code != 200:
+            error_info = f"[DIFY] payload={payload} response text={response_text} status_code={status_code}"
+            logger.warning(error_info)
+            friendly_error_msg = self._handle_error_response(response_text, status_code)
+            return None, friendly_error_msg
+        # 回复中图片、文件的下载和分段发送是同步逻辑，放到线程池执行
+        return await asyncio.get_running_loop().run_in_executor(get_thread_pool("chat"), self._process_chatbot_response, json.loads(response_text), session, context)
+
+    async def _ahandle_agent(self, query: str, session: DifySession, context: Context):
+        payload = self._get_payload(query, session, 'streaming')
+        files = await self._aget_upload_files(session, context)
+        data = ChatClient.build_chat_message_data(payload['inputs'], payload['query'], payload['user'], payload['response_mode'], payload['conversation_id'], files)
+        loop = asyncio.get_running_loop()
+        stream_reply = self._get_dify_conf(context, "dify_stream_reply", False)
+        splitter = self._new_stream_splitter(context)
+        sent = 0
+        events = []
+        async with self._async_post(context, "/chat-messages", data) as response:
+            if response.status != 200:
+                response_text = await response.text()
+                error_info = f"[DIFY] payload={payload} response text={response_text} status_code={response.status}"
+                logger.warning(error_info)
+                friendly_error_msg = self._handle_error_response(response_text, response.status)
+                return None, friendly_error_msg
+            async for line in response.content:
+                event = self._parse_sse_event(line.decode('utf-8').strip())
+                if not event:
+                    continue
+                if not stream_reply:
+                    events.append(event)
+                    continue
+                for msg in splitter.feed(event):
+                    await loop.run_in_executor(get_thread_pool("chat"), self._send_agent_message, msg, context, sent == 0)
+                    sent += 1
+                if splitter.finished:
+                    break
+        if stream_reply:
+            return await loop.run_in_executor(get_thread_pool("chat"), self._finish_agent_stream, splitter, sent, session, context)
+        msgs, conversation_id = self._merge_sse_events(events)
+        return await loop.run_in_executor(get_thread_pool("chat"), self._process_agent_messages, msgs, conversation_id, session, context)
+
+    async def _ahandle_workflow(self, query: str, session: DifySession, context: Context):
+        payload = self._get_workflow_payload(query, session)
+        async with self._async_post(context, "/workflows/run", payload) as response:
+            status_code = response.status
+            response_text = await response.text()
+        if status_code != 200:
+            error_info = f"[DIFY] payload={payload} response text={response_text} status_code={status_code}"
+            logger.warning(error_info)
+            friendly_error_msg = self._handle_error_response(response_text, status_code)
+            return None, friendly_error_msg
+        return self._process_workflow_response(json.loads(response_text))
+
+    def _handle_chatbot(self, query: str, session: DifySession, context: Context):
+        chat_client = self._get_client(context, ChatClient)
         response_mode = 'blocking'
         payload = self._get_payload(query, session, response_mode)
         files = self._get_upload_files(session, context)
@@ -150,6 +290,9 @@ class DifyBot(Bot):
         #     "created_at": 1705407629
         # }
         rsp_data = response.json()
+        return self._process_chatbot_response(rsp_data, session, context)
+
+    def _process_chatbot_response(self, rsp_data: dict, session: DifySession, context: Context):
         logger.debug("[DIFY] usage {}".format(rsp_data.get('metadata', {}).get('usage', 0)))
 
         answer = rsp_data['answer']
@@ -250,9 +393,7 @@ class DifyBot(Bot):
         return None
 
     def _handle_agent(self, query: str, session: DifySession, context: Context):
-        api_key = self._get_dify_conf(context, "dify_api_key", '')
-        api_base = self._get_dify_conf(context, "dify_api_base", "https://api.dify.ai/v1")
-        chat_client = ChatClient(api_key, api_base)
+        chat_client = self._get_client(context, ChatClient)
         response_mode = 'streaming'
         payload = self._get_payload(query, session, response_mode)
         files = self._get_upload_files(session, context)
@@ -275,30 +416,61 @@ class DifyBot(Bot):
         # data: {"event": "agent_thought", "id": "8dcf3648-fbad-407a-85dd-73a6f43aeb9f", "task_id": "9cf1ddd7-f94b-459b-b942-b77b26c59e9b", "message_id": "1fb10045-55fd-4040-99e6-d048d07cbad3", "position": 1, "thought": "", "observation": "", "tool": "dalle3", "tool_input": "{\"dalle3\": {\"prompt\": \"cute Japanese anime girl with white hair, blue eyes, bunny girl suit\"}}", "created_at": 1705639511, "message_files": [], "conversation_id": "c216c595-2d89-438c-b33c-aae5ddddd142"}
         # data: {"event": "agent_message", "id": "1fb10045-55fd-4040-99e6-d048d07cbad3", "task_id": "9cf1ddd7-f94b-459b-b942-b77b26c59e9b", "message_id": "1fb10045-55fd-4040-99e6-d048d07cbad3", "answer": "I have created an image of a cute Japanese", "created_at": 1705639511, "conversation_id": "c216c595-2d89-438c-b33c-aae5ddddd142"}
         # data: {"event": "message_end", "task_id": "9cf1ddd7-f94b-459b-b942-b77b26c59e9b", "id": "1fb10045-55fd-4040-99e6-d048d07cbad3", "message_id": "1fb10045-55fd-4040-99e6-d048d07cbad3", "conversation_id": "c216c595-2d89-438c-b33c-aae5ddddd142", "metadata": {"usage": {"prompt_tokens": 305, "prompt_unit_price": "0.001", "prompt_price_unit": "0.001", "prompt_price": "0.0003050", "completion_tokens": 97, "completion_unit_price": "0.002", "completion_price_unit": "0.001", "completion_price": "0.0001940", "total_tokens": 184, "total_price": "0.0002290", "currency": "USD", "latency": 1.771092874929309}}}
+        if self._get_dify_conf(context, "dify_stream_reply", False):
+            return self._stream_agent_events(self._iter_sse_events(response), session, context)
         msgs, conversation_id = self._handle_sse_response(response)
-        channel = context.get("channel")
-        # TODO: 适配除微信以外的其他channel
-        is_group = context.get("isgroup", False)
+        return self._process_agent_messages(msgs, conversation_id, session, context)
+
+    def _process_agent_messages(self, msgs: list, conversation_id, session: DifySession, context: Context):
         for msg in msgs[:-1]:
-            if msg['type'] == 'agent_message':
-                if is_group:
-                    at_prefix = "@" + context["msg"].actual_user_nickname + "\n"
-                    msg['content'] = at_prefix + msg['content']
-                reply = Reply(ReplyType.TEXT, msg['content'])
-                channel.send(reply, context)
-            elif msg['type'] == 'message_file':
-                url = self._fill_file_base_url(msg['content']['url'])
-                reply = Reply(ReplyType.IMAGE_URL, url)
-                thread = threading.Thread(target=channel.send, args=(reply, context))
-                thread.start()
+            self._send_agent_message(msg, context)
         # 检查msgs是否为空
         if not msgs:
             return None, "No messages received from agent."
-        final_msg = msgs[-1]
+        return self._build_agent_reply(msgs[-1], conversation_id, session, context)
+
+    def _send_agent_message(self, msg: dict, context: Context, at_user=True):
+        channel = context.get("channel")
+        # TODO: 适配除微信以外的其他channel
+        if msg['type'] == 'agent_message':
+            content = self._filter_reply_text(context, msg['content'])
+            if not content:
+                return
+            if at_user and context.get("isgroup", False):
+                content = "@" + context["msg"].actual_user_nickname + "\n" + content
+            channel.send(Reply(ReplyType.TEXT, content), context)
+        elif msg['type'] == 'message_file':
+            url = self._fill_file_base_url(msg['content']['url'])
+            reply = Reply(ReplyType.IMAGE_URL, url)
+            thread = threading.Thread(target=channel.send, args=(reply, context))
+            thread.start()
+
+    def _filter_reply_text(self, context: Context, content, final=False):
+        """
+        分段发送的文本依次经过插件注册的流式过滤器(如敏感词插件)，过滤器在多段之间保持状态
+        :param final: 是否为最后一段，为True时取出过滤器中暂存的剩余文本
+        :return: 过滤后的文本，为None时表示不再发送
+        """
+        for stream in context.get("reply_stream_filters", []) if context else []:
+            if content is None:
+                break
+            content = stream.feed(content)
+            if final and content is not None:
+                rest = stream.flush()
+                content = None if rest is None else content + rest
+        return content
+
+    def _build_agent_reply(self, final_msg: dict, conversation_id, session: DifySession, context: Context = None):
         reply = None
         if final_msg['type'] == 'agent_message':
-            reply = Reply(ReplyType.TEXT, final_msg['content'])
+            content = self._filter_reply_text(context, final_msg['content'], final=True)
+            if content:
+                reply = Reply(ReplyType.TEXT, content)
         elif final_msg['type'] == 'message_file':
+            # 最后一条是文件时，先发出过滤器中暂存的剩余文本并结束过滤
+            rest = self._filter_reply_text(context, "", final=True)
+            if rest and context and context.get("channel"):
+                context["channel"].send(Reply(ReplyType.TEXT, rest), context)
             url = self._fill_file_base_url(final_msg['content']['url'])
             reply = Reply(ReplyType.IMAGE_URL, url)
         # 设置dify conversation_id, 依靠dify管理上下文
@@ -306,11 +478,44 @@ class DifyBot(Bot):
             session.set_conversation_id(conversation_id)
         return reply, None
 
+    def _new_stream_splitter(self, context: Context):
+        return DifyStreamSplitter(
+            min_chars=self._get_dify_conf(context, "dify_stream_min_chars", 20),
+            send_interval=self._get_dify_conf(context, "dify_stream_send_interval", 1.0),
+        )
+
+    def _stream_agent_events(self, events, session: DifySession, context: Context):
+        """
+        流式回复：边接收sse事件边把完整的段落/句子发给用户，剩余内容作为最终回复返回
+        """
+        splitter = self._new_stream_splitter(context)
+        sent = 0
+        for event in events:
+            for msg in splitter.feed(event):
+                self._send_agent_message(msg, context, at_user=sent == 0)
+                sent += 1
+            if splitter.finished:
+                break
+        return self._finish_agent_stream(splitter, sent, session, context)
+
+    def _finish_agent_stream(self, splitter: DifyStreamSplitter, sent: int, session: DifySession, context: Context):
+        if not splitter.conversation_id:
+            raise Exception("conversation_id not found")
+        msgs = splitter.finish()
+        if not msgs and sent and context.get("reply_stream_filters"):
+            msgs = [{"type": "agent_message", "content": ""}]  # 取出过滤器中暂存的剩余文本
+        if not msgs:
+            if sent == 0:
+                return None, "No messages received from agent."
+            # 内容已经全部发出，没有最终回复
+            if session.get_conversation_id() == '':
+                session.set_conversation_id(splitter.conversation_id)
+            return None, None
+        return self._build_agent_reply(msgs[-1], splitter.conversation_id, session, context)
+
     def _handle_workflow(self, query: str, session: DifySession, context: Context):
         payload = self._get_workflow_payload(query, session)
-        api_key = self._get_dify_conf(context, "dify_api_key", '')
-        api_base = self._get_dify_conf(context, "dify_api_base", "https://api.dify.ai/v1")
-        dify_client = DifyClient(api_key, api_base)
+        dify_client = self._get_client(context)
         response = dify_client._send_request("POST", "/workflows/run", json=payload)
         if response.status_code != 200:
             error_info = f"[DIFY] payload={payload} response text={response.text} status_code={response.status_code}"
@@ -338,6 +543,9 @@ class DifyBot(Bot):
         #  }
 
         rsp_data = response.json()
+        return self._process_workflow_response(rsp_data)
+
+    def _process_workflow_response(self, rsp_data: dict):
         if 'data' not in rsp_data or 'outputs' not in rsp_data['data'] or 'text' not in rsp_data['data']['outputs']:
             error_info = f"[DIFY] Unexpected response format: {rsp_data}"
             logger.warning(error_info)
@@ -351,9 +559,7 @@ class DifyBot(Bot):
             return None
         # 清理图片缓存
         memory.USER_IMAGE_CACHE[session_id] = None
-        api_key = self._get_dify_conf(context, "dify_api_key", '')
-        api_base = self._get_dify_conf(context, "dify_api_base", "https://api.dify.ai/v1")
-        dify_client = DifyClient(api_key, api_base)
+        dify_client = self._get_client(context)
         msg = img_cache.get("msg")
         path = img_cache.get("path")
         msg.prepare()
@@ -430,15 +636,21 @@ class DifyBot(Bot):
             return None
 
     # TODO: 异步返回events
-    def _handle_sse_response(self, response: requests.Response):
-        events = []
+    def _iter_sse_events(self, response: requests.Response):
+        """
+        逐个产出sse事件，不等待整个响应结束
+        """
         for line in response.iter_lines():
             if line:
                 decoded_line = line.decode('utf-8')
                 event = self._parse_sse_event(decoded_line)
                 if event:
-                    events.append(event)
+                    yield event
+
+    def _handle_sse_response(self, response: requests.Response):
+        return self._merge_sse_events(self._iter_sse_events(response))
 
+    def _merge_sse_events(self, events):
         merged_message = []
         accumulated_agent_message = ''
         conversation_id = None
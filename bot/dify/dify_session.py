@@ -1,4 +1,4 @@
-from common.expired_dict import ExpiredDict
+from common.session_store import create_session_store
 from config import conf
 
 
@@ -58,13 +58,23 @@ class DifySession(object):
         
         self._user_message_counter += 1
 
+    def dump(self) -> dict:
+        """
+        导出会话状态，用于持久化存储
+        """
+        state = dict(self.__dict__)
+        state.pop("_session_id", None)
+        return state
+
+    def load(self, state: dict):
+        """
+        从dump()导出的状态恢复会话
+        """
+        self.__dict__.update(state)
+
 class DifySessionManager(object):
     def __init__(self, sessioncls, **session_kwargs):
-        if conf().get("expires_in_seconds"):
-            sessions = ExpiredDict(conf().get("expires_in_seconds"))
-        else:
-            sessions = dict()
-        self.sessions = sessions
+        self.sessions = create_session_store(sessioncls.__name__, lambda session_id: sessioncls(session_id, ''))
         self.sessioncls = sessioncls
         self.session_kwargs = session_kwargs
 
@@ -75,15 +85,23 @@ class DifySessionManager(object):
         if session_id is None:
             return self.sessioncls(session_id, user)
 
-        if session_id not in self.sessions:
-            self.sessions[session_id] = self.sessioncls(session_id, user)
-        session = self.sessions[session_id]
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self.sessioncls(session_id, user)
+            self.sessions[session_id] = session
         return session
 
     def get_session(self, session_id, user):
         session = self._build_session(session_id, user)
         return session
 
+    def save_session(self, session: DifySession):
+        """
+        会话修改后写回存储，持久化存储时必须调用
+        """
+        if session.get_session_id() is not None:
+            self.sessions[session.get_session_id()] = session
+
     def clear_session(self, session_id):
         if session_id in self.sessions:
             del self.sessions[session_id]
@@ -0,0 +1,98 @@
+import time
+
+from common.log import logger
+
+# 句子结束符，遇到后即可把已收到的内容作为一条消息发出
+SENTENCE_ENDINGS = ("\n", "。", "！", "？", "；", "!", "?", ";")
+
+
+class DifyStreamSplitter(object):
+    """
+    增量处理dify agent/chatflow的sse事件，把已完整的段落或句子尽早切分出来发送，
+    不必等待整个agent运行结束。返回的消息格式与DifyBot._merge_sse_events一致
+    """
+
+    def __init__(self, min_chars=20, send_interval=1.0):
+        """
+        :param min_chars: 未遇到段落结束时，缓冲区至少积累的字符数才按句子切分，避免消息过碎
+        :param send_interval: 两次发送之间的最小间隔(秒)，期间到达的内容合并到下一条消息，避免触发channel的发送频率限制
+        """
+        self.min_chars = min_chars
+        self.send_interval = send_interval
+        self.buffer = ""
+        self.conversation_id = None
+        self.finished = False
+        self._last_send_time = 0
+
+    def feed(self, event: dict) -> list:
+        """
+        处理一个sse事件
+        :return: 可以立即发送的消息列表
+        """
+        event_name = event["event"]
+        msgs = []
+        if event_name == "agent_message" or event_name == "message":
+            self.buffer += event["answer"]
+            if not self.conversation_id:
+                self.conversation_id = event["conversation_id"]
+            segment = self._cut()
+            if segment:
+                msgs.append(self._agent_message(segment))
+        elif event_name == "agent_thought":
+            # 工具调用前后的内容分开发送，与非流式模式保持一致
+            self._flush(msgs)
+            logger.debug("[DIFY] agent_thought: {}".format(event))
+        elif event_name == "message_file":
+            self._flush(msgs)
+            if event.get("type") != "image":
+                logger.warning("[DIFY] unsupported message file type: {}".format(event))
+            msgs.append({"type": "message_file", "content": event})
+        elif event_name == "message_replace":
+            # TODO: handle message_replace
+            pass
+        elif event_name == "error":
+            logger.error("[DIFY] error: {}".format(event))
+            raise Exception(event)
+        elif event_name == "message_end":
+            self.finished = True
+            logger.debug("[DIFY] message_end usage: {}".format(event["metadata"]["usage"]))
+        else:
+            logger.warning("[DIFY] unknown event: {}".format(event))
+        return msgs
+
+    def finish(self) -> list:
+        """
+        流结束后返回缓冲区中剩余的内容
+        """
+        msgs = []
+        self._flush(msgs)
+        return msgs
+
+    def _cut(self):
+        now = time.time()
+        if now - self._last_send_time < self.send_interval:
+            return None
+        cut = self.buffer.rfind("\n\n") + 2
+        if cut < 2:
+            if len(self.buffer) < self.min_chars:
+                return None
+            cut = max(self.buffer.rfind(c) for c in SENTENCE_ENDINGS) + 1
+            if cut <= 0:
+                return None
+        segment = self.buffer[:cut].strip()
+        self.buffer = self.buffer[cut:]
+        if not segment:
+            return None
+        self._last_send_time = now
+        return segment
+
+    def _flush(self, msgs: list):
+        segment = self.buffer.strip()
+        self.buffer = ""
+        if segment:
+            self._last_send_time = time.time()
+            msgs.append(self._agent_message(segment))
+
+    @staticmethod
+    def _agent_message(content):
+        return {"type": "agent_message", "content": content}
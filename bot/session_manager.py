@@ -1,5 +1,5 @@
-from common.expired_dict import ExpiredDict
 from common.log import logger
+from common.session_store import create_session_store
 from config import conf
 
 
@@ -29,6 +29,20 @@ class Session(object):
         assistant_item = {"role": "assistant", "content": reply}
         self.messages.append(assistant_item)
 
+    def dump(self) -> dict:
+        """
+        导出会话状态，用于持久化存储
+        """
+        state = dict(self.__dict__)
+        state.pop("session_id", None)
+        return state
+
+    def load(self, state: dict):
+        """
+        从dump()导出的状态恢复会话
+        """
+        self.__dict__.update(state)
+
     def discard_exceeding(self, max_tokens=None, cur_tokens=None):
         raise NotImplementedError
 
@@ -38,11 +52,7 @@ class Session(object):
 
 class SessionManager(object):
     def __init__(self, sessioncls, **session_args):
-        if conf().get("expires_in_seconds"):
-            sessions = ExpiredDict(conf().get("expires_in_seconds"))
-        else:
-            sessions = dict()
-        self.sessions = sessions
+        self.sessions = create_session_store(sessioncls.__name__, lambda session_id: sessioncls(session_id, **session_args))
         self.sessioncls = sessioncls
         self.session_args = session_args
 
@@ -54,13 +64,22 @@ class SessionManager(object):
         if session_id is None:
             return self.sessioncls(session_id, system_prompt, **self.session_args)
 
-        if session_id not in self.sessions:
-            self.sessions[session_id] = self.sessioncls(session_id, system_prompt, **self.session_args)
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self.sessioncls(session_id, system_prompt, **self.session_args)
+            self.save_session(session)
         elif system_prompt is not None:  # 如果有新的system_prompt，更新并重置session
-            self.sessions[session_id].set_system_prompt(system_prompt)
-        session = self.sessions[session_id]
+            session.set_system_prompt(system_prompt)
+            self.save_session(session)
         return session
 
+    def save_session(self, session):
+        """
+        会话修改后写回存储，持久化存储时必须调用
+        """
+        if session.session_id is not None:
+            self.sessions[session.session_id] = session
+
     def session_query(self, query, session_id):
         session = self.build_session(session_id)
         session.add_query(query)
@@ -70,6 +89,7 @@ class SessionManager(object):
             logger.debug("prompt tokens used={}".format(total_tokens))
         except Exception as e:
             logger.warning("Exception when counting tokens precisely for prompt: {}".format(str(e)))
+        self.save_session(session)
         return session
 
     def session_reply(self, reply, session_id, total_tokens=None):
@@ -81,6 +101,7 @@ class SessionManager(object):
             logger.debug("raw total_tokens={}, savesession tokens={}".format(total_tokens, tokens_cnt))
         except Exception as e:
             logger.warning("Exception when counting tokens precisely for session: {}".format(str(e)))
+        self.save_session(session)
         return session
 
     def clear_session(self, session_id):
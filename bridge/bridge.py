@@ -1,18 +1,40 @@
+import asyncio
+import threading
+import weakref
+
+from bot.bot import AsyncBot
 from bot.bot_factory import create_bot
 from bridge.context import Context
 from bridge.reply import Reply
 from common import const
 from common.log import logger
 from common.singleton import singleton
-from config import conf
+from common.thread_pool import get_thread_pool
+from config import conf, record_config_reads
 from translate.factory import create_translator
+from voice.asr_pipeline import voice_to_text
 from voice.factory import create_voice
+from voice.tts_cache import text_to_voice
+
+# 这些配置项变化时会话存储需要重建，不能沿用旧bot的会话
+SESSION_STORE_KEYS = ("session_store", "session_store_path", "expires_in_seconds", "session_max_count")
 
 
 @singleton
 class Bridge(object):
     def __init__(self):
-        self.btype = {
+        self.btype = self._route()
+        self.bots = {}
+        self.chat_bots = {}
+        self.bot_deps = weakref.WeakKeyDictionary()  # bot -> 创建时读取的配置项(ConfigDeps)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _route() -> dict:
+        """
+        根据当前配置计算各类能力使用的bot类型
+        """
+        btype = {
             "chat": const.CHATGPT,
             "voice_to_text": conf().get("voice_to_text", "openai"),
             "text_to_voice": conf().get("text_to_voice", "google"),
@@ -22,69 +44,80 @@ class Bridge(object):
         # 这边取配置的模型
         bot_type = conf().get("bot_type")
         if bot_type:
-            self.btype["chat"] = bot_type
+            btype["chat"] = bot_type
         else:
             model_type = conf().get("model") or const.GPT35
             if model_type in ["text-davinci-003"]:
-                self.btype["chat"] = const.OPEN_AI
+                btype["chat"] = const.OPEN_AI
             if conf().get("use_azure_chatgpt", False):
-                self.btype["chat"] = const.CHATGPTONAZURE
+                btype["chat"] = const.CHATGPTONAZURE
             if model_type in ["wenxin", "wenxin-4"]:
-                self.btype["chat"] = const.BAIDU
+                btype["chat"] = const.BAIDU
             if model_type in ["xunfei"]:
-                self.btype["chat"] = const.XUNFEI
+                btype["chat"] = const.XUNFEI
             if model_type in [const.QWEN]:
-                self.btype["chat"] = const.QWEN
+                btype["chat"] = const.QWEN
             if model_type in [const.QWEN_TURBO, const.QWEN_PLUS, const.QWEN_MAX]:
-                self.btype["chat"] = const.QWEN_DASHSCOPE
+                btype["chat"] = const.QWEN_DASHSCOPE
             if model_type and model_type.startswith("gemini"):
-                self.btype["chat"] = const.GEMINI
+                btype["chat"] = const.GEMINI
             if model_type in [const.DIFY]:
-                self.btype["chat"] = const.DIFY
+                btype["chat"] = const.DIFY
             if model_type and model_type.startswith("glm"):
-                self.btype["chat"] = const.ZHIPU_AI
+                btype["chat"] = const.ZHIPU_AI
             if model_type in [const.COZE]:
-                self.btype["chat"] = const.COZE
+                btype["chat"] = const.COZE
             if model_type and model_type.startswith("claude-3"):
-                self.btype["chat"] = const.CLAUDEAPI
+                btype["chat"] = const.CLAUDEAPI
             if model_type and model_type.startswith("deepseek-"):
-                self.btype["chat"] = const.DEEPSEEK
+                btype["chat"] = const.DEEPSEEK
 
             if model_type in ["claude"]:
-                self.btype["chat"] = const.CLAUDEAI
+                btype["chat"] = const.CLAUDEAI
 
             if model_type in [const.MOONSHOT, "moonshot-v1-8k", "moonshot-v1-32k", "moonshot-v1-128k"]:
-                self.btype["chat"] = const.MOONSHOT
+                btype["chat"] = const.MOONSHOT
 
             if model_type in [const.MODELSCOPE]:
-                self.btype["chat"] = const.MODELSCOPE
+                btype["chat"] = const.MODELSCOPE
             
             if model_type in ["abab6.5-chat"]:
-                self.btype["chat"] = const.MiniMax
+                btype["chat"] = const.MiniMax
             
             if conf().get("use_linkai") and conf().get("linkai_api_key"):
-                self.btype["chat"] = const.LINKAI
+                btype["chat"] = const.LINKAI
                 if not conf().get("voice_to_text") or conf().get("voice_to_text") in ["openai"]:
-                    self.btype["voice_to_text"] = const.LINKAI
+                    btype["voice_to_text"] = const.LINKAI
                 if not conf().get("text_to_voice") or conf().get("text_to_voice") in ["openai", const.TTS_1, const.TTS_1_HD]:
-                    self.btype["text_to_voice"] = const.LINKAI
+                    btype["text_to_voice"] = const.LINKAI
 
-        self.bots = {}
-        self.chat_bots = {}
+        return btype
 
     # 模型对应的接口
     def get_bot(self, typename):
-        if self.bots.get(typename) is None:
-            logger.info("create bot {} for {}".format(self.btype[typename], typename))
-            if typename == "text_to_voice":
-                self.bots[typename] = create_voice(self.btype[typename])
-            elif typename == "voice_to_text":
-                self.bots[typename] = create_voice(self.btype[typename])
-            elif typename == "chat":
-                self.bots[typename] = create_bot(self.btype[typename])
+        bot = self.bots.get(typename)
+        if bot is None:
+            with self._lock:
+                bot = self.bots.get(typename)
+                if bot is None:
+                    logger.info("create bot {} for {}".format(self.btype[typename], typename))
+                    bot = self._create_bot(typename, self.btype[typename])
+                    self.bots = {**self.bots, typename: bot}
+        return bot
+
+    def _create_bot(self, typename, bot_type):
+        """
+        创建bot并记录创建时读取的配置项
+        """
+        with record_config_reads() as deps:
+            if typename in ("text_to_voice", "voice_to_text"):
+                bot = create_voice(bot_type)
             elif typename == "translate":
-                self.bots[typename] = create_translator(self.btype[typename])
-        return self.bots[typename]
+                bot = create_translator(bot_type)
+            else:
+                bot = create_bot(bot_type)
+        self.bot_deps[bot] = deps
+        return bot
 
     def get_bot_type(self, typename):
         return self.btype[typename]
@@ -92,22 +125,90 @@ class Bridge(object):
     def fetch_reply_content(self, query, context: Context) -> Reply:
         return self.get_bot("chat").reply(query, context)
 
+    async def afetch_reply_content(self, query, context: Context) -> Reply:
+        bot = self.get_bot("chat")
+        if isinstance(bot, AsyncBot):
+            return await bot.areply(query, context)
+        # 没有异步实现的bot回退到线程池中执行
+        return await asyncio.get_running_loop().run_in_executor(get_thread_pool("chat"), bot.reply, query, context)
+
     def fetch_voice_to_text(self, voiceFile) -> Reply:
-        return self.get_bot("voice_to_text").voiceToText(voiceFile)
+        return voice_to_text(self.get_bot("voice_to_text"), voiceFile)
 
     def fetch_text_to_voice(self, text) -> Reply:
-        return self.get_bot("text_to_voice").textToVoice(text)
+        return text_to_voice(self.get_bot("text_to_voice"), text)
 
     def fetch_translate(self, text, from_lang="", to_lang="en") -> Reply:
         return self.get_bot("translate").translate(text, from_lang, to_lang)
 
     def find_chat_bot(self, bot_type: str):
-        if self.chat_bots.get(bot_type) is None:
-            self.chat_bots[bot_type] = create_bot(bot_type)
-        return self.chat_bots.get(bot_type)
+        bot = self.chat_bots.get(bot_type)
+        if bot is None:
+            with self._lock:
+                bot = self.chat_bots.get(bot_type)
+                if bot is None:
+                    bot = self._create_bot("chat", bot_type)
+                    self.chat_bots = {**self.chat_bots, bot_type: bot}
+        return bot
 
-    def reset_bot(self):
+    def reset_bot(self) -> list:
         """
-        重置bot路由
+        配置变更后刷新bot路由：只重建类型或创建时读取的配置项发生变化的bot，并沿用旧bot的会话，
+        其余bot(及其会话和连接)保持不变。新bot创建完成后整体替换，处理中的消息不受影响
+        :return: 重建的bot列表
         """
-        self.__init__()
+        with self._lock:
+            old_btype, self.btype = self.btype, self._route()
+            bots, chat_bots, rebuilt = {}, {}, []
+            for typename, bot in self.bots.items():
+                new_bot = self._refresh_bot(typename, self.btype[typename], bot, old_btype[typename] != self.btype[typename])
+                if new_bot is not bot:
+                    rebuilt.append(typename)
+                if new_bot is not None:
+                    bots[typename] = new_bot
+            for bot_type, bot in self.chat_bots.items():
+                new_bot = self._refresh_bot("chat", bot_type, bot)
+                if new_bot is not bot:
+                    rebuilt.append(bot_type)
+                if new_bot is not None:
+                    chat_bots[bot_type] = new_bot
+            self.bots, self.chat_bots = bots, chat_bots
+        return rebuilt
+
+    def _refresh_bot(self, typename, bot_type, bot, retyped=False):
+        """
+        :param retyped: bot类型是否发生变化
+        :return: 配置未变化时返回原bot，否则返回新建的bot，新建失败时返回None(下次使用时再创建)
+        """
+        deps = self.bot_deps.get(bot)
+        changed = deps.changed() if deps is not None else []
+        if not retyped and not changed:
+            return bot
+        logger.info("[Bridge] rebuild bot {} for {}, changed config: {}".format(bot_type, typename, changed))
+        self.bot_deps.pop(bot, None)
+        try:
+            new_bot = self._create_bot(typename, bot_type)
+        except Exception as e:
+            logger.exception("[Bridge] rebuild bot {} failed: {}".format(bot_type, e))
+            return None
+        if not set(changed) & set(SESSION_STORE_KEYS):
+            _inherit_sessions(new_bot, bot)
+        return new_bot
+
+
+def _inherit_sessions(bot, old_bot):
+    """
+    新bot沿用旧bot的会话存储，会话类型不同(如切换了bot类型)时不沿用
+    SessionManager、DifySessionManager、CozeSessionManager都通过sessions属性持有会话存储
+    """
+    old_manager = getattr(old_bot, "sessions", None)
+    manager = getattr(bot, "sessions", None)
+    if old_manager is None or manager is None or type(old_manager) is not type(manager):
+        return
+    if getattr(old_manager, "sessioncls", None) is not getattr(manager, "sessioncls", None):
+        return
+    if hasattr(old_manager, "sessions") and hasattr(manager, "sessions"):
+        # 新bot创建时也建了一份会话存储，sqlite存储持有连接和写入线程，替换后关闭
+        store, manager.sessions = manager.sessions, old_manager.sessions
+        if store is not manager.sessions:
+            store.close()
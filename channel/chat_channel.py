@@ -1,23 +1,23 @@
+import asyncio
 import os
-import re
 import threading
 import time
-from asyncio import CancelledError
-from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import CancelledError, Future
+from queue import Queue
 
+from bot.bot import AsyncBot
+from bridge.bridge import Bridge
 from bridge.context import *
 from bridge.reply import *
 from channel.channel import Channel
-from common.dequeue import Dequeue
+from channel.trigger_index import at_pattern, get_trigger_index
 from common import memory
+from common.async_loop import AsyncLoop
+from common.dequeue import Dequeue
+from common.thread_pool import get_thread_pool
+from config import config_snapshot
 from plugins import *
-
-try:
-    from voice.audio_convert import any_to_wav
-except Exception as e:
-    pass
-
-handler_pool = ThreadPoolExecutor(max_workers=8)  # 处理消息的线程池
+from voice.tts_pipeline import plan_segments, synthesize_segments
 
 
 # 抽象类, 它包含了与消息通道无关的通用处理逻辑
@@ -27,8 +27,11 @@ class ChatChannel(Channel):
     futures = {}  # 记录每个session_id提交到线程池的future对象, 用于重置会话时把没执行的future取消掉，正在执行的不会被取消
     sessions = {}  # 用于控制并发，每个session_id同时只能有一个context在处理
     lock = threading.Lock()  # 用于控制对sessions的访问
+    ready_sessions = Queue()  # 有新消息入队或有任务结束的session_id，通知消费者线程立即调度
 
     def __init__(self):
+        # 排队消息统计：queued当前排队数，shed因队列满被丢弃数，expired排队过久被丢弃数，merged被合并数
+        self.queue_stats = {"queued": 0, "shed": 0, "expired": 0, "merged": 0}
         _thread = threading.Thread(target=self.consume)
         _thread.setDaemon(True)
         _thread.start()
@@ -47,8 +50,8 @@ class ChatChannel(Channel):
         # context首次传入时，receiver是None，根据类型设置receiver
         first_in = "receiver" not in context
         # 群名匹配过程，设置session_id和receiver
+        triggers = get_trigger_index()
         if first_in:  # context首次传入时，receiver是None，根据类型设置receiver
-            config = conf()
             cmsg = context["msg"]
             user_data = conf().get_user_data(cmsg.from_user_id)
             context["openai_api_key"] = user_data.get("openai_api_key")
@@ -58,24 +61,10 @@ class ChatChannel(Channel):
                 group_id = cmsg.other_user_id
                 context["group_name"] = group_name
 
-                group_name_white_list = config.get("group_name_white_list", [])
-                group_name_keyword_white_list = config.get("group_name_keyword_white_list", [])
-                if any(
-                        [
-                            group_name in group_name_white_list,
-                            "ALL_GROUP" in group_name_white_list,
-                            check_contain(group_name, group_name_keyword_white_list),
-                        ]
-                ):
-                    group_chat_in_one_session = conf().get("group_chat_in_one_session", [])
+                if triggers.is_group_allowed(group_name):
                     session_id = f"{cmsg.actual_user_id}@@{group_id}" # 当群聊未共享session时，session_id为user_id与group_id的组合，用于区分不同群聊以及单聊
                     context["is_shared_session_group"] = False  # 默认为非共享会话群
-                    if any(
-                            [
-                                group_name in group_chat_in_one_session,
-                                "ALL_GROUP" in group_chat_in_one_session,
-                            ]
-                    ):
+                    if triggers.is_shared_session_group(group_name):
                         session_id = group_id
                         context["is_shared_session_group"] = True  # 如果是共享会话群，设置为True
                 else:
@@ -90,20 +79,20 @@ class ChatChannel(Channel):
             context = e_context["context"]
             if e_context.is_pass() or context is None:
                 return context
-            if cmsg.from_user_id == self.user_id and not config.get("trigger_by_self", True):
+            if cmsg.from_user_id == self.user_id and not triggers.trigger_by_self:
                 logger.debug("[chat_channel]self message skipped")
                 return None
 
         # 消息内容匹配过程，并处理content
         if ctype == ContextType.TEXT:
-            nick_name_black_list = conf().get("nick_name_black_list", [])
+            nick_name_black_list = triggers.nick_name_black_list
             if context.get("isgroup", False):  # 群聊
                 # 校验关键字
-                match_prefix = check_prefix(content, conf().get("group_chat_prefix"))
-                match_contain = check_contain(content, conf().get("group_chat_keyword"))
+                match_prefix = triggers.group_chat_prefix.match(content)
+                match_contain = triggers.group_chat_keyword.match(content)
                 flag = False
                 if context["msg"].to_user_id != context["msg"].actual_user_id:
-                    if match_prefix is not None or match_contain is not None:
+                    if match_prefix is not None or match_contain:
                         flag = True
                         if match_prefix:
                             content = content.replace(match_prefix, "", 1).strip()
@@ -115,19 +104,16 @@ class ChatChannel(Channel):
                             return None
 
                         logger.info("[chat_channel]receive group at")
-                        if not conf().get("group_at_off", False):
+                        if not triggers.group_at_off:
                             flag = True
                         self.name = self.name if self.name is not None else ""  # 部分渠道self.name可能没有赋值
-                        pattern = f"@{re.escape(self.name)}(\u2005|\u0020)"
-                        subtract_res = re.sub(pattern, r"", content)
+                        subtract_res = at_pattern(self.name).sub(r"", content)
                         if isinstance(context["msg"].at_list, list):
                             for at in context["msg"].at_list:
-                                pattern = f"@{re.escape(at)}(\u2005|\u0020)"
-                                subtract_res = re.sub(pattern, r"", subtract_res)
+                                subtract_res = at_pattern(at).sub(r"", subtract_res)
                         if subtract_res == content and context["msg"].self_display_name:
                             # 前缀移除后没有变化，使用群昵称再次移除
-                            pattern = f"@{re.escape(context['msg'].self_display_name)}(\u2005|\u0020)"
-                            subtract_res = re.sub(pattern, r"", content)
+                            subtract_res = at_pattern(context["msg"].self_display_name).sub(r"", content)
                         content = subtract_res
                 if not flag:
                     if context["origin_ctype"] == ContextType.VOICE:
@@ -140,7 +126,7 @@ class ChatChannel(Channel):
                     logger.warning(f"[chat_channel] Nickname '{nick_name}' in In BlackList, ignore")
                     return None
 
-                match_prefix = check_prefix(content, conf().get("single_chat_prefix", [""]))
+                match_prefix = triggers.single_chat_prefix.match(content)
                 if match_prefix is not None:  # 判断如果匹配到自定义前缀，则返回过滤掉前缀+空格后的内容
                     content = content.replace(match_prefix, "", 1).strip()
                 elif self.channel_type == 'wechatcom_app':
@@ -151,19 +137,17 @@ class ChatChannel(Channel):
                 else:
                     return None
             content = content.strip()
-            img_match_prefix = check_prefix(content, conf().get("image_create_prefix",[""]))
+            img_match_prefix = triggers.image_create_prefix.match(content)
             if img_match_prefix:
                 content = content.replace(img_match_prefix, "", 1)
                 context.type = ContextType.IMAGE_CREATE
             else:
                 context.type = ContextType.TEXT
             context.content = content.strip()
-            if "desire_rtype" not in context and conf().get(
-                    "always_reply_voice") and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
+            if "desire_rtype" not in context and triggers.always_reply_voice and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
                 context["desire_rtype"] = ReplyType.VOICE
         elif context.type == ContextType.VOICE:
-            if "desire_rtype" not in context and conf().get(
-                    "voice_reply_voice") and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
+            if "desire_rtype" not in context and triggers.voice_reply_voice and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
                 context["desire_rtype"] = ReplyType.VOICE
         return context
 
@@ -183,13 +167,36 @@ class ChatChannel(Channel):
             # reply的发送步骤
             self._send_reply(context, reply)
 
-    def _generate_reply(self, context: Context, reply: Reply = Reply()) -> Reply:
-        e_context = PluginManager().emit_event(
+    # 异步模式下的消息处理，事件循环只等待bot的网络请求，插件、装饰和发送等同步逻辑放到线程池执行
+    async def _ahandle(self, context: Context):
+        if context is None or not context.content:
+            return
+        logger.debug("[chat_channel] ready to handle context in async mode: {}".format(context))
+        loop = asyncio.get_running_loop()
+        pool = get_thread_pool("chat")
+        e_context = await loop.run_in_executor(pool, self._emit_handle_context, context, Reply())
+        reply = e_context["reply"]
+        if not e_context.is_pass():
+            if context.type == ContextType.TEXT or context.type == ContextType.IMAGE_CREATE:
+                context["channel"] = e_context["channel"]
+                reply = await super().abuild_reply_content(context.content, context)
+            else:
+                logger.warning("[chat_channel] context type changed to {} by plugin, ignore in async mode".format(context.type))
+                return
+        if reply and reply.content:
+            reply = await loop.run_in_executor(pool, self._decorate_reply, context, reply)
+            await loop.run_in_executor(pool, self._send_reply, context, reply)
+
+    def _emit_handle_context(self, context: Context, reply: Reply):
+        return PluginManager().emit_event(
             EventContext(
                 Event.ON_HANDLE_CONTEXT,
                 {"channel": self, "context": context, "reply": reply},
             )
         )
+
+    def _generate_reply(self, context: Context, reply: Reply = Reply()) -> Reply:
+        e_context = self._emit_handle_context(context, reply)
         reply = e_context["reply"]
         if not e_context.is_pass():
             logger.debug("[chat_channel] ready to handle context: type={}, content={}".format(context.type, context.content))
@@ -200,19 +207,11 @@ class ChatChannel(Channel):
                 cmsg = context["msg"]
                 cmsg.prepare()
                 file_path = context.content
-                wav_path = os.path.splitext(file_path)[0] + ".wav"
-                try:
-                    any_to_wav(file_path, wav_path)
-                except Exception as e:  # 转换失败，直接使用mp3，对于某些api，mp3也可以识别
-                    logger.warning("[chat_channel]any to wav error, use raw path. " + str(e))
-                    wav_path = file_path
-                # 语音识别
-                reply = super().build_voice_to_text(wav_path)
+                # 语音识别，各语音服务在内存中转换为所需的格式，不再生成中间的wav文件
+                reply = super().build_voice_to_text(file_path)
                 # 删除临时文件
                 try:
                     os.remove(file_path)
-                    if wav_path != file_path:
-                        os.remove(wav_path)
                 except Exception as e:
                     pass
                     # logger.warning("[chat_channel]delete temp file error: " + str(e))
@@ -224,6 +223,8 @@ class ChatChannel(Channel):
                     else:
                         return
             elif context.type == ContextType.IMAGE:  # 图片消息，当前仅做下载保存到本地的逻辑
+                if context.get("msg"):
+                    context["msg"].prepare()  # 在图片下载线程池中提前下载，避免占用对话线程
                 memory.USER_IMAGE_CACHE[context["session_id"]] = {
                     "path": context.content,
                     "msg": context.get("msg")
@@ -258,16 +259,17 @@ class ChatChannel(Channel):
                 if reply.type == ReplyType.TEXT:
                     reply_text = reply.content
                     if desire_rtype == ReplyType.VOICE and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
+                        if config_snapshot().voice_reply_pipeline and self._send_voice_segments(context, reply.content):
+                            return None
                         reply = super().build_text_to_voice(reply.content)
                         return self._decorate_reply(context, reply)
+                    cfg = config_snapshot()
                     if context.get("isgroup", False):
-                        if not conf().get("no_need_at", False):
+                        if not cfg.no_need_at:
                             reply_text = "@" + context["msg"].actual_user_nickname + "\n" + reply_text.strip()
-                        reply_text = conf().get("group_chat_reply_prefix", "") + reply_text + conf().get(
-                            "group_chat_reply_suffix", "")
+                        reply_text = cfg.get("group_chat_reply_prefix", "") + reply_text + cfg.get("group_chat_reply_suffix", "")
                     else:
-                        reply_text = conf().get("single_chat_reply_prefix", "") + reply_text + conf().get(
-                            "single_chat_reply_suffix", "")
+                        reply_text = cfg.get("single_chat_reply_prefix", "") + reply_text + cfg.get("single_chat_reply_suffix", "")
                     reply.content = reply_text
                 elif reply.type == ReplyType.ERROR or reply.type == ReplyType.INFO:
                     reply.content = "[" + str(reply.type) + "]\n" + reply.content
@@ -282,6 +284,24 @@ class ChatChannel(Channel):
                 logger.warning("[chat_channel] desire_rtype: {}, but reply type: {}".format(context.get("desire_rtype"), reply.type))
             return reply
 
+    # 长回复按句切分并发合成，按顺序逐段发送语音，只有一段时返回False由调用方整体合成
+    def _send_voice_segments(self, context: Context, text) -> bool:
+        segments = plan_segments(text, self.VOICE_MAX_DURATION)
+        if len(segments) < 2:
+            return False
+        logger.debug("[chat_channel] synthesize voice reply in {} segments".format(len(segments)))
+        error = None
+        sent = False
+        for reply in synthesize_segments(super().build_text_to_voice, segments):
+            if reply and reply.type == ReplyType.VOICE:
+                self._send_reply(context, self._decorate_reply(context, reply))
+                sent = True
+            else:
+                error = error or reply
+        if not sent:
+            self._send_reply(context, self._decorate_reply(context, error or Reply(ReplyType.ERROR, "抱歉，语音合成失败")))
+        return True
+
     def _send_reply(self, context: Context, reply: Reply):
         if reply and reply.type:
             e_context = PluginManager().emit_event(
@@ -339,71 +359,181 @@ class ChatChannel(Channel):
                 logger.exception("Worker raise exception: {}".format(e))
             with self.lock:
                 self.sessions[session_id][1].release()
+            self.ready_sessions.put(session_id)  # 释放了信号量，通知消费者调度该session的下一条消息
 
         return func
 
     def produce(self, context: Context):
         session_id = context.get("session_id", 0)
+        context["enqueue_time"] = time.monotonic()
         with self.lock:
             if session_id not in self.sessions:
                 self.sessions[session_id] = [
                     Dequeue(),
-                    threading.BoundedSemaphore(conf().get("concurrency_in_session", 4)),
+                    threading.BoundedSemaphore(config_snapshot().get("concurrency_in_session", 4)),
                 ]
-            if context.type == ContextType.TEXT and context.content.startswith("#"):
-                self.sessions[session_id][0].putleft(context)  # 优先处理管理命令
-            else:
-                self.sessions[session_id][0].put(context)
+            context_queue = self.sessions[session_id][0]
+            if _is_admin_command(context):
+                context_queue.putleft(context)  # 优先处理管理命令，不受队列长度限制
+                self.queue_stats["queued"] += 1
+            elif not self._enqueue(session_id, context_queue, context):
+                return
+        self.ready_sessions.put(session_id)
+
+    # 按队列上限和丢弃策略入队，需持有self.lock，返回是否有新消息入队
+    def _enqueue(self, session_id, context_queue: Dequeue, context: Context):
+        cfg = config_snapshot()
+        global_max_size = cfg.get("global_queue_max_size", 0)
+        if global_max_size and self.queue_stats["queued"] >= global_max_size:
+            self._shed(session_id, context, "global queue full")
+            return False
+        max_size = cfg.get("session_queue_max_size", 0)
+        if max_size and context_queue.qsize() >= max_size:
+            policy = cfg.get("session_queue_drop_policy", "oldest")
+            if policy == "merge" and self._merge_last(context_queue, context):
+                self.queue_stats["merged"] += 1
+                return False
+            if policy == "newest":
+                self._shed(session_id, context, "session queue full")
+                return False
+            # 丢弃最早的普通消息，插队的管理命令不受队列长度限制，不会被丢弃
+            oldest = context_queue.remove_first(lambda c: not _is_admin_command(c))
+            if oldest is None:
+                self._shed(session_id, context, "session queue full")
+                return False
+            self.queue_stats["queued"] -= 1
+            self._shed(session_id, oldest, "session queue full")
+        context_queue.put(context)
+        self.queue_stats["queued"] += 1
+        return True
+
+    # 同一用户连续发送的文本消息合并到队尾的消息中
+    def _merge_last(self, context_queue: Dequeue, context: Context):
+        last = context_queue.peek_last()
+        if last is None or last.type != ContextType.TEXT or context.type != ContextType.TEXT or _is_admin_command(last):
+            return False
+        if _sender_id(last) != _sender_id(context):
+            return False
+        last.content = last.content + "\n" + context.content
+        return True
+
+    def _shed(self, session_id, context: Context, reason):
+        self.queue_stats["shed"] += 1
+        logger.warning("[chat_channel] drop message, reason={}, session_id={}, content={}".format(reason, session_id, context.content))
+
+    # 排队超过message_expire_seconds的消息不再处理
+    def _is_expired(self, context: Context):
+        expire_seconds = config_snapshot().get("message_expire_seconds", 0)
+        if not expire_seconds or "enqueue_time" not in context:
+            return False
+        return time.monotonic() - context["enqueue_time"] > expire_seconds
+
+    def queue_metrics(self) -> dict:
+        with self.lock:
+            return dict(self.queue_stats, sessions=len(self.sessions))
 
-    # 消费者函数，单独线程，用于从消息队列中取出消息并处理
+    # 消费者函数，单独线程，阻塞等待就绪的session_id，只调度有事件发生的session
     def consume(self):
         while True:
+            session_id = self.ready_sessions.get()
+            try:
+                self._dispatch(session_id)
+            except Exception as e:
+                logger.exception("[chat_channel] dispatch session {} error: {}".format(session_id, e))
+
+    # 开启异步模式且bot支持协程时，文本消息作为任务在共享事件循环中执行
+    def _use_async(self, context: Context):
+        if not config_snapshot().get("async_pipeline", False):
+            return False
+        if context.type not in [ContextType.TEXT, ContextType.IMAGE_CREATE] or context.get("desire_rtype") == ReplyType.VOICE:
+            return False
+        return isinstance(Bridge().get_bot("chat"), AsyncBot)
+
+    # 按消息类型选择隔离的线程池，避免语音、图片等慢任务占满对话线程
+    def _select_pool(self, context: Context):
+        if context.type == ContextType.VOICE:
+            return "voice_to_text"
+        if context.type == ContextType.IMAGE:
+            return "image_download"
+        if context.get("desire_rtype") == ReplyType.VOICE:
+            return "text_to_voice"
+        return "chat"
+
+    # 尽可能多地为session_id提交任务，直到信号量耗尽或队列为空；队列为空且没有任务在执行时删除该session
+    def _dispatch(self, session_id):
+        with self.lock:
+            if session_id not in self.sessions:
+                return
+            semaphore = self.sessions[session_id][1]
+        while semaphore.acquire(blocking=False):
             with self.lock:
-                session_ids = list(self.sessions.keys())
-            for session_id in session_ids:
-                with self.lock:
-                    context_queue, semaphore = self.sessions[session_id]
-                if semaphore.acquire(blocking=False):  # 等线程处理完毕才能删除
-                    if not context_queue.empty():
-                        context = context_queue.get()
-                        logger.debug("[chat_channel] consume context: {}".format(context))
-                        future: Future = handler_pool.submit(self._handle, context)
-                        future.add_done_callback(self._thread_pool_callback(session_id, context=context))
-                        with self.lock:
-                            if session_id not in self.futures:
-                                self.futures[session_id] = []
-                            self.futures[session_id].append(future)
-                    elif semaphore._initial_value == semaphore._value + 1:  # 除了当前，没有任务再申请到信号量，说明所有任务都处理完毕
-                        with self.lock:
-                            self.futures[session_id] = [t for t in self.futures[session_id] if not t.done()]
-                            assert len(self.futures[session_id]) == 0, "thread pool error"
-                            del self.sessions[session_id]
+                if session_id not in self.sessions:
+                    semaphore.release()
+                    return
+                context_queue = self.sessions[session_id][0]  # cancel_session会替换队列，每次重新获取
+                context = None
+                while not context_queue.empty():
+                    context = context_queue.get()
+                    self.queue_stats["queued"] -= 1
+                    if not self._is_expired(context):
+                        break
+                    self.queue_stats["expired"] += 1
+                    logger.warning("[chat_channel] drop expired message, session_id={}, content={}".format(session_id, context.content))
+                    context = None
+                if context is None:
+                    if semaphore._initial_value == semaphore._value + 1:  # 除了当前，没有任务再申请到信号量，说明所有任务都处理完毕
+                        self.futures[session_id] = [t for t in self.futures.get(session_id, []) if not t.done()]
+                        assert len(self.futures[session_id]) == 0, "thread pool error"
+                        del self.sessions[session_id]
                     else:
                         semaphore.release()
-            time.sleep(0.2)
+                    return
+            logger.debug("[chat_channel] consume context: {}".format(context))
+            if self._use_async(context):
+                future: Future = AsyncLoop().submit(self._ahandle(context))
+            else:
+                future: Future = get_thread_pool(self._select_pool(context)).submit(self._handle, context)
+            with self.lock:
+                if session_id not in self.futures:
+                    self.futures[session_id] = []
+                self.futures[session_id].append(future)
+            future.add_done_callback(self._thread_pool_callback(session_id, context=context))
 
     # 取消session_id对应的所有任务，只能取消排队的消息和已提交线程池但未执行的任务
     def cancel_session(self, session_id):
         with self.lock:
             if session_id in self.sessions:
-                for future in self.futures[session_id]:
+                for future in self.futures.get(session_id, []):
                     future.cancel()
                 cnt = self.sessions[session_id][0].qsize()
                 if cnt > 0:
                     logger.info("Cancel {} messages in session {}".format(cnt, session_id))
+                self.queue_stats["queued"] -= cnt
                 self.sessions[session_id][0] = Dequeue()
 
     def cancel_all_session(self):
         with self.lock:
             for session_id in self.sessions:
-                for future in self.futures[session_id]:
+                for future in self.futures.get(session_id, []):
                     future.cancel()
                 cnt = self.sessions[session_id][0].qsize()
                 if cnt > 0:
                     logger.info("Cancel {} messages in session {}".format(cnt, session_id))
+                self.queue_stats["queued"] -= cnt
                 self.sessions[session_id][0] = Dequeue()
 
 
+def _is_admin_command(context: Context):
+    return context.type == ContextType.TEXT and context.content.startswith("#")
+
+
+def _sender_id(context: Context):
+    msg = context.get("msg")
+    if msg is None:
+        return None
+    return msg.actual_user_id if context.get("isgroup", False) else msg.from_user_id
+
+
 def check_prefix(content, prefix_list):
     if not prefix_list:
         return None
@@ -16,7 +16,7 @@ from bridge.reply import Reply, ReplyType
 from common.log import logger
 from common.singleton import singleton
 from config import conf
-from common.expired_dict import ExpiredDict
+from common.ttl_cache import TTLCache
 from bridge.context import ContextType
 from channel.chat_channel import ChatChannel, check_prefix
 from common import utils
@@ -35,7 +35,7 @@ class FeiShuChanel(ChatChannel):
     def __init__(self):
         super().__init__()
         # 历史消息id暂存，用于幂等控制
-        self.receivedMsgs = ExpiredDict(60 * 60 * 7.1)
+        self.receivedMsgs = TTLCache(60 * 60 * 7.1)
         logger.info("[FeiShu] app_id={}, app_secret={} verification_token={}".format(
             self.feishu_app_id, self.feishu_app_secret, self.feishu_token))
         # 无需群校验和前缀
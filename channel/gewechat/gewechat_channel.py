@@ -13,7 +13,7 @@ from common.singleton import singleton
 from common.tmp_dir import TmpDir
 from config import conf, save_config
 from lib.gewechat import GewechatClient
-from voice.audio_convert import mp3_to_silk
+from voice.tts_cache import voice_to_silk
 import uuid
 
 MAX_UTF8_LEN = 2048
@@ -120,7 +120,7 @@ class GeWeChatChannel(ChatChannel):
                 if content.endswith('.mp3'):
                     # 如果是mp3文件，转换为silk格式
                     silk_path = content + '.silk'
-                    duration = mp3_to_silk(content, silk_path)
+                    duration = voice_to_silk(content, silk_path)
                     callback_url = conf().get("gewechat_callback_url")
                     silk_url = callback_url + "?file=" + silk_path
                     self.client.post_voice(self.app_id, receiver, silk_url, duration)
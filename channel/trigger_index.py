@@ -0,0 +1,133 @@
+import functools
+import re
+import threading
+
+from common.aho_corasick import AhoCorasick
+from config import config_snapshot, record_config_reads, register_derived
+
+# 关键词少于该数量时逐个查找更快(str.find为C实现)，超过后使用AC自动机
+AUTOMATON_THRESHOLD = 16
+
+
+class KeywordMatcher(object):
+    """
+    判断文本是否包含任一关键词
+    """
+
+    def __init__(self, keywords):
+        keywords = [k for k in (keywords or []) if isinstance(k, str)]
+        self.empty = not keywords
+        self.has_blank = "" in keywords  # 空关键词匹配任意文本，与check_contain保持一致
+        keywords = tuple(dict.fromkeys(k for k in keywords if k))
+        self._automaton = AhoCorasick(keywords) if len(keywords) >= AUTOMATON_THRESHOLD else None
+        self._keywords = keywords
+
+    def match(self, content) -> bool:
+        if self.empty:
+            return False
+        if self.has_blank:
+            return True
+        if self._automaton is not None:
+            return self._automaton.search(content) is not None
+        for keyword in self._keywords:
+            if keyword in content:
+                return True
+        return False
+
+
+class PrefixMatcher(object):
+    """
+    前缀树，返回文本匹配到的前缀，多个前缀匹配时按配置中的顺序返回第一个，与check_prefix保持一致
+    """
+
+    def __init__(self, prefixes):
+        self._root = {}
+        self.empty = not prefixes
+        for index, prefix in enumerate(prefixes or []):
+            node = self._root
+            for ch in prefix:
+                node = node.setdefault(ch, {})
+            node.setdefault(None, (index, prefix))  # None键存放在此结束的前缀，重复时保留第一个
+
+    def match(self, content):
+        """
+        :return: 匹配到的前缀，没有匹配时返回None
+        """
+        if self.empty:
+            return None
+        node = self._root
+        best = node.get(None)
+        for ch in content:
+            node = node.get(ch)
+            if node is None:
+                break
+            found = node.get(None)
+            if found and (best is None or found[0] < best[0]):
+                best = found
+        return best[1] if best else None
+
+
+class TriggerIndex(object):
+    """
+    由配置编译出的消息触发索引，配置变化后重新编译，避免每条消息都遍历各种名单和前缀
+    """
+
+    def __init__(self, config):
+        group_name_white_list = config.get("group_name_white_list", []) or []
+        self.group_names = frozenset(group_name_white_list)
+        self.all_group = "ALL_GROUP" in self.group_names
+        self.group_name_keywords = KeywordMatcher(config.get("group_name_keyword_white_list", []))
+        group_chat_in_one_session = config.get("group_chat_in_one_session", []) or []
+        self.shared_session_groups = frozenset(group_chat_in_one_session)
+        self.all_group_shared = "ALL_GROUP" in self.shared_session_groups
+        self.group_chat_prefix = PrefixMatcher(config.get("group_chat_prefix"))
+        self.group_chat_keyword = KeywordMatcher(config.get("group_chat_keyword"))
+        self.single_chat_prefix = PrefixMatcher(config.get("single_chat_prefix", [""]))
+        self.image_create_prefix = PrefixMatcher(config.get("image_create_prefix", [""]))
+        self.nick_name_black_list = frozenset(config.get("nick_name_black_list", []) or [])
+        self.group_at_off = config.get("group_at_off", False)
+        self.trigger_by_self = config.get("trigger_by_self", True)
+        self.always_reply_voice = config.get("always_reply_voice")
+        self.voice_reply_voice = config.get("voice_reply_voice")
+
+    def is_group_allowed(self, group_name) -> bool:
+        return self.all_group or group_name in self.group_names or self.group_name_keywords.match(group_name)
+
+    def is_shared_session_group(self, group_name) -> bool:
+        return self.all_group_shared or group_name in self.shared_session_groups
+
+
+_index = None
+_index_deps = None
+_index_lock = threading.Lock()
+
+
+def _build_trigger_index(snapshot) -> TriggerIndex:
+    """
+    配置快照的派生值，只有索引用到的配置项变化时才重新编译，否则沿用上一版本的索引
+    """
+    global _index, _index_deps
+    with _index_lock:
+        if _index is None or _index_deps.changed(snapshot):
+            with record_config_reads(snapshot) as deps:
+                index = TriggerIndex(snapshot)
+            _index, _index_deps = index, deps
+        return _index
+
+
+register_derived("triggers", _build_trigger_index)
+
+
+def get_trigger_index() -> TriggerIndex:
+    """
+    获取当前配置对应的触发索引，重新加载配置(#reconf)或修改配置项后自动更新
+    """
+    return config_snapshot().triggers
+
+
+@functools.lru_cache(maxsize=1024)
+def at_pattern(nick_name):
+    """
+    缓存每个昵称编译好的@匹配正则
+    """
+    return re.compile(f"@{re.escape(nick_name)}(\u2005|\u0020)")
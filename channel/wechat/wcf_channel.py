@@ -8,7 +8,6 @@ import io
 import json
 import os
 import threading
-import time
 from queue import Empty
 from typing import Any
 
@@ -18,6 +17,7 @@ from channel.chat_channel import ChatChannel
 from channel.wechat.wcf_message import WechatfMessage
 from common.log import logger
 from common.singleton import singleton
+from common.ttl_cache import TTLCache
 from common.utils import *
 from config import conf, get_appdata_dir
 from wcferry import Wcf, WxMsg
@@ -30,8 +30,8 @@ class WechatfChannel(ChatChannel):
     def __init__(self):
         super().__init__()
         self.NOT_SUPPORT_REPLYTYPE = []
-        # 使用字典存储最近消息，用于去重
-        self.received_msgs = {}
+        # 存储最近60秒的消息id，用于去重
+        self.received_msgs = TTLCache(60)
         # 初始化wcferry客户端
         self.wcf = Wcf()
         self.wxid = None  # 登录后会被设置为当前登录用户的wxid
@@ -83,9 +83,7 @@ class WechatfChannel(ChatChannel):
             # 消息去重
             if cmsg.msg_id in self.received_msgs:
                 return
-            self.received_msgs[cmsg.msg_id] = time.time()
-            # 清理过期消息ID
-            self._clean_expired_msgs()
+            self.received_msgs[cmsg.msg_id] = True
 
             logger.debug(f"收到消息: {msg}")
             context = self._compose_context(cmsg.ctype, cmsg.content,
@@ -96,15 +94,6 @@ class WechatfChannel(ChatChannel):
         except Exception as e:
             logger.error(f"处理消息失败: {e}")
 
-    def _clean_expired_msgs(self, expire_time: float = 60):
-        """
-        清理过期的消息ID
-        """
-        now = time.time()
-        for msg_id in list(self.received_msgs.keys()):
-            if now - self.received_msgs[msg_id] > expire_time:
-                del self.received_msgs[msg_id]
-
     def send(self, reply: Reply, context: Context):
         """
         发送消息
@@ -16,7 +16,7 @@ from bridge.reply import *
 from channel.chat_channel import ChatChannel
 from channel import chat_channel
 from channel.wechat.wechat_message import *
-from common.expired_dict import ExpiredDict
+from common.ttl_cache import TTLCache
 from common.log import logger
 from common.singleton import singleton
 from common.time_check import time_checker
@@ -141,7 +141,7 @@ class WechatChannel(ChatChannel):
 
     def __init__(self):
         super().__init__()
-        self.receivedMsgs = ExpiredDict(conf().get("expires_in_seconds", 3600))
+        self.receivedMsgs = TTLCache(conf().get("expires_in_seconds") or 3600)
         self.auto_login_times = 0
 
     def startup(self):
@@ -9,7 +9,6 @@ import base64
 import os
 import time
 
-from channel import chat_channel
 from wechaty import Contact, Wechaty
 from wechaty.user import Message
 from wechaty_puppet import FileBox
@@ -21,10 +20,11 @@ from channel.chat_channel import ChatChannel
 from channel.wechat.wechaty_message import WechatyMessage
 from common.log import logger
 from common.singleton import singleton
+from common.thread_pool import set_thread_pool_initializer
 from config import conf
 
 try:
-    from voice.audio_convert import any_to_sil
+    from voice.tts_cache import voice_to_silk
 except Exception as e:
     pass
 
@@ -45,7 +45,7 @@ class WechatyChannel(ChatChannel):
     async def main(self):
         loop = asyncio.get_event_loop()
         # 将asyncio的loop传入处理线程
-        chat_channel.handler_pool._initializer = lambda: asyncio.set_event_loop(loop)
+        set_thread_pool_initializer(lambda: asyncio.set_event_loop(loop))
         self.bot = Wechaty()
         self.bot.on("login", self.on_login)
         self.bot.on("message", self.on_message)
@@ -77,7 +77,7 @@ class WechatyChannel(ChatChannel):
             voiceLength = None
             file_path = reply.content
             sil_file = os.path.splitext(file_path)[0] + ".sil"
-            voiceLength = int(any_to_sil(file_path, sil_file))
+            voiceLength = int(voice_to_silk(file_path, sil_file))
             if voiceLength >= 60000:
                 voiceLength = 60000
                 logger.info("[WX] voice too long, length={}, set to 60s".format(voiceLength))
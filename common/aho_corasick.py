@@ -0,0 +1,87 @@
+from collections import deque
+
+
+class AhoCorasick(object):
+    """
+    Aho-Corasick多模式匹配自动机，一次扫描文本即可找出所有关键词，耗时与关键词数量无关
+
+    节点用数组下标表示，_goto[i]为节点i的转移表，_fail[i]为失配指针，_output[i]为在节点i结束的关键词
+    """
+
+    def __init__(self, words=None):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [()]
+        self.words = []
+        for word in words or []:
+            self.add(word)
+        self.build()
+
+    def add(self, word):
+        """
+        添加关键词，添加完成后需调用build()
+        """
+        if not word:
+            return
+        node = 0
+        for ch in word:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+            node = nxt
+        if word not in self._output[node]:
+            self._output[node] = self._output[node] + (word,)
+            self.words.append(word)
+
+    def build(self):
+        """
+        广度优先计算失配指针，并把失配节点的输出合并到当前节点
+        """
+        queue = deque(self._goto[0].values())
+        for node in queue:
+            self._fail[node] = 0
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(ch, 0)
+                self._fail[nxt] = fail
+                if self._output[fail]:
+                    self._output[nxt] = self._output[nxt] + self._output[fail]
+
+    def __len__(self):
+        return len(self.words)
+
+    def iter(self, text):
+        """
+        依次产出(结束位置, 关键词)，结束位置为关键词最后一个字符的下标
+        """
+        goto, fail, output = self._goto, self._fail, self._output
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for word in output[node]:
+                yield i, word
+
+    def search(self, text):
+        """
+        返回文本中最先出现的关键词，没有时返回None
+        """
+        for _, word in self.iter(text):
+            return word
+        return None
+
+    def findall(self, text):
+        """
+        返回文本中所有关键词的出现位置[(起始下标, 关键词)]
+        """
+        return [(end - len(word) + 1, word) for end, word in self.iter(text)]
@@ -0,0 +1,62 @@
+import asyncio
+import threading
+from concurrent.futures import TimeoutError
+
+from common.log import logger
+from common.singleton import singleton
+from config import conf
+
+
+@singleton
+class AsyncLoop(object):
+    """
+    全局共享的后台事件循环，运行在单独的守护线程中
+    同步代码通过submit/run提交协程，异步bot共享同一个aiohttp连接池
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._http_session = None
+        self._thread = threading.Thread(target=self._run, name="async_loop", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        """
+        在共享事件循环中执行协程，线程安全
+        :return: concurrent.futures.Future
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """
+        同步等待协程执行结果，不能在事件循环线程中调用
+        :raise concurrent.futures.TimeoutError: 超时，超时后协程会被取消
+        """
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("AsyncLoop.run() cannot be called from the event loop thread")
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+    def http_session(self):
+        """
+        获取共享的aiohttp会话，只能在事件循环中调用
+        """
+        if self._http_session is None or self._http_session.closed:
+            import aiohttp
+
+            connector = aiohttp.TCPConnector(limit=conf().get("async_http_pool_size", 100), keepalive_timeout=60)
+            self._http_session = aiohttp.ClientSession(connector=connector, trust_env=True)
+            logger.debug("[AsyncLoop] create shared http session")
+        return self._http_session
+
+    async def close(self):
+        if self._http_session and not self._http_session.closed:
+            await self._http_session.close()
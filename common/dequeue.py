@@ -31,3 +31,25 @@ class Dequeue(Queue):
 
     def _putleft(self, item):
         self.queue.appendleft(item)
+
+    def peek_last(self):
+        """
+        查看队尾元素但不取出，队列为空时返回None
+        """
+        with self.mutex:
+            return self.queue[-1] if self.queue else None
+
+    def remove_first(self, predicate):
+        """
+        取出第一个满足predicate的元素并视为已处理完(相当于get后task_done)，没有时返回None
+        """
+        with self.mutex:
+            for i, item in enumerate(self.queue):
+                if predicate(item):
+                    del self.queue[i]
+                    self.not_full.notify()
+                    self.unfinished_tasks -= 1
+                    if self.unfinished_tasks == 0:
+                        self.all_tasks_done.notify_all()
+                    return item
+            return None
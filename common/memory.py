@@ -1,3 +1,3 @@
-from common.expired_dict import ExpiredDict
+from common.ttl_cache import TTLCache
 
-USER_IMAGE_CACHE = ExpiredDict(60 * 3)
\ No newline at end of file
+USER_IMAGE_CACHE = TTLCache(60 * 3)
\ No newline at end of file
@@ -0,0 +1,69 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from common.log import logger
+from common.thread_pool import thread_pool_metrics
+
+_collectors = {}
+_server = None
+
+
+def register_collector(name, collector):
+    """
+    注册指标采集函数
+    :param collector: 无参函数，返回Prometheus文本格式的指标
+    """
+    _collectors[name] = collector
+
+
+def _thread_pool_collector():
+    lines = []
+    metrics = thread_pool_metrics()
+    for field in ("workers", "active", "queued", "submitted", "completed", "rejected"):
+        lines.append("# TYPE thread_pool_{} gauge".format(field))
+        for name, m in metrics.items():
+            lines.append('thread_pool_{}{{pool="{}"}} {}'.format(field, name, m[field]))
+    return "\n".join(lines) + "\n"
+
+
+register_collector("thread_pool", _thread_pool_collector)
+
+
+def export_metrics() -> str:
+    output = []
+    for name, collector in list(_collectors.items()):
+        try:
+            output.append(collector())
+        except Exception as e:
+            logger.warning("[Metrics] collector {} failed: {}".format(name, e))
+    return "".join(output)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = export_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port, host="0.0.0.0"):
+    """
+    在后台线程启动/metrics指标接口，重复调用只启动一次
+    """
+    global _server
+    if _server is not None:
+        return _server
+    _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info("[Metrics] metrics server started at http://{}:{}/metrics".format(host, port))
+    return _server
@@ -0,0 +1,235 @@
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from common.log import logger
+from common.ttl_cache import TTLCache
+from config import conf, get_appdata_dir
+
+# 序列化后超过该字节数时使用zlib压缩
+COMPRESS_THRESHOLD = 512
+# 清理过期会话的间隔(秒)
+PURGE_INTERVAL = 600
+
+
+class SessionStore(object):
+    """
+    会话存储接口，按会话id存取会话对象，会话对象需实现dump()和load(state)
+
+    修改会话后需要重新赋值 store[session_id] = session 才能保证持久化
+    """
+
+    def __getitem__(self, session_id):
+        raise NotImplementedError
+
+    def __setitem__(self, session_id, session):
+        raise NotImplementedError
+
+    def __delitem__(self, session_id):
+        raise NotImplementedError
+
+    def __contains__(self, session_id):
+        return self.get(session_id) is not None
+
+    def get(self, session_id, default=None):
+        try:
+            return self[session_id]
+        except KeyError:
+            return default
+
+    def clear(self):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class MemorySessionStore(TTLCache, SessionStore):
+    """
+    进程内存储，直接保存会话对象，重启后丢失
+    """
+
+
+def encode_state(state: dict) -> bytes:
+    data = json.dumps(state, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if len(data) > COMPRESS_THRESHOLD:
+        return b"z" + zlib.compress(data)
+    return b"j" + data
+
+
+def decode_state(data: bytes) -> dict:
+    if data[:1] == b"z":
+        return json.loads(zlib.decompress(data[1:]))
+    return json.loads(data[1:])
+
+
+class SqliteSessionStore(SessionStore):
+    """
+    基于SQLite的持久化存储，同一台机器上的多个进程可共享会话，重启不丢失
+
+    写入先进入内存中的待写队列(同一会话只保留最新状态)，由后台线程按flush_interval批量写入；
+    读取时优先读待写队列，保证本进程读到自己的最新写入，其他进程在下一次flush后可见
+    """
+
+    def __init__(self, namespace, factory, ttl=None, path=None, flush_interval=1.0, batch_size=100):
+        """
+        :param namespace: 命名空间，不同类型的会话互不影响
+        :param factory: factory(session_id)创建空会话对象，再通过load(state)恢复状态
+        :param ttl: 会话过期时间(秒)，按最后一次写入时间计算
+        :param path: 数据库文件路径
+        :param flush_interval: 后台批量写入间隔(秒)
+        :param batch_size: 待写会话数达到该值时立即写入
+        """
+        self.namespace = namespace
+        self.factory = factory
+        self.ttl = ttl
+        self.path = path or os.path.join(get_appdata_dir(), "sessions.db")
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._pending = {}  # session_id -> (data, updated_at)，data为None表示删除
+        self._flushing = {}  # 正在写入数据库的会话，写入完成前仍从这里读取
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "namespace TEXT NOT NULL, session_id TEXT NOT NULL, data BLOB NOT NULL, updated_at REAL NOT NULL, "
+            "PRIMARY KEY (namespace, session_id))"
+        )
+        self._conn.commit()
+        self._stop = threading.Event()
+        self._last_purge = 0
+        self._thread = threading.Thread(target=self._run, name="session_store_{}".format(namespace), daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _expired(self, updated_at):
+        return self.ttl and time.time() - updated_at > self.ttl
+
+    def __getitem__(self, session_id):
+        with self._lock:
+            pending = self._pending.get(session_id) or self._flushing.get(session_id)
+        if pending:
+            data, updated_at = pending
+        else:
+            with self._db_lock:
+                row = self._conn.execute(
+                    "SELECT data, updated_at FROM sessions WHERE namespace=? AND session_id=?", (self.namespace, session_id)
+                ).fetchone()
+            data, updated_at = row if row else (None, 0)
+        if data is None or self._expired(updated_at):
+            raise KeyError(session_id)
+        session = self.factory(session_id)
+        session.load(decode_state(data))
+        return session
+
+    def __setitem__(self, session_id, session):
+        # 写入时立即序列化，之后对会话对象的修改不影响本次写入
+        data = encode_state(session.dump())
+        with self._lock:
+            self._pending[session_id] = (data, time.time())
+            need_flush = len(self._pending) >= self.batch_size
+        if need_flush:
+            self.flush()
+
+    def __delitem__(self, session_id):
+        with self._lock:
+            self._pending[session_id] = (None, time.time())
+
+    def clear(self):
+        with self._lock:
+            self._pending.clear()
+        with self._db_lock:
+            self._conn.execute("DELETE FROM sessions WHERE namespace=?", (self.namespace,))
+            self._conn.commit()
+
+    def flush(self):
+        """
+        将待写队列批量写入数据库
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flushing = pending
+        if not pending:
+            return
+        upserts = [(self.namespace, sid, data, ts) for sid, (data, ts) in pending.items() if data is not None]
+        deletes = [(self.namespace, sid) for sid, (data, ts) in pending.items() if data is None]
+        try:
+            with self._db_lock:
+                with self._conn:
+                    self._conn.executemany("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)", upserts)
+                    self._conn.executemany("DELETE FROM sessions WHERE namespace=? AND session_id=?", deletes)
+        except Exception as e:
+            logger.error("[SessionStore] flush {} sessions failed: {}".format(len(pending), e))
+            # 写入失败时放回队列，已有更新的状态不覆盖
+            with self._lock:
+                for sid, value in pending.items():
+                    self._pending.setdefault(sid, value)
+        finally:
+            with self._lock:
+                self._flushing = {}
+
+    def purge(self):
+        """
+        删除数据库中的过期会话
+        """
+        if not self.ttl:
+            return
+        with self._db_lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM sessions WHERE namespace=? AND updated_at<?", (self.namespace, time.time() - self.ttl))
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+            if time.time() - self._last_purge > PURGE_INTERVAL:
+                self._last_purge = time.time()
+                try:
+                    self.purge()
+                except Exception as e:
+                    logger.warning("[SessionStore] purge failed: {}".format(e))
+
+    def close(self):
+        """
+        停止后台写入线程，写入剩余的会话后关闭数据库连接
+        """
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        if threading.current_thread() is not self._thread:
+            self._thread.join()
+        self.flush()
+        with self._db_lock:
+            self._conn.close()
+        atexit.unregister(self.close)
+
+
+def create_session_store(namespace, factory) -> SessionStore:
+    """
+    根据配置创建会话存储
+    :param namespace: 命名空间，一般为会话类名
+    :param factory: factory(session_id)创建空会话对象
+    """
+    ttl = conf().get("expires_in_seconds")
+    backend = conf().get("session_store", "memory")
+    if backend == "sqlite":
+        return SqliteSessionStore(
+            namespace,
+            factory,
+            ttl=ttl,
+            path=conf().get("session_store_path") or None,
+            flush_interval=conf().get("session_store_flush_interval", 1.0),
+            batch_size=conf().get("session_store_batch_size", 100),
+        )
+    if backend != "memory":
+        logger.warning("[SessionStore] unsupported session_store: {}, use memory".format(backend))
+    return MemorySessionStore(ttl, conf().get("session_max_count", 0))
@@ -0,0 +1,203 @@
+import threading
+import time
+from concurrent.futures import Future
+from queue import Empty, Queue
+
+from common.log import logger
+from config import conf
+
+# 各隔离线程池的最大线程数配置项，不同类型的任务互不抢占线程
+POOL_SIZE_SETTINGS = {
+    "chat": "chat_pool_size",
+    "voice_to_text": "voice_to_text_pool_size",
+    "asr_segment": "asr_segment_pool_size",
+    "text_to_voice": "text_to_voice_pool_size",
+    "tts_segment": "tts_segment_pool_size",
+    "image_download": "image_download_pool_size",
+    "plugin": "plugin_pool_size",
+}
+
+
+class PoolRejectedError(RuntimeError):
+    pass
+
+
+class _WorkItem(object):
+    def __init__(self, future, fn, args, kwargs):
+        self.future = future
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+    def run(self):
+        if not self.future.set_running_or_notify_cancel():  # 已被取消
+            return
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except BaseException as e:
+            self.future.set_exception(e)
+        else:
+            self.future.set_result(result)
+
+
+class ElasticThreadPool(object):
+    """
+    可伸缩线程池：排队任务数超过空闲线程数时扩容，线程空闲超过idle_seconds后回收到min_workers
+    队列满时不抛异常，而是返回一个已失败(PoolRejectedError)的future，方便调用方统一在回调中处理
+    """
+
+    def __init__(self, name, max_workers=8, min_workers=1, max_queue_size=0, idle_seconds=60, initializer=None):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self.min_workers = max(0, min(min_workers, self.max_workers))
+        self.max_queue_size = max_queue_size  # 0为不限制
+        self.idle_seconds = idle_seconds
+        self.initializer = initializer  # 每个新线程启动时调用，如设置asyncio的事件循环
+        self._queue = Queue()
+        self._lock = threading.Lock()
+        self._workers = 0
+        self._idle = 0
+        self._active = 0
+        self._submitted = 0
+        self._completed = 0
+        self._rejected = 0
+        self._shutdown = False
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        future = Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            if self.max_queue_size > 0 and self._queue.qsize() >= self.max_queue_size:
+                self._rejected += 1
+                future.set_exception(PoolRejectedError("thread pool {} is full, queued={}".format(self.name, self._queue.qsize())))
+                return future
+            self._submitted += 1
+            self._queue.put(_WorkItem(future, fn, args, kwargs))
+            # 排队任务多于空闲线程时扩容
+            if self._workers < self.max_workers and self._queue.qsize() > self._idle:
+                self._spawn_worker()
+        return future
+
+    def _spawn_worker(self):
+        self._workers += 1
+        t = threading.Thread(target=self._worker, name="{}_pool_{}".format(self.name, self._workers), daemon=True)
+        t.start()
+
+    def _worker(self):
+        if self.initializer:
+            try:
+                self.initializer()
+            except Exception as e:
+                logger.exception("[thread_pool] {} initializer error: {}".format(self.name, e))
+        while True:
+            with self._lock:
+                self._idle += 1
+            try:
+                item = self._queue.get(timeout=self.idle_seconds)
+            except Empty:
+                item = None
+            with self._lock:
+                self._idle -= 1
+                if item is None:
+                    # 空闲超时，线程数大于最小值时回收
+                    if self._shutdown or self._workers > self.min_workers:
+                        self._workers -= 1
+                        return
+                    continue
+                self._active += 1
+            try:
+                item.run()
+            finally:
+                with self._lock:
+                    self._active -= 1
+                    self._completed += 1
+                    if self._workers > self.max_workers:  # 线程池被缩容
+                        self._workers -= 1
+                        return
+
+    def resize(self, max_workers=None, min_workers=None, max_queue_size=None, idle_seconds=None):
+        with self._lock:
+            if max_workers is not None:
+                self.max_workers = max(1, max_workers)
+            if min_workers is not None:
+                self.min_workers = max(0, min_workers)
+            self.min_workers = min(self.min_workers, self.max_workers)
+            if max_queue_size is not None:
+                self.max_queue_size = max_queue_size
+            if idle_seconds is not None:
+                self.idle_seconds = idle_seconds
+            while self._workers < self.max_workers and self._queue.qsize() > self._idle:
+                self._spawn_worker()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self._workers,
+                "max_workers": self.max_workers,
+                "active": self._active,
+                "queued": self._queue.qsize(),
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            self._shutdown = True
+            self.min_workers = 0
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_initializer = None
+
+
+def _pool_args(name):
+    size_key = POOL_SIZE_SETTINGS.get(name, "chat_pool_size")
+    return {
+        "max_workers": conf().get(size_key, 8),
+        "max_queue_size": conf().get("thread_pool_max_queue_size", 0),
+        "idle_seconds": conf().get("thread_pool_idle_seconds", 60),
+    }
+
+
+def get_thread_pool(name="chat") -> ElasticThreadPool:
+    """
+    获取指定用途的线程池，首次使用时按配置创建
+    :param name: chat/voice_to_text/asr_segment/text_to_voice/tts_segment/image_download/plugin
+    """
+    pool = _pools.get(name)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(name)
+            if pool is None:
+                pool = ElasticThreadPool(name, initializer=_initializer, **_pool_args(name))
+                _pools[name] = pool
+    return pool
+
+
+def set_thread_pool_initializer(initializer):
+    """
+    设置所有线程池新线程的初始化函数，已创建的线程不受影响
+    """
+    global _initializer
+    _initializer = initializer
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.initializer = initializer
+
+
+def reload_thread_pools():
+    """
+    配置重载后调整已有线程池的大小
+    """
+    with _pools_lock:
+        for name, pool in _pools.items():
+            pool.resize(**_pool_args(name))
+
+
+def thread_pool_metrics() -> dict:
+    with _pools_lock:
+        pools = list(_pools.items())
+    return {name: pool.metrics() for name, pool in pools}
@@ -3,39 +3,127 @@ import time
 import config
 from common.log import logger
 
+MINUTES_PER_DAY = 24 * 60
+TIME_PATTERN = re.compile(r"^([01]?[0-9]|2[0-4]):([0-5][0-9])$")
+WEEKDAY_PATTERN = re.compile(r"^([1-7])(?:-([1-7]))?$")
+# 定义匹配规则，如果以 #reconf 或者  #更新配置  结尾, 非服务时间可以修改开始/结束时间并重载配置
+RECONF_PATTERN = re.compile(r"^.*#(?:reconf|更新配置)$")
 
-def time_checker(f):
-    def _time_checker(self, *args, **kwargs):
-        _config = config.conf()
-        chat_time_module = _config.get("chat_time_module", False)
 
-        if chat_time_module:
-            chat_start_time = _config.get("chat_start_time", "00:00")
-            chat_stop_time = _config.get("chat_stop_time", "24:00")
+def _parse_minute(text):
+    match = TIME_PATTERN.match(text.strip())
+    if not match:
+        raise ValueError("invalid time: {}".format(text))
+    return min(int(match.group(1)) * 60 + int(match.group(2)), MINUTES_PER_DAY)
 
-            time_regex = re.compile(r"^([01]?[0-9]|2[0-4])(:)([0-5][0-9])$")
 
-            if not (time_regex.match(chat_start_time) and time_regex.match(chat_stop_time)):
-                logger.warning("时间格式不正确，请在config.json中修改CHAT_START_TIME/CHAT_STOP_TIME。")
-                return None
+def _parse_weekdays(spec):
+    """
+    解析星期配置，如 "1-5,7"，1-7代表周一到周日
+    :return: 与time.struct_time.tm_wday一致的星期列表，0为周一
+    """
+    days = []
+    for part in spec.split(","):
+        match = WEEKDAY_PATTERN.match(part.strip())
+        if not match:
+            raise ValueError("invalid weekdays: {}".format(spec))
+        first = int(match.group(1))
+        last = int(match.group(2) or first)
+        days.extend(day % 7 for day in range(first - 1, (last if last >= first else last + 7)))
+    return days
+
+
+def _parse_window(window):
+    """
+    解析单个服务时间段，如 "09:00-18:00"、"1-5 09:00-18:00"、"22:00-02:00"(跨天)
+    :return: (星期列表, 开始分钟, 结束分钟)
+    """
+    days, _, period = window.strip().rpartition(" ")
+    start, sep, stop = period.partition("-")
+    if not sep:
+        raise ValueError("invalid time window: {}".format(window))
+    weekdays = _parse_weekdays(days) if days.strip() else range(7)
+    return weekdays, _parse_minute(start), _parse_minute(stop)
+
+
+class ServiceSchedule(object):
+    """
+    服务时间表，所有时间段预先展开为一周内每分钟是否提供服务，判断时只需一次下标访问
+    """
+
+    def __init__(self, windows):
+        table = bytearray(7 * MINUTES_PER_DAY)
+        for window in windows:
+            weekdays, start, stop = _parse_window(window)
+            for day in weekdays:
+                if start < stop:
+                    self._fill(table, day, start, stop)
+                elif stop < start:  # 结束时间小于开始时间，跨天了
+                    self._fill(table, day, start, MINUTES_PER_DAY)
+                    self._fill(table, (day + 1) % 7, 0, stop)
+        self.table = bytes(table)
+
+    @staticmethod
+    def _fill(table, day, start, stop):
+        # 与原有逻辑一致，开始和结束时间所在的分钟都在服务时间内
+        begin = day * MINUTES_PER_DAY + start
+        end = day * MINUTES_PER_DAY + min(stop, MINUTES_PER_DAY - 1) + 1
+        table[begin:end] = b"\x01" * (end - begin)
+
+    def is_open(self, now: time.struct_time = None) -> bool:
+        now = now or time.localtime()
+        return self.table[now.tm_wday * MINUTES_PER_DAY + now.tm_hour * 60 + now.tm_min] == 1
+
+
+class ChatSchedule(object):
+    """
+    按群名、通道类型选择服务时间表，群配置优先于通道配置，都没有时使用默认配置
+    """
 
-            now_time = time.strptime(time.strftime("%H:%M"), "%H:%M")
-            chat_start_time = time.strptime(chat_start_time, "%H:%M")
-            chat_stop_time = time.strptime(chat_stop_time, "%H:%M")
-            # 结束时间小于开始时间，跨天了
-            if chat_stop_time < chat_start_time and (chat_start_time <= now_time or now_time <= chat_stop_time):
+    def __init__(self, default: ServiceSchedule, groups: dict = None, channels: dict = None):
+        self.default = default
+        self.groups = groups or {}
+        self.channels = channels or {}
+
+    def is_open(self, group_name=None, channel_type=None, now: time.struct_time = None) -> bool:
+        schedule = self.groups.get(group_name) or self.channels.get(channel_type) or self.default
+        return schedule.is_open(now)
+
+
+def _build_chat_schedule(snapshot):
+    """
+    配置快照的派生值：解析后的服务时间表，配置重载后自动重新生成
+    :return: ChatSchedule，未开启时间模块时返回None，时间格式错误时返回False
+    """
+    if not snapshot.chat_time_module:
+        return None
+    try:
+        windows = snapshot.chat_time_windows or ["{}-{}".format(snapshot.get("chat_start_time", "00:00"), snapshot.get("chat_stop_time", "24:00"))]
+        groups = {name: ServiceSchedule(w) for name, w in (snapshot.chat_time_group_windows or {}).items()}
+        channels = {name: ServiceSchedule(w) for name, w in (snapshot.chat_time_channel_windows or {}).items()}
+        return ChatSchedule(ServiceSchedule(windows), groups, channels)
+    except (ValueError, AttributeError) as e:
+        logger.warning("时间格式不正确，请在config.json中修改CHAT_START_TIME/CHAT_STOP_TIME/CHAT_TIME_WINDOWS。{}".format(e))
+        return False
+
+
+config.register_derived("chat_time", _build_chat_schedule)
+
+
+def time_checker(f):
+    def _time_checker(self, *args, **kwargs):
+        chat_time = config.config_snapshot().chat_time
+
+        if chat_time is not None:
+            cmsg = args[0] if args else None
+            group_name = cmsg.other_user_nickname if getattr(cmsg, "is_group", False) else None
+            if chat_time and chat_time.is_open(group_name, getattr(self, "channel_type", None)):
                 f(self, *args, **kwargs)
-            # 结束大于开始时间代表，没有跨天
-            elif chat_start_time < chat_stop_time and chat_start_time <= now_time <= chat_stop_time:
+            elif isinstance(getattr(cmsg, "content", None), str) and RECONF_PATTERN.match(cmsg.content):
                 f(self, *args, **kwargs)
             else:
-                # 定义匹配规则，如果以 #reconf 或者  #更新配置  结尾, 非服务时间可以修改开始/结束时间并重载配置
-                pattern = re.compile(r"^.*#(?:reconf|更新配置)$")
-                if args and pattern.match(args[0].content):
-                    f(self, *args, **kwargs)
-                else:
-                    logger.info("非服务时间内，不接受访问")
-                    return None
+                logger.info("非服务时间内，不接受访问")
+                return None
         else:
             f(self, *args, **kwargs)  # 未开启时间模块则直接回答
 
@@ -0,0 +1,176 @@
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+from common.log import logger
+
+# 后台清理线程的最长休眠时间(秒)
+MAX_SWEEP_INTERVAL = 60
+
+
+class TTLCache(MutableMapping):
+    """
+    带过期时间和容量上限的LRU缓存，可替代ExpiredDict
+
+    每次访问都会刷新过期时间并移到队尾，因此队首总是最早过期的元素，
+    写入时顺带清理队首的过期元素(惰性清理)，另有后台线程定期清理长期无人访问的元素，
+    各操作均为O(1)(摊还)。
+    """
+
+    def __init__(self, ttl=3600, maxsize=0, on_evict=None, sweep_interval=MAX_SWEEP_INTERVAL):
+        """
+        :param ttl: 过期时间(秒)，为空或0时不过期
+        :param maxsize: 最大元素数量，超出时淘汰最久未访问的元素，0为不限制
+        :param on_evict: 元素因过期或容量被淘汰时的回调 on_evict(key, value, reason)，reason为"expired"或"capacity"
+        :param sweep_interval: 后台定期清理的间隔(秒)
+        """
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.on_evict = on_evict
+        self.sweep_interval = sweep_interval
+        self._data = OrderedDict()  # key -> [value, expire_at]
+        self._lock = threading.RLock()
+        if ttl:
+            _Sweeper.register(self)
+
+    # 按对象身份比较和哈希，便于后台清理线程弱引用持有
+    __eq__ = object.__eq__
+    __hash__ = object.__hash__
+
+    def __getitem__(self, key):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data[key]
+            if item[1] is None or item[1] > now:
+                if self.ttl:
+                    item[1] = now + self.ttl
+                self._data.move_to_end(key)
+                return item[0]
+            del self._data[key]
+        self._notify([(key, item[0], "expired")])
+        raise KeyError("expired {}".format(key))
+
+    def __setitem__(self, key, value):
+        now = time.monotonic()
+        data = self._data
+        evicted = None
+        with self._lock:
+            if key in data:
+                data.move_to_end(key)
+            data[key] = [value, now + self.ttl if self.ttl else None]
+            # 惰性清理：只检查队首，没有过期元素时为O(1)
+            head = data[next(iter(data))]
+            if head[1] is not None and head[1] <= now:
+                evicted = self._evict_expired(now, max_count=2)
+            if self.maxsize and len(data) > self.maxsize:
+                evicted = evicted or []
+                while len(data) > self.maxsize:
+                    k, item = data.popitem(last=False)
+                    evicted.append((k, item[0], "capacity"))
+        if evicted:
+            self._notify(evicted)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._data[key]
+
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+    def __iter__(self):
+        self.expire()
+        with self._lock:
+            keys = list(self._data.keys())
+        return iter(keys)
+
+    def __len__(self):
+        self.expire()
+        return len(self._data)
+
+    def __repr__(self):
+        with self._lock:
+            return "{}({})".format(self.__class__.__name__, {k: v[0] for k, v in self._data.items()})
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def expire(self):
+        """
+        清理所有过期元素
+        :return: 清理的数量
+        """
+        with self._lock:
+            evicted = self._evict_expired(time.monotonic())
+        self._notify(evicted)
+        return len(evicted)
+
+    def _evict_expired(self, now, max_count=None):
+        evicted = []
+        if not self.ttl:
+            return evicted
+        while self._data and (max_count is None or len(evicted) < max_count):
+            key, item = next(iter(self._data.items()))
+            if item[1] > now:
+                break
+            del self._data[key]
+            evicted.append((key, item[0], "expired"))
+        return evicted
+
+    def _notify(self, evicted):
+        if not evicted or not self.on_evict:
+            return
+        for key, value, reason in evicted:
+            try:
+                self.on_evict(key, value, reason)
+            except Exception as e:
+                logger.warning("[TTLCache] on_evict error, key={}, error={}".format(key, e))
+
+
+class _Sweeper(object):
+    """
+    所有TTLCache共用的后台清理线程，弱引用持有缓存，不影响缓存被回收
+    """
+
+    _caches = weakref.WeakSet()
+    _lock = threading.Lock()
+    _thread = None
+
+    @classmethod
+    def register(cls, cache: TTLCache):
+        with cls._lock:
+            cls._caches.add(cache)
+            if cls._thread is None:
+                cls._thread = threading.Thread(target=cls._run, name="ttl_cache_sweeper", daemon=True)
+                cls._thread.start()
+
+    @classmethod
+    def _run(cls):
+        next_sweep = weakref.WeakKeyDictionary()
+        while True:
+            now = time.monotonic()
+            wait = MAX_SWEEP_INTERVAL
+            for cache in list(cls._caches):
+                due = next_sweep.get(cache, 0)
+                if due <= now:
+                    try:
+                        cache.expire()
+                    except Exception as e:
+                        logger.warning("[TTLCache] sweep error: {}".format(e))
+                    due = now + cache.sweep_interval
+                    next_sweep[cache] = due
+                wait = min(wait, due - now)
+            cache = None  # 休眠期间不持有缓存的强引用
+            time.sleep(max(wait, 0.01))
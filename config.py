@@ -5,6 +5,9 @@ import logging
 import os
 import pickle
 import copy
+import itertools
+import threading
+from contextlib import contextmanager
 
 from common.log import logger
 
@@ -56,12 +59,33 @@ available_setting = {
     "image_proxy": True,  # 是否需要图片代理，国内访问LinkAI时需要
     "image_create_prefix": ["画", "看", "找"],  # 开启图片回复的前缀
     "concurrency_in_session": 1,  # 同一会话最多有多少条消息在处理中，大于1可能乱序
+    # 消息处理线程池配置，不同类型的任务使用各自的线程池，互不抢占
+    "chat_pool_size": 8,  # 文本对话线程池最大线程数
+    "voice_to_text_pool_size": 4,  # 语音识别线程池最大线程数
+    "asr_segment_pool_size": 4,  # 长语音分段识别线程池最大线程数，即语音识别接口的最大并发请求数
+    "text_to_voice_pool_size": 4,  # 语音回复线程池最大线程数
+    "tts_segment_pool_size": 4,  # 分段语音合成线程池最大线程数，即语音合成接口的最大并发请求数
+    "image_download_pool_size": 4,  # 图片下载线程池最大线程数
+    "plugin_pool_size": 8,  # 插件线程池最大线程数，设置了plugin_timeout时插件在该线程池中执行
+    "thread_pool_max_queue_size": 0,  # 每个线程池最多排队的任务数，超出后拒绝处理，0为不限制
+    "thread_pool_idle_seconds": 60,  # 线程空闲超过该时间后回收
+    "async_pipeline": False,  # 是否开启异步模式，开启后支持协程的bot(dify/chatGPT/linkai)在共享事件循环中处理文本消息，不占用处理线程
+    "async_http_pool_size": 100,  # 异步模式下共享http连接池的最大连接数
+    "session_queue_max_size": 0,  # 每个会话最多排队的消息数，0为不限制
+    "global_queue_max_size": 0,  # 所有会话合计最多排队的消息数，超出后丢弃新消息，0为不限制
+    "session_queue_drop_policy": "oldest",  # 会话队列满时的处理策略，oldest(丢弃最早的消息)/newest(丢弃新消息)/merge(同一用户的连续文本消息合并，无法合并时丢弃最早的消息)
+    "message_expire_seconds": 0,  # 消息排队超过该时间(秒)后不再处理，0为不限制
     "image_create_size": "256x256",  # 图片大小,可选有 256x256, 512x512, 1024x1024 (dall-e-3默认为1024x1024)
     "group_chat_exit_group": False,
     "group_exit_msg": "",  # 退出群聊的消息
     "accept_friend_msg": "",  # 接受好友请求后发送的消息
     # chatgpt会话参数
     "expires_in_seconds": 3600,  # 无操作会话的过期时间
+    "session_max_count": 0,  # 内存中最多保留的会话数，超出时淘汰最久未使用的会话，0为不限制
+    "session_store": "memory",  # 会话存储方式，memory(进程内存)/sqlite(持久化，同一台机器的多个进程可共享会话，重启不丢失)
+    "session_store_path": "",  # sqlite会话数据库路径，为空时使用appdata目录下的sessions.db
+    "session_store_flush_interval": 1.0,  # sqlite会话批量写入间隔(秒)
+    "session_store_batch_size": 100,  # 待写入会话数达到该值时立即写入
     # 人格描述
     "character_desc": "你是ChatGPT, 一个由OpenAI训练的大型语言模型, 你旨在回答并解决人们的任何问题，并且可以使用多种语言与人交流。",
     "conversation_max_tokens": 1000,  # 支持上下文记忆的最多字符数
@@ -107,6 +131,14 @@ available_setting = {
     "dify_app_type": "chatbot", # dify助手类型 chatbot(对应聊天助手或对话流)/agent(对应Agent)/workflow(对应工作流，则默认为chatbot
     "dify_conversation_max_messages": 5, # dify目前不支持设置历史消息长度，暂时使用超过最大消息数清空会话的策略，缺点是没有滑动窗口，会突然丢失历史消息，当设置的值小于等于0，则不限制历史消息长度
     "dify_error_reply": "", # dify bot错误时给用户的回复
+    "dify_http_pool_size": 10, # 每个dify api_base保持的最大keep-alive连接数
+    "dify_connect_timeout": 10, # dify建立连接超时时间(秒)
+    "dify_read_timeout": 180, # dify读取响应超时时间(秒)，流式响应为两次数据之间的最长间隔
+    "dify_max_retries": 2, # dify请求失败重试次数，POST请求仅在连接失败时重试
+    "dify_retry_backoff": 0.5, # dify重试退避系数，第n次重试前等待 backoff * 2^(n-1) 秒
+    "dify_stream_reply": False, # agent类型是否流式回复，开启后收到完整的段落或句子就立即发送，不等待agent运行结束
+    "dify_stream_min_chars": 20, # 流式回复时，没有遇到段落结束时至少积累多少字符才按句子发送
+    "dify_stream_send_interval": 1.0, # 流式回复时两条消息之间的最小间隔(秒)，避免触发channel的发送频率限制
     # coze配置
     "coze_api_base": "https://api.coze.cn",
     "coze_api_key": "xxx",
@@ -120,10 +152,15 @@ available_setting = {
     "group_speech_recognition": False,  # 是否开启群组语音识别
     "voice_reply_voice": False,  # 是否使用语音回复语音，需要设置对应语音合成引擎的api key
     "always_reply_voice": False,  # 是否一直使用语音回复
+    "voice_reply_pipeline": False,  # 长回复是否按句切分并发合成，逐段发送多条语音，单条语音不超过channel的最大时长
     "voice_to_text": "openai",  # 语音识别引擎，支持openai,baidu,google,azure,xunfei,ali
+    "asr_segment_duration": 0,  # 语音超过该时长(秒)时按静音切分为多段并发识别，0为不切分
     "text_to_voice": "openai",  # 语音合成引擎，支持openai,baidu,google,azure,xunfei,ali,pytts(offline),elevenlabs,edge(online)
     "text_to_voice_model": "tts-1",
     "tts_voice_id": "alloy",
+    "text_to_voice_timeout": 60,  # 异步语音合成(如edge)的超时时间(秒)，超时后取消合成
+    "tts_cache": True,  # 是否缓存语音合成结果，相同文本和音色不再重复合成和编码
+    "tts_cache_max_size": 200,  # 语音合成缓存最大占用空间(MB)，超出后淘汰最久未使用的语音
     # baidu 语音api配置， 使用百度语音识别和语音合成时需要
     "baidu_app_id": "",
     "baidu_api_key": "",
@@ -142,6 +179,9 @@ available_setting = {
     "chat_time_module": False,  # 是否开启服务时间限制
     "chat_start_time": "00:00",  # 服务开始时间
     "chat_stop_time": "24:00",  # 服务结束时间
+    "chat_time_windows": [],  # 多个服务时间段，配置后代替chat_start_time/chat_stop_time，如 ["09:00-12:00", "1-5 14:00-18:00", "6,7 10:00-16:00"]，可选的星期前缀中1-7代表周一到周日
+    "chat_time_group_windows": {},  # 按群名单独配置的服务时间段，如 {"ChatGPT测试群": ["20:00-23:00"]}
+    "chat_time_channel_windows": {},  # 按通道类型单独配置的服务时间段，如 {"wechatcom_app": ["1-5 09:00-18:00"]}，群配置优先于通道配置
     # 翻译api
     "translate": "baidu",  # 翻译api，支持baidu
     # baidu翻译api的配置
@@ -193,6 +233,14 @@ available_setting = {
     "plugin_trigger_prefix": "$",  # 规范插件提供聊天相关指令的前缀，建议不要和管理员指令前缀"#"冲突
     # 是否使用全局插件配置
     "use_global_plugin_config": False,
+    "plugin_lazy_import": True,  # 启动时只从源码读取插件信息，插件开启时才导入，未开启的插件不加载其依赖
+    "plugin_init_workers": 8,  # 并发导入和初始化插件的线程数，1为逐个初始化
+    "plugin_slow_threshold": 0,  # 插件处理函数耗时超过该值(秒)时打印告警和调用栈，0为不检测
+    "plugin_timeout": 0,  # 插件处理函数的超时时间(秒)，超时后跳过该插件继续处理，0为不限制，可在plugins.json中为单个插件设置timeout
+    "plugin_breaker_threshold": 3,  # 插件连续失败(超时或异常)达到该次数后暂停使用，0为不暂停
+    "plugin_breaker_cooldown": 60,  # 插件首次暂停的时间(秒)，再次失败时暂停时间翻倍
+    "plugin_breaker_max_cooldown": 3600,  # 插件最长暂停时间(秒)
+    "metrics_port": 0,  # 监控指标http端口，开启后可通过 http://ip:端口/metrics 获取Prometheus格式的指标，0为不开启
     "max_media_send_count": 3,  # 单次最大发送媒体资源的个数
     "media_send_interval": 1,  # 发送图片的事件间隔，单位秒
     # 智谱AI 平台配置
@@ -215,6 +263,11 @@ available_setting = {
 }
 
 
+_config_versions = itertools.count(1)
+_config_reads = threading.local()  # 当前线程正在记录的配置项集合，见record_config_reads
+_MISSING = object()
+
+
 class Config(dict):
     def __init__(self, d=None):
         super().__init__()
@@ -222,19 +275,41 @@ class Config(dict):
             d = {}
         for k, v in d.items():
             self[k] = v
+        self.version = next(_config_versions)
         # user_datas: 用户数据，key为用户名，value为用户数据，也是dict
         self.user_datas = {}
 
     def __getitem__(self, key):
         if key not in available_setting:
             raise Exception("key {} not in available_setting".format(key))
+        reads = getattr(_config_reads, "keys", None)
+        if reads is not None:
+            reads.add(key)
         return super().__getitem__(key)
 
     def __setitem__(self, key, value):
         if key not in available_setting:
             raise Exception("key {} not in available_setting".format(key))
+        self.version = next(_config_versions)  # 配置版本号，全局递增，用于判断编译缓存是否失效
         return super().__setitem__(key, value)
 
+    # 其余修改配置的方法同样要更新版本号，否则config_snapshot()会返回旧快照
+    def __delitem__(self, key):
+        self.version = next(_config_versions)
+        return super().__delitem__(key)
+
+    def update(self, *args, **kwargs):
+        for k, v in dict(*args, **kwargs).items():
+            self[k] = v
+
+    def clear(self):
+        self.version = next(_config_versions)
+        return super().clear()
+
+    def pop(self, *args):
+        self.version = next(_config_versions)
+        return super().pop(*args)
+
     def get(self, key, default=None):
         try:
             return self[key]
@@ -278,6 +353,129 @@ class Config(dict):
 config = Config()
 
 
+class ConfigSnapshot(object):
+    """
+    某一版本配置的只读快照，通过属性访问配置项(未配置时为None)，读取时不做任何检查。
+    由配置派生的预计算结果(见register_derived)在生成快照时计算一次，同样作为属性访问。
+    配置修改或重载后由config_snapshot()生成新快照整体替换，已取得旧快照的调用方不受影响
+    """
+
+    def __init__(self, config):
+        values = copy.deepcopy(dict(config))
+        object.__setattr__(self, "_values", values)
+        object.__setattr__(self, "version", getattr(config, "version", 0))
+        self.__dict__.update(values)
+        for name, factory in list(_derivations.items()):
+            self._derive(name, factory)
+
+    def __getattr__(self, key):
+        # 只有实例属性中不存在时才会调用：未配置的配置项，或快照生成后才注册的派生值
+        factory = _derivations.get(key)
+        if factory is not None:
+            return self._derive(key, factory)
+        if key in available_setting:
+            return None
+        raise AttributeError("'ConfigSnapshot' has no attribute '{}'".format(key))
+
+    def __setattr__(self, key, value):
+        raise AttributeError("ConfigSnapshot is read-only")
+
+    def _derive(self, name, factory):
+        try:
+            value = factory(self)
+        except Exception as e:
+            logger.exception("[Config] derive {} failed: {}".format(name, e))
+            value = None
+        object.__setattr__(self, name, value)
+        return value
+
+    def get(self, key, default=None):
+        reads = getattr(_config_reads, "keys", None)
+        if reads is not None:
+            reads.add(key)
+        return self._values.get(key, default)
+
+
+_derivations = {}  # 派生值名称 -> factory(snapshot)
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def register_derived(name, factory):
+    """
+    注册由配置派生的预计算值，如解析后的时间段、编译好的前缀匹配器等
+    :param name: 快照上的属性名
+    :param factory: factory(snapshot)，每个版本的配置只调用一次
+    """
+    _derivations[name] = factory
+
+
+def config_snapshot() -> ConfigSnapshot:
+    """
+    获取当前配置的快照，一条消息处理过程中应只获取一次，配置版本变化后重新生成
+    """
+    global _snapshot
+    snapshot = _snapshot
+    version = getattr(config, "version", 0)
+    if snapshot is None or snapshot.version != version:
+        with _snapshot_lock:
+            snapshot = _snapshot
+            if snapshot is None or snapshot.version != version:
+                snapshot = _snapshot = ConfigSnapshot(config)
+    return snapshot
+
+
+class ConfigDeps(object):
+    """
+    一个对象创建时读取的配置项及当时的取值，配置重载后据此判断该对象是否需要重建
+    """
+
+    def __init__(self, keys=(), config=None):
+        """
+        :param config: 取值来源，Config或ConfigSnapshot，默认为当前配置
+        """
+        config = conf() if config is None else config
+        self.values = {}
+        for key in keys:
+            value = _raw_get(config, key)
+            self.values[key] = value if value is _MISSING else copy.deepcopy(value)
+
+    def changed(self, config=None) -> list:
+        """
+        :return: 取值与当前配置(或指定的Config、ConfigSnapshot)不同的配置项列表
+        """
+        config = conf() if config is None else config
+        return [key for key, value in self.values.items() if _raw_get(config, key) != value]
+
+
+def _raw_get(config, key):
+    # 不经过get读取，避免被record_config_reads记录
+    if isinstance(config, ConfigSnapshot):
+        return config._values.get(key, _MISSING)
+    return dict.get(config, key, _MISSING)
+
+
+@contextmanager
+def record_config_reads(config=None):
+    """
+    记录代码块内当前线程读取的配置项，退出时生成ConfigDeps，可嵌套使用:
+        with record_config_reads() as deps:
+            bot = create_bot(bot_type)
+        if deps.changed(): ...
+    :param config: 记录取值的来源，从快照读取时传入该快照，默认为当前配置
+    """
+    outer = getattr(_config_reads, "keys", None)
+    keys = _config_reads.keys = set()
+    deps = ConfigDeps()
+    try:
+        yield deps
+    finally:
+        _config_reads.keys = outer
+        if outer is not None:
+            outer |= keys
+        deps.values = ConfigDeps(keys, config).values
+
+
 def drag_sensitive(config):
     try:
         if isinstance(config, str):
@@ -1,10 +1,79 @@
+import threading
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+def create_session(pool_size=10, max_retries=2, backoff_factor=0.5):
+    """
+    创建带连接池和重试的Session，连接保持keep-alive，避免每次请求重新握手
+    POST请求只在建立连接失败时重试，避免重复发送消息；GET请求额外对429/5xx重试
+    """
+    retry = Retry(
+        total=max_retries,
+        connect=max_retries,
+        read=0,
+        status=max_retries,
+        status_forcelist=(429, 502, 503, 504),
+        backoff_factor=backoff_factor,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class DifyClientPool:
+    """
+    按(api_base, api_key)缓存客户端，同一api_base的客户端共享一个连接池
+    """
+
+    def __init__(self, pool_size=10, max_retries=2, backoff_factor=0.5, timeout=None):
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self._sessions = {}
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def get_client(self, client_cls, api_key, base_url: str = 'https://api.dify.ai/v1'):
+        key = (client_cls, base_url, api_key)
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    session = self._sessions.get(base_url)
+                    if session is None:
+                        session = create_session(self.pool_size, self.max_retries, self.backoff_factor)
+                        self._sessions[base_url] = session
+                    client = client_cls(api_key, base_url, session=session, timeout=self.timeout)
+                    self._clients[key] = client
+        return client
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+            self._clients.clear()
 
 
 class DifyClient:
-    def __init__(self, api_key, base_url: str = 'https://api.dify.ai/v1'):
+    def __init__(self, api_key, base_url: str = 'https://api.dify.ai/v1', session: requests.Session = None, timeout=None):
         self.api_key = api_key
         self.base_url = base_url
+        self.session = session
+        self.timeout = timeout  # 秒数或(connect_timeout, read_timeout)
+
+    def _request(self, method, url, **kwargs):
+        if self.session is None:
+            return requests.request(method, url, timeout=self.timeout, **kwargs)
+        return self.session.request(method, url, timeout=self.timeout, **kwargs)
 
     def _send_request(self, method, endpoint, json=None, params=None, stream=False):
         headers = {
@@ -13,7 +82,7 @@ class DifyClient:
         }
 
         url = f"{self.base_url}{endpoint}"
-        response = requests.request(method, url, json=json, params=params, headers=headers, stream=stream)
+        response = self._request(method, url, json=json, params=params, headers=headers, stream=stream)
 
         return response
 
@@ -23,7 +92,7 @@ class DifyClient:
         }
 
         url = f"{self.base_url}{endpoint}"
-        response = requests.request(method, url, data=data, headers=headers, files=files)
+        response = self._request(method, url, data=data, headers=headers, files=files)
 
         return response
 
@@ -58,7 +127,8 @@ class CompletionClient(DifyClient):
 
 
 class ChatClient(DifyClient):
-    def create_chat_message(self, inputs, query, user, response_mode="blocking", conversation_id=None, files=None):
+    @staticmethod
+    def build_chat_message_data(inputs, query, user, response_mode="blocking", conversation_id=None, files=None):
         data = {
             "inputs": inputs,
             "query": query,
@@ -68,7 +138,10 @@ class ChatClient(DifyClient):
         }
         if conversation_id:
             data["conversation_id"] = conversation_id
+        return data
 
+    def create_chat_message(self, inputs, query, user, response_mode="blocking", conversation_id=None, files=None):
+        data = self.build_chat_message_data(inputs, query, user, response_mode, conversation_id, files)
         return self._send_request("POST", "/chat-messages", data,
                                   stream=True if response_mode == "streaming" else False)
 
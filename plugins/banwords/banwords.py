@@ -9,7 +9,7 @@ from bridge.reply import Reply, ReplyType
 from common.log import logger
 from plugins import *
 
-from .lib.WordsSearch import WordsSearch
+from .lib.compact_search import load_or_build
 
 
 @plugins.register(
@@ -35,7 +35,6 @@ class Banwords(Plugin):
                     with open(config_path, "w") as f:
                         json.dump(conf, f, indent=4)
 
-            self.searchr = WordsSearch()
             self.action = conf["action"]
             banwords_path = os.path.join(curdir, "banwords.txt")
             with open(banwords_path, "r", encoding="utf-8") as f:
@@ -44,8 +43,10 @@ class Banwords(Plugin):
                     word = line.strip()
                     if word:
                         words.append(word)
-            self.searchr.SetKeywords(words)
+            # 自动机构建后缓存到磁盘，敏感词不变时直接mmap加载
+            self.searchr = load_or_build(words, os.path.join(curdir, "banwords.cache"))
             self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context
+            self.context_types[Event.ON_HANDLE_CONTEXT] = [ContextType.TEXT, ContextType.IMAGE_CREATE]
             if conf.get("reply_filter", True):
                 self.handlers[Event.ON_DECORATE_REPLY] = self.on_decorate_reply
                 self.reply_action = conf.get("reply_action", "ignore")
@@ -63,6 +64,10 @@ class Banwords(Plugin):
 
         content = e_context["context"].content
         logger.debug("[Banwords] on_handle_context. content: %s" % content)
+        if Event.ON_DECORATE_REPLY in self.handlers:
+            # 流式回复(如dify_stream_reply)分段发送前逐段过滤，跨段的敏感词同样能匹配
+            stream = self.searchr.stream(block=self.reply_action == "ignore")
+            e_context["context"]["reply_stream_filters"] = e_context["context"].get("reply_stream_filters", []) + [stream]
         if self.action == "ignore":
             f = self.searchr.FindFirst(content)
             if f:
@@ -80,6 +85,12 @@ class Banwords(Plugin):
         if e_context["reply"].type not in [ReplyType.TEXT]:
             return
 
+        for stream in e_context["context"].get("reply_stream_filters", []):
+            if getattr(stream, "search", None) is self.searchr and stream.closed:
+                if stream.matches:
+                    logger.info("[Banwords] %s in streamed reply" % stream.matches[0])
+                return  # 已经在流式发送时逐段过滤过
+
         reply = e_context["reply"]
         content = reply.content
         if self.reply_action == "ignore":
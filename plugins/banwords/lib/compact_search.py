@@ -0,0 +1,395 @@
+# encoding:utf-8
+
+"""
+紧凑的Aho-Corasick敏感词匹配，接口与WordsSearch一致(SetKeywords/FindFirst/FindAll/ContainsAny/Replace)
+
+- 字符按出现频率重新编码为1..K的连续整数，不在任何敏感词中的字符直接回到根节点
+- 字典树以双数组(base/check)存储：状态s经字符c转移到t=base[s]+c，当且仅当check[t]==s
+- 失配指针fail和输出链表out_head/out_word/out_next同样是int32数组
+- 构建好的自动机可以保存到磁盘，加载时用mmap映射，多进程共享且无需重新构建
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections import deque
+
+MAGIC = b"CWS1"
+_HEADER = struct.Struct("<4sI")  # 魔数, 元数据长度
+
+
+class _Node(object):
+    __slots__ = ("children", "outputs", "slot", "fail")
+
+    def __init__(self):
+        self.children = {}
+        self.outputs = []
+        self.slot = 0
+        self.fail = None
+
+
+def keywords_digest(keywords) -> str:
+    return hashlib.sha1("\0".join(keywords).encode("utf-8")).hexdigest()
+
+
+class CompactWordsSearch(object):
+    def __init__(self):
+        self._keywords = []
+        self._lengths = []
+        self._codes = {}  # 字符 -> 编码
+        self._base = array("i", [0])
+        self._check = array("i", [-2])
+        self._fail = array("i", [0])
+        self._out_head = array("i", [-1])
+        self._out_word = array("i")
+        self._out_next = array("i")
+        self._mmap = None
+        self.digest = keywords_digest([])
+
+    def SetKeywords(self, keywords):
+        keywords = list(keywords)
+        # 高频字符编码小，双数组更容易排布紧凑
+        freq = {}
+        for word in keywords:
+            for ch in word:
+                freq[ch] = freq.get(ch, 0) + 1
+        alphabet = sorted(freq, key=lambda ch: (-freq[ch], ch))
+        codes = {ch: i + 1 for i, ch in enumerate(alphabet)}
+
+        root = _Node()
+        for index, word in enumerate(keywords):
+            node = root
+            for ch in word:
+                code = codes[ch]
+                child = node.children.get(code)
+                if child is None:
+                    child = node.children[code] = _Node()
+                node = child
+            if node is not root:
+                node.outputs.append(index)
+
+        # 广度优先为每个节点的子节点寻找空位，同时得到fail的计算顺序
+        alphabet_size = len(codes)
+        used = bytearray(b"\x01") + bytearray(alphabet_size + 1)  # 根节点占用0号位置，末尾始终预留一个字母表长度的空位
+        base = array("i", [0]) * len(used)
+        check = array("i", [-1]) * len(used)
+        check[0] = -2
+        order = []
+        single_free = 1  # 单个子节点只需要一个空位，从最左边的空位开始填充
+        multi_free = 1  # 多个子节点的查找起点，空位稀疏时右移，避免反复尝试左侧零散的空位
+        queue = deque([root])
+        while queue:
+            node = queue.popleft()
+            order.append(node)
+            if not node.children:
+                continue
+            child_codes = sorted(node.children)
+            first = child_codes[0]
+            if len(child_codes) == 1:
+                single_free = used.find(0, single_free)
+                b = used.find(0, max(single_free, first + 1)) - first
+            else:
+                pos = max(multi_free, first + 1)
+                tries = 0
+                while True:
+                    pos = used.find(0, pos)
+                    b = pos - first
+                    for c in child_codes:
+                        if used[b + c]:
+                            break
+                    else:
+                        break
+                    pos += 1
+                    tries += 1
+                if tries > 16:
+                    multi_free = pos
+            for c in child_codes:
+                child = node.children[c]
+                child.slot = b + c
+                used[b + c] = 1
+                check[b + c] = node.slot
+                queue.append(child)
+            base[node.slot] = b
+            grow = b + child_codes[-1] + alphabet_size + 1 - len(used)
+            if grow > 0:
+                grow = max(grow, len(used) // 4)
+                used.extend(bytearray(grow))
+                base.extend(array("i", [0]) * grow)
+                check.extend(array("i", [-1]) * grow)
+
+        # 去掉末尾多余的空位，保留足够的长度保证任意状态base[s]+c都不越界
+        size = max(max(base) + alphabet_size + 1, used.rfind(1) + 1)
+        del base[size:], check[size:]
+        fail = array("i", [0]) * size
+        out_head = array("i", [-1]) * size
+        out_word = array("i")
+        out_next = array("i")
+        root.fail = root
+        for node in order:
+            for code, child in node.children.items():
+                f = node.fail
+                while f is not root and code not in f.children:
+                    f = f.fail
+                child.fail = f.children[code] if node is not root and code in f.children else root
+                fail[child.slot] = child.fail.slot
+            # 输出链表：先是本节点的关键词，再接上失配节点的整条链表(共享后缀)
+            head = out_head[node.fail.slot] if node is not root else -1
+            for index in reversed(node.outputs):
+                out_word.append(index)
+                out_next.append(head)
+                head = len(out_word) - 1
+            out_head[node.slot] = head
+
+        self._keywords = keywords
+        self._lengths = [len(word) for word in keywords]
+        self._codes = codes
+        self._base = base
+        self._check = check
+        self._fail = fail
+        self._out_head = out_head
+        self._out_word = out_word
+        self._out_next = out_next
+        self._mmap = None
+        self.digest = keywords_digest(keywords)
+
+    def _matches(self, text):
+        """
+        依次产出(结束下标, 状态)，只产出有关键词结束的位置
+        """
+        base, check, fail, out_head = self._base, self._check, self._fail, self._out_head
+        s = 0
+        for i, code in enumerate(map(self._codes.get, text)):
+            if code is None:
+                s = 0
+                continue
+            t = base[s] + code
+            while check[t] != s:
+                if not s:
+                    break
+                s = fail[s]
+                t = base[s] + code
+            else:
+                s = t
+            if out_head[s] >= 0:
+                yield i, s
+
+    def _scan(self, text, s):
+        """
+        从状态s开始扫描整段文本
+        :return: ([(结束下标, 状态)], 扫描结束时的状态)
+        """
+        base, check, fail, out_head = self._base, self._check, self._fail, self._out_head
+        ends = []
+        for i, code in enumerate(map(self._codes.get, text)):
+            if code is None:
+                s = 0
+                continue
+            t = base[s] + code
+            while check[t] != s:
+                if not s:
+                    break
+                s = fail[s]
+                t = base[s] + code
+            else:
+                s = t
+            if out_head[s] >= 0:
+                ends.append((i, s))
+        return ends, s
+
+    def _depth(self, s):
+        """
+        状态对应的字典树深度，即已匹配的敏感词前缀长度
+        """
+        check = self._check
+        depth = 0
+        while s > 0:
+            s = check[s]
+            depth += 1
+        return depth
+
+    def stream(self, replaceChar="*", block=False):
+        """
+        创建流式过滤器，在多段文本之间保持匹配状态
+        :param block: 为True时匹配到敏感词后不再输出任何内容，否则替换为replaceChar
+        """
+        return WordsStream(self, replaceChar, block)
+
+    def _result(self, index, end):
+        keyword = self._keywords[index]
+        return {"Keyword": keyword, "Success": True, "End": end, "Start": end + 1 - len(keyword), "Index": index}
+
+    def FindFirst(self, text):
+        for end, s in self._matches(text):
+            return self._result(self._out_word[self._out_head[s]], end)
+        return None
+
+    def FindAll(self, text):
+        results = []
+        out_head, out_word, out_next = self._out_head, self._out_word, self._out_next
+        for end, s in self._matches(text):
+            k = out_head[s]
+            while k >= 0:
+                results.append(self._result(out_word[k], end))
+                k = out_next[k]
+        return results
+
+    def ContainsAny(self, text):
+        for _ in self._matches(text):
+            return True
+        return False
+
+    def Replace(self, text, replaceChar="*"):
+        result = list(text)
+        out_head, out_word, lengths = self._out_head, self._out_word, self._lengths
+        for end, s in self._matches(text):
+            # 替换在此结束的最长关键词
+            for j in range(end + 1 - lengths[out_word[out_head[s]]], end + 1):
+                result[j] = replaceChar
+        return "".join(result)
+
+    def save(self, path):
+        """
+        保存到磁盘，先写临时文件再替换，避免其他进程读到不完整的文件
+        """
+        alphabet = sorted(self._codes, key=self._codes.get)
+        meta = {
+            "digest": self.digest,
+            "byteorder": sys.byteorder,
+            "keywords": self._keywords,
+            "alphabet": "".join(alphabet),
+            "size": len(self._check),
+            "outputs": len(self._out_word),
+        }
+        meta = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+        meta += b" " * (-(len(meta) + _HEADER.size) % 4)  # 数组按4字节对齐
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, len(meta)))
+            f.write(meta)
+            for arr in (self._base, self._check, self._fail, self._out_head, self._out_word, self._out_next):
+                arr = arr if isinstance(arr, array) else array("i", arr)
+                arr.tofile(f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        以mmap方式加载save保存的文件，数组直接映射到文件内容
+        """
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, meta_len = _HEADER.unpack_from(mm, 0)
+            if magic != MAGIC:
+                raise ValueError("invalid words cache file: {}".format(path))
+            meta = json.loads(mm[_HEADER.size : _HEADER.size + meta_len].decode("utf-8"))
+            if meta["byteorder"] != sys.byteorder:
+                raise ValueError("words cache file byteorder mismatch: {}".format(path))
+            view = memoryview(mm)[_HEADER.size + meta_len :].cast("i")
+            size, outputs = meta["size"], meta["outputs"]
+            if len(view) != size * 4 + outputs * 2:
+                raise ValueError("words cache file truncated: {}".format(path))
+        except Exception:
+            mm.close()
+            raise
+        search = cls()
+        search._keywords = meta["keywords"]
+        search._lengths = [len(word) for word in search._keywords]
+        search._codes = {ch: i + 1 for i, ch in enumerate(meta["alphabet"])}
+        search._base = view[0:size]
+        search._check = view[size : size * 2]
+        search._fail = view[size * 2 : size * 3]
+        search._out_head = view[size * 3 : size * 4]
+        search._out_word = view[size * 4 : size * 4 + outputs]
+        search._out_next = view[size * 4 + outputs :]
+        search._mmap = mm
+        search.digest = meta["digest"]
+        return search
+
+
+class WordsStream(object):
+    """
+    流式敏感词过滤：逐段输入文本，只扫描新输入的部分，跨段的敏感词同样能匹配和替换。
+    末尾可能是敏感词前缀的字符暂不输出，等后续文本确定后再输出，以句子结束符等不在词库中的字符结尾时不会保留
+    """
+
+    def __init__(self, search: CompactWordsSearch, replaceChar="*", block=False):
+        self.search = search
+        self.replaceChar = replaceChar
+        self.block = block
+        self.matches = []  # 已匹配到的敏感词
+        self.blocked = False
+        self.closed = False
+        self._state = 0
+        self._pending = []  # 暂不输出的字符
+
+    def feed(self, text):
+        """
+        :return: 可以输出的文本，敏感词已替换；block模式下匹配到敏感词后返回None
+        """
+        if self.blocked:
+            return None
+        search = self.search
+        ends, self._state = search._scan(text, self._state)
+        chars = self._pending + list(text)
+        if ends:
+            offset = len(self._pending)
+            for end, s in ends:
+                word = search._keywords[search._out_word[search._out_head[s]]]
+                self.matches.append(word)
+                end += offset
+                for j in range(end + 1 - len(word), end + 1):
+                    chars[j] = self.replaceChar
+            if self.block:
+                self.blocked = True
+                self._pending = []
+                return None
+        hold = search._depth(self._state)
+        self._pending = chars[len(chars) - hold :] if hold else []
+        return "".join(chars[: len(chars) - hold])
+
+    def feed_batch(self, texts):
+        """
+        依次输入多段文本
+        :return: 每段对应的输出，与feed一致
+        """
+        return [self.feed(text) for text in texts]
+
+    def flush(self):
+        """
+        输入结束，返回剩余暂存的文本
+        """
+        self.closed = True
+        if self.blocked:
+            return None
+        rest = "".join(self._pending)
+        self._pending = []
+        self._state = 0
+        return rest
+
+
+def load_or_build(keywords, cache_path=None) -> CompactWordsSearch:
+    """
+    优先加载缓存文件，关键词有变化或缓存不可用时重新构建并写入缓存
+    :param cache_path: 缓存文件路径，为None时不使用缓存
+    """
+    keywords = list(keywords)
+    if cache_path and os.path.exists(cache_path):
+        try:
+            search = CompactWordsSearch.load(cache_path)
+            if search.digest == keywords_digest(keywords):
+                return search
+        except Exception:
+            pass
+    search = CompactWordsSearch()
+    search.SetKeywords(keywords)
+    if cache_path:
+        try:
+            search.save(cache_path)
+        except OSError:
+            pass
+    return search
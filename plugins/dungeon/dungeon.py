@@ -5,8 +5,8 @@ from bridge.bridge import Bridge
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common import const
-from common.expired_dict import ExpiredDict
 from common.log import logger
+from common.ttl_cache import TTLCache
 from config import conf
 from plugins import *
 
@@ -54,10 +54,11 @@ class Dungeon(Plugin):
     def __init__(self):
         super().__init__()
         self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context
+        self.context_types[Event.ON_HANDLE_CONTEXT] = [ContextType.TEXT]
         logger.info("[Dungeon] inited")
         # 目前没有设计session过期事件，这里先暂时使用过期字典
         if conf().get("expires_in_seconds"):
-            self.games = ExpiredDict(conf().get("expires_in_seconds"))
+            self.games = TTLCache(conf().get("expires_in_seconds"))
         else:
             self.games = dict()
 
@@ -13,8 +13,11 @@ from bridge.bridge import Bridge
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common import const
+from common.thread_pool import reload_thread_pools, thread_pool_metrics
 from config import conf, load_config, global_config
 from plugins import *
+from plugins.plugin_guard import circuit_breaker
+from plugins.plugin_metrics import plugin_metrics
 
 # 定义指令集
 COMMANDS = {
@@ -131,6 +134,15 @@ ADMIN_COMMANDS = {
         "alias": ["debug", "调试模式", "DEBUG"],
         "desc": "开启机器调试日志",
     },
+    "pool": {
+        "alias": ["pool", "线程池"],
+        "desc": "查看消息处理线程池状态",
+    },
+    "pstat": {
+        "alias": ["pstat", "插件统计"],
+        "args": ["reset(可选)"],
+        "desc": "查看各插件的处理耗时、异常、超时和中断次数，reset清空统计并恢复被暂停的插件",
+    },
 }
 
 def generate_temporary_password(length=12):
@@ -245,6 +257,7 @@ class Godcmd(Plugin):
         global_config["admin_users"] = self.admin_users
         self.isrunning = True  # 机器人是否运行中
 
+        # 停止运行后需要拦截所有类型的消息，不按ContextType过滤
         self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context
         logger.info("[Godcmd] inited")
 
@@ -375,7 +388,15 @@ class Godcmd(Plugin):
                             ok, result = True, "服务已恢复"
                         elif cmd == "reconf":
                             load_config()
+                            reload_thread_pools()
+                            # 只重建配置发生变化的bot和插件，会话和连接保持不变
+                            bots = Bridge().reset_bot()
+                            instances = dict(PluginManager().instances)
+                            PluginManager().activate_plugins()
+                            plugins = [name for name, instance in PluginManager().instances.items() if instances.get(name) is not instance]
                             ok, result = True, "配置已重载"
+                            if bots or plugins:
+                                result += "，已重建: " + ", ".join(bots + plugins)
                         elif cmd == "resetall":
                             if bottype in [const.OPEN_AI, const.CHATGPT, const.CHATGPTONAZURE, const.LINKAI, const.DIFY, const.COZE,
                                            const.BAIDU, const.XUNFEI, const.QWEN, const.GEMINI, const.ZHIPU_AI, const.MOONSHOT,
@@ -392,13 +413,37 @@ class Godcmd(Plugin):
                             else:
                                 logger.setLevel(logging.DEBUG)
                                 ok, result = True, "DEBUG模式已开启"
+                        elif cmd == "pool":
+                            ok = True
+                            result = "线程池状态：\n"
+                            for name, m in thread_pool_metrics().items():
+                                result += f"{name}: 线程 {m['workers']}/{m['max_workers']}, 处理中 {m['active']}, 排队 {m['queued']}, 已完成 {m['completed']}, 已拒绝 {m['rejected']}\n"
+                            channel = e_context["channel"]
+                            if hasattr(channel, "queue_metrics"):
+                                q = channel.queue_metrics()
+                                result += f"消息队列: 会话 {q['sessions']}, 排队 {q['queued']}, 丢弃 {q['shed']}, 过期 {q['expired']}, 合并 {q['merged']}\n"
+                        elif cmd == "pstat":
+                            if args and args[0] == "reset":
+                                plugin_metrics.reset()
+                                circuit_breaker.reset()
+                                ok, result = True, "插件统计已清空"
+                            else:
+                                ok = True
+                                result = "插件统计(次数/异常/超时/中断/放行, 平均/P99/最大耗时)：\n"
+                                for name, events in plugin_metrics.snapshot().items():
+                                    for event, m in events.items():
+                                        result += f"{name} {event}: {m['calls']}/{m['errors']}/{m['timeouts']}/{m['breaks']}/{m['passes']}, {m['avg'] * 1000:.1f}/{m['p99'] * 1000:.0f}/{m['max'] * 1000:.1f}ms\n"
+                                for name, remain in circuit_breaker.status().items():
+                                    result += f"{name} 连续失败已暂停，{remain:.0f}秒后恢复\n"
                         elif cmd == "plist":
                             plugins = PluginManager().list_plugins()
                             ok = True
                             result = "插件列表：\n"
                             for name, plugincls in plugins.items():
                                 result += f"{plugincls.name}_v{plugincls.version} {plugincls.priority} - "
-                                if plugincls.enabled:
+                                if plugincls.enabled and name in PluginManager().load_times:
+                                    result += f"已启用, 加载耗时{PluginManager().load_times[name]:.2f}s\n"
+                                elif plugincls.enabled:
                                     result += "已启用\n"
                                 else:
                                     result += "未启用\n"
@@ -1,14 +1,36 @@
 # encoding:utf-8
 
+import io
 import json
 import os
-import requests
 import plugins
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
+from common import const
 from common.log import logger
+from config import conf, get_appdata_dir
 from plugins import *
-import random
+
+from .keyword_index import KeywordIndex, load_rules
+from .media_store import MediaStore
+
+IMAGE_EXTS = (".jpg", ".webp", ".jpeg", ".png", ".gif", ".img")
+FILE_EXTS = (".pdf", ".doc", ".docx", ".xls", "xlsx", ".zip", ".rar")
+VIDEO_EXTS = (".mp4",)
+
+
+def _media_type(reply_text):
+    """
+    以http://或https://开头时按后缀判断为图片、文件或视频链接，否则为普通文本
+    """
+    if reply_text.startswith("http://") or reply_text.startswith("https://"):
+        if reply_text.endswith(IMAGE_EXTS):
+            return ReplyType.IMAGE_URL
+        if reply_text.endswith(FILE_EXTS):
+            return ReplyType.FILE
+        if reply_text.endswith(VIDEO_EXTS):
+            return ReplyType.VIDEO_URL
+    return ReplyType.TEXT
 
 
 @plugins.register(
@@ -35,11 +57,15 @@ class Keyword(Plugin):
                 logger.debug(f"[keyword]加载配置文件{config_path}")
                 with open(config_path, "r", encoding="utf-8") as f:
                     conf = json.load(f)
-            # 加载关键词
-            self.keyword = conf["keyword"]
-
-            logger.info("[keyword] {}".format(self.keyword))
+            # 加载关键词，编译为索引
+            self.index = KeywordIndex(load_rules(conf))
+            logger.info("[keyword] {} rules loaded".format(len(self.index)))
             self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context
+            self.context_types[Event.ON_HANDLE_CONTEXT] = [ContextType.TEXT]
+            # 预先下载规则中的图片和文件，匹配时直接读取本地缓存
+            self.media = MediaStore(os.path.join(get_appdata_dir(), "keyword_media"))
+            urls = [url for rule in self.index.rules for url in rule.replies() if _media_type(url) in (ReplyType.IMAGE_URL, ReplyType.FILE)]
+            self.media.preload(urls)
             logger.info("[keyword] inited.")
         except Exception as e:
             logger.warn("[keyword] init failed, ignore or see https://github.com/zhayujie/chatgpt-on-wechat/tree/master/plugins/keyword .")
@@ -51,51 +77,31 @@ class Keyword(Plugin):
 
         content = e_context["context"].content.strip()
         logger.debug("[keyword] on_handle_context. content: %s" % content)
-        if content in self.keyword:
-            logger.info(f"[keyword] 匹配到关键字【{content}】")
-            reply_text = self.keyword[content]
+        rule = self.index.match(content)
+        if rule is not None:
+            logger.info(f"[keyword] 匹配到关键字【{rule.pattern}】({rule.type})")
+            # 如果关键词对应的是一个列表，则随机选择列表中的一个元素
+            e_context["reply"] = self._build_reply(rule.pick_reply())
+            e_context.action = EventAction.BREAK_PASS  # 事件结束，并跳过处理context的默认逻辑
 
-            if isinstance(reply_text, list):
-                # 如果关键词对应的是一个列表，则随机选择列表中的一个元素
-                reply_text = random.choice(reply_text)
+    def _build_reply(self, reply_text):
+        reply_type = _media_type(reply_text)
+        if reply_type == ReplyType.IMAGE_URL:
+            # 图片已缓存时直接发送本地文件，飞书通道只支持图片链接
+            path = self.media.get(reply_text)
+            if path and conf().get("channel_type") != const.FEISHU:
+                with open(path, "rb") as f:
+                    return Reply(ReplyType.IMAGE, io.BytesIO(f.read()))
+            return Reply(ReplyType.IMAGE_URL, reply_text)
+        elif reply_type == ReplyType.FILE:
+            # 文件未缓存时下载到缓存目录，之后的匹配不再下载
+            try:
+                return Reply(ReplyType.FILE, self.media.fetch(reply_text))
+            except Exception as e:
+                logger.warning("[keyword] download {} failed: {}".format(reply_text, e))
+                return Reply(ReplyType.TEXT, reply_text)
+        return Reply(reply_type, reply_text)
 
-            # 判断匹配内容的类型
-            if (reply_text.startswith("http://") or reply_text.startswith("https://")) and any(reply_text.endswith(ext) for ext in [".jpg", ".webp", ".jpeg", ".png", ".gif", ".img"]):
-            # 如果是以 http:// 或 https:// 开头，且".jpg", ".jpeg", ".png", ".gif", ".img"结尾，则认为是图片 URL。
-                reply = Reply()
-                reply.type = ReplyType.IMAGE_URL
-                reply.content = reply_text
-                
-            elif (reply_text.startswith("http://") or reply_text.startswith("https://")) and any(reply_text.endswith(ext) for ext in [".pdf", ".doc", ".docx", ".xls", "xlsx",".zip", ".rar"]):
-            # 如果是以 http:// 或 https:// 开头，且".pdf", ".doc", ".docx", ".xls", "xlsx",".zip", ".rar"结尾，则下载文件到tmp目录并发送给用户
-                file_path = "tmp"
-                if not os.path.exists(file_path):
-                    os.makedirs(file_path)
-                file_name = reply_text.split("/")[-1]  # 获取文件名
-                file_path = os.path.join(file_path, file_name)
-                response = requests.get(reply_text)
-                with open(file_path, "wb") as f:
-                    f.write(response.content)
-                #channel/wechat/wechat_channel.py和channel/wechat_channel.py中缺少ReplyType.FILE类型。
-                reply = Reply()
-                reply.type = ReplyType.FILE
-                reply.content = file_path
-            
-            elif (reply_text.startswith("http://") or reply_text.startswith("https://")) and any(reply_text.endswith(ext) for ext in [".mp4"]):
-            # 如果是以 http:// 或 https:// 开头，且".mp4"结尾，则下载视频到tmp目录并发送给用户
-                reply = Reply()
-                reply.type = ReplyType.VIDEO_URL
-                reply.content = reply_text
-                
-            else:
-            # 否则认为是普通文本
-                reply = Reply()
-                reply.type = ReplyType.TEXT
-                reply.content = reply_text
-            
-            e_context["reply"] = reply
-            e_context.action = EventAction.BREAK_PASS  # 事件结束，并跳过处理context的默认逻辑
-            
     def get_help_text(self, **kwargs):
         help_text = "关键词过滤"
         return help_text
@@ -0,0 +1,110 @@
+# encoding:utf-8
+
+import random
+import re
+
+from common.aho_corasick import AhoCorasick
+
+# 优先级相同时按匹配方式排序：完全匹配 > 前缀 > 包含 > 正则
+RULE_TYPES = ("exact", "prefix", "contains", "regex")
+
+
+class KeywordRule(object):
+    __slots__ = ("type", "pattern", "reply", "priority", "order", "regex", "key")
+
+    def __init__(self, type, pattern, reply, priority=0, order=0):
+        if type not in RULE_TYPES:
+            raise ValueError("unknown keyword rule type: {}".format(type))
+        self.type = type
+        self.pattern = pattern
+        self.reply = reply  # 回复内容，列表时随机选择一个
+        self.priority = priority
+        self.order = order
+        self.regex = re.compile(pattern) if type == "regex" else None
+        self.key = (-priority, RULE_TYPES.index(type), order)  # 越小越优先
+
+    def pick_reply(self):
+        return random.choice(self.reply) if isinstance(self.reply, list) else self.reply
+
+    def replies(self):
+        return self.reply if isinstance(self.reply, list) else [self.reply]
+
+
+def load_rules(conf: dict) -> list:
+    """
+    读取插件配置中的规则，keyword为旧格式的完全匹配，rules为新格式:
+    {"type": "exact/prefix/contains/regex", "pattern": "...", "reply": "..."或[...], "priority": 0}
+    """
+    rules = []
+    for pattern, reply in (conf.get("keyword") or {}).items():
+        rules.append(KeywordRule("exact", pattern, reply, order=len(rules)))
+    for item in conf.get("rules") or []:
+        rules.append(KeywordRule(item.get("type", "exact"), item["pattern"], item["reply"], item.get("priority", 0), len(rules)))
+    return rules
+
+
+def _better(rule, best):
+    return best is None or rule.key < best.key
+
+
+class KeywordIndex(object):
+    """
+    关键词规则编译后的索引：完全匹配用字典，前缀用字典树，包含用AC自动机，正则按优先级依次尝试，
+    返回优先级最高的一条规则
+    """
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self._exact = {}
+        self._prefix = {}
+        contains = {}
+        regex = []
+        for rule in self.rules:
+            if rule.type == "exact":
+                if _better(rule, self._exact.get(rule.pattern)):
+                    self._exact[rule.pattern] = rule
+            elif rule.type == "prefix":
+                node = self._prefix
+                for ch in rule.pattern:
+                    node = node.setdefault(ch, {})
+                if _better(rule, node.get(None)):
+                    node[None] = rule  # None键存放在此结束的前缀规则
+            elif rule.type == "contains":
+                if rule.pattern and _better(rule, contains.get(rule.pattern)):
+                    contains[rule.pattern] = rule
+            else:
+                regex.append(rule)
+        self._contains = contains
+        self._automaton = AhoCorasick(contains.keys()) if contains else None
+        self._regex = sorted(regex, key=lambda r: r.key)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def match(self, content):
+        """
+        :return: 匹配到的优先级最高的规则，没有时返回None
+        """
+        best = self._exact.get(content)
+        node = self._prefix
+        if None in node and _better(node[None], best):  # 空前缀匹配任意内容
+            best = node[None]
+        for ch in content:
+            node = node.get(ch)
+            if node is None:
+                break
+            rule = node.get(None)
+            if rule is not None and _better(rule, best):
+                best = rule
+        if self._automaton is not None:
+            for _, word in self._automaton.iter(content):
+                rule = self._contains[word]
+                if _better(rule, best):
+                    best = rule
+        for rule in self._regex:
+            if best is not None and best.key < rule.key:
+                break  # 剩余正则规则的优先级都更低
+            if rule.regex.search(content):
+                best = rule
+                break
+        return best
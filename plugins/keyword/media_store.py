@@ -0,0 +1,111 @@
+# encoding:utf-8
+
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import Future
+from urllib.parse import unquote, urlparse
+
+import requests
+
+from common.log import logger
+from common.thread_pool import get_thread_pool
+
+
+class MediaStore(object):
+    """
+    按内容寻址的媒体文件缓存：文件保存在 <root>/<sha256>/<原文件名>，内容相同的文件只存一份，
+    url到文件的映射保存在index.json中，重启后无需重新下载
+    """
+
+    def __init__(self, root, timeout=30):
+        self.root = root
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._pending = {}  # url -> 下载中的future，其他线程等待同一个下载结果
+        self._index_path = os.path.join(root, "index.json")
+        self._index = {}  # url -> 相对root的文件路径
+        os.makedirs(root, exist_ok=True)
+        try:
+            with open(self._index_path, "r", encoding="utf-8") as f:
+                self._index = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def get(self, url):
+        """
+        :return: 已缓存的本地文件路径，未缓存时返回None
+        """
+        relpath = self._index.get(url)
+        if relpath is None:
+            return None
+        path = os.path.join(self.root, relpath)
+        return path if os.path.exists(path) else None
+
+    def fetch(self, url):
+        """
+        获取本地文件路径，未缓存时在当前线程下载，同一url同时只下载一次
+        """
+        path = self.get(url)
+        if path:
+            return path
+        with self._lock:
+            future = self._pending.get(url)
+            owner = future is None
+            if owner:
+                future = self._pending[url] = Future()
+        if not owner:
+            return future.result()
+        try:
+            path = self._download(url)
+            future.set_result(path)
+            return path
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(url, None)
+
+    def preload(self, urls):
+        """
+        在后台下载所有未缓存的url
+        """
+        missing = [url for url in dict.fromkeys(urls) if not self.get(url)]
+        if missing:
+            logger.info("[keyword] preloading {} media files".format(len(missing)))
+        for url in missing:
+            get_thread_pool("image_download").submit(self._preload_one, url)
+
+    def _preload_one(self, url):
+        try:
+            self.fetch(url)
+        except Exception as e:
+            logger.warning("[keyword] preload {} failed: {}".format(url, e))
+
+    def _download(self, url):
+        response = requests.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        content = response.content
+        digest = hashlib.sha256(content).hexdigest()
+        name = os.path.basename(unquote(urlparse(url).path)) or "file"
+        relpath = os.path.join(digest, name)
+        path = os.path.join(self.root, relpath)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = "{}.{}.tmp".format(path, threading.get_ident())
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        with self._lock:
+            self._index[url] = relpath
+            self._save_index()
+        logger.debug("[keyword] cached {} -> {}".format(url, path))
+        return path
+
+    def _save_index(self):
+        tmp_path = self._index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._index, f, ensure_ascii=False)
+        os.replace(tmp_path, self._index_path)
@@ -5,7 +5,7 @@ from plugins import *
 from .midjourney import MJBot
 from .summary import LinkSummary
 from bridge import bridge
-from common.expired_dict import ExpiredDict
+from common.ttl_cache import TTLCache
 from common import const
 import os
 from .utils import Util
@@ -334,4 +334,4 @@ def _find_file_id(context):
         return USER_FILE_MAP.get(user_id + "-file_id")
 
 
-USER_FILE_MAP = ExpiredDict(conf().get("expires_in_seconds") or 60 * 30)
+USER_FILE_MAP = TTLCache(conf().get("expires_in_seconds") or 60 * 30)
@@ -7,6 +7,8 @@ from common.log import logger
 class Plugin:
     def __init__(self):
         self.handlers = {}
+        # 各事件关注的消息类型，如 {Event.ON_HANDLE_CONTEXT: [ContextType.TEXT]}，其他类型的消息不会触发该事件的处理函数
+        self.context_types = {}
 
     def load_config(self) -> dict:
         """
@@ -0,0 +1,132 @@
+# encoding:utf-8
+
+import copy
+import threading
+import time
+from concurrent.futures import TimeoutError
+
+from bridge.context import Context
+from bridge.reply import Reply
+from common.log import logger
+from common.thread_pool import get_thread_pool
+from config import conf
+
+from .event import EventContext
+
+
+class PluginTimeoutError(TimeoutError):
+    pass
+
+
+class CircuitBreaker(object):
+    """
+    插件熔断器：连续失败(超时或异常)达到阈值后暂停插件，暂停时间每次翻倍，
+    到期后放行一次试探调用，成功则恢复，失败则继续暂停
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._failures = {}  # 插件名 -> 连续失败次数
+        self._trips = {}  # 插件名 -> 连续熔断次数，用于计算暂停时间
+        self._open_until = {}  # 插件名 -> 暂停截止时间
+        self._probing = set()  # 正在试探的插件
+
+    def allow(self, name) -> bool:
+        open_until = self._open_until.get(name)
+        if open_until is None:
+            return True
+        with self._lock:
+            if time.monotonic() < self._open_until.get(name, 0) or name in self._probing:
+                return False
+            self._probing.add(name)  # 暂停到期，只放行一次试探调用
+            return True
+
+    def record_success(self, name):
+        if name not in self._failures and name not in self._open_until:
+            return
+        with self._lock:
+            self._failures.pop(name, None)
+            self._probing.discard(name)
+            if self._open_until.pop(name, None) is not None:
+                self._trips.pop(name, None)
+                logger.info("[PluginGuard] plugin {} recovered".format(name))
+
+    def record_failure(self, name):
+        threshold = conf().get("plugin_breaker_threshold", 3)
+        if not threshold or threshold <= 0:
+            return
+        with self._lock:
+            failures = self._failures.get(name, 0) + 1
+            self._failures[name] = failures
+            probing = name in self._probing
+            self._probing.discard(name)
+            if failures < threshold and not probing:
+                return
+            trips = self._trips.get(name, 0) + 1
+            self._trips[name] = trips
+            cooldown = conf().get("plugin_breaker_cooldown", 60) * 2 ** (trips - 1)
+            cooldown = min(cooldown, conf().get("plugin_breaker_max_cooldown", 3600))
+            self._open_until[name] = time.monotonic() + cooldown
+            self._failures[name] = 0
+        logger.warning("[PluginGuard] plugin {} failed {} times, suspended for {}s".format(name, failures, cooldown))
+
+    def status(self) -> dict:
+        """
+        :return: {插件名: 剩余暂停秒数}
+        """
+        now = time.monotonic()
+        with self._lock:
+            return {name: max(0, until - now) for name, until in self._open_until.items()}
+
+    def reset(self, name=None):
+        with self._lock:
+            for states in (self._failures, self._trips, self._open_until):
+                if name is None:
+                    states.clear()
+                else:
+                    states.pop(name, None)
+            if name is None:
+                self._probing.clear()
+            else:
+                self._probing.discard(name)
+
+
+def _shadow_copy(value):
+    # Context和Reply复制一份，kwargs中的消息对象、channel等无法复制，仍与原对象共享
+    if isinstance(value, (Context, Reply)):
+        shadow = copy.copy(value)
+        if isinstance(value, Context):
+            shadow.kwargs = dict(value.kwargs)
+        return shadow
+    return value
+
+
+def call_with_timeout(handler, e_context: EventContext, timeout, *args, **kwargs):
+    """
+    在plugin线程池中执行处理函数，最多等待timeout秒
+    处理函数操作的是e_context以及其中Context、Reply的副本，成功后才写回，超时放弃的处理函数之后再修改
+    e_context、context(type/content/kwargs)和reply不会影响后续流程；
+    context.kwargs中的消息对象、channel等只做浅拷贝，被放弃的处理函数修改这些对象仍然会生效
+    :raise PluginTimeoutError: 超时
+    """
+    originals = dict(e_context.econtext)
+    shadow = EventContext(e_context.event, {key: _shadow_copy(value) for key, value in originals.items()})
+    copies = {key: value for key, value in shadow.econtext.items() if value is not originals[key]}
+    shadow.action = e_context.action
+    future = get_thread_pool("plugin").submit(handler, shadow, *args, **kwargs)
+    try:
+        future.result(timeout)
+    except TimeoutError:
+        future.cancel()  # 还在排队时直接取消，已开始执行的无法中断，只能放弃结果
+        raise PluginTimeoutError("plugin handler timed out after {}s".format(timeout))
+    for key, value in copies.items():
+        if shadow.econtext.get(key) is value:
+            # 处理函数原地修改了副本，写回原对象，调用方持有的context、reply引用保持有效
+            vars(originals[key]).update(vars(value))
+            shadow.econtext[key] = originals[key]
+    e_context.econtext = shadow.econtext
+    e_context.action = shadow.action
+    return e_context
+
+
+circuit_breaker = CircuitBreaker()
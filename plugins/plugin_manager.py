@@ -1,17 +1,82 @@
 # encoding:utf-8
 
+import ast
+import hashlib
 import importlib
 import importlib.util
 import json
 import os
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from common.log import logger
 from common.singleton import singleton
 from common.sorted_dict import SortedDict
-from config import conf, remove_plugin_config, write_plugin_config
+from config import conf, record_config_reads, remove_plugin_config, write_plugin_config
 
 from .event import *
+from .plugin_guard import PluginTimeoutError, call_with_timeout, circuit_breaker
+from .plugin_metrics import plugin_metrics
+
+
+class LazyPlugin:
+    """
+    扫描插件时从源码中静态读取的插件元数据，插件开启时才导入模块，注册后被真正的插件类替换
+    """
+
+    lazy = True
+
+    def __init__(self, import_path, path, name, desire_priority=0, **kwargs):
+        self.import_path = import_path
+        self.path = path
+        self.name = name
+        self.priority = desire_priority
+        self.desc = kwargs.get("desc")
+        self.author = kwargs.get("author")
+        self.version = kwargs.get("version") if kwargs.get("version") != None else "1.0"
+        self.namecn = kwargs.get("namecn") if kwargs.get("namecn") != None else name
+        self.hidden = kwargs.get("hidden") if kwargs.get("hidden") != None else False
+        self.enabled = kwargs.get("enabled") if kwargs.get("enabled") != None else True
+
+
+def read_plugin_metadata(plugin_path):
+    """
+    不导入模块，解析插件目录下的py文件，读取@plugins.register装饰器的参数
+    :return: 参数字典列表，参数不是字面量或找不到注册的插件类时返回None，需要导入模块才能得到
+    """
+    metas = []
+    for filename in sorted(os.listdir(plugin_path)):
+        if not filename.endswith(".py"):
+            continue
+        try:
+            with open(os.path.join(plugin_path, filename), "r", encoding="utf-8") as f:
+                tree = ast.parse(f.read(), filename)
+        except (OSError, SyntaxError, UnicodeDecodeError):
+            return None
+        for node in tree.body:
+            if not isinstance(node, ast.ClassDef):
+                continue
+            for decorator in node.decorator_list:
+                if not isinstance(decorator, ast.Call):
+                    continue
+                func = decorator.func
+                func_name = func.attr if isinstance(func, ast.Attribute) else getattr(func, "id", None)
+                if func_name != "register":
+                    continue
+                try:
+                    kwargs = {kw.arg: ast.literal_eval(kw.value) for kw in decorator.keywords}
+                    args = [ast.literal_eval(arg) for arg in decorator.args]
+                except ValueError:
+                    return None
+                if None in kwargs:  # **kwargs
+                    return None
+                kwargs.update(zip(("name", "desire_priority"), args))
+                if not isinstance(kwargs.get("name"), str):
+                    return None
+                metas.append(kwargs)
+    return metas or None
 
 
 @singleton
@@ -20,24 +85,37 @@ class PluginManager:
         self.plugins = SortedDict(lambda k, v: v.priority, reverse=True)
         self.listening_plugins = {}
         self.instances = {}
+        self.dispatch_table = {}  # event -> 按优先级排好序的(插件名, 处理函数, 关注的ContextType, 超时时间)元组，插件变化时重建
         self.pconf = {}
         self.current_plugin_path = None
         self.loaded = {}
+        self.plugin_paths = {}  # 插件模块导入路径 -> 插件目录，延迟导入的插件注册时使用
+        self.load_times = {}  # 插件名 -> 最近一次导入和初始化的耗时(秒)
+        self.instance_deps = {}  # 插件名 -> (插件配置摘要, 初始化时读取的全局配置项)，用于判断重载时是否需要重建实例
+        self._register_lock = threading.Lock()
 
     def register(self, name: str, desire_priority: int = 0, **kwargs):
         def wrapper(plugincls):
+            # 延迟导入时可能在多个线程中并发注册，插件目录优先由模块路径得出
+            path = self.plugin_paths.get(".".join(plugincls.__module__.split(".")[:2])) or self.current_plugin_path
             plugincls.name = name
             plugincls.priority = desire_priority
             plugincls.desc = kwargs.get("desc")
             plugincls.author = kwargs.get("author")
-            plugincls.path = self.current_plugin_path
+            plugincls.path = path
             plugincls.version = kwargs.get("version") if kwargs.get("version") != None else "1.0"
             plugincls.namecn = kwargs.get("namecn") if kwargs.get("namecn") != None else name
             plugincls.hidden = kwargs.get("hidden") if kwargs.get("hidden") != None else False
             plugincls.enabled = kwargs.get("enabled") if kwargs.get("enabled") != None else True
-            if self.current_plugin_path == None:
+            if path == None:
                 raise Exception("Plugin path not set")
-            self.plugins[name.upper()] = plugincls
+            with self._register_lock:
+                placeholder = self.plugins.get(name.upper())
+                if getattr(placeholder, "lazy", False):
+                    # 沿用扫描时从plugins.json读取的开关和优先级
+                    plugincls.enabled = placeholder.enabled
+                    plugincls.priority = placeholder.priority
+                self.plugins[name.upper()] = plugincls
             logger.info("Plugin %s_v%s registered, path=%s" % (name, plugincls.version, plugincls.path))
 
         return wrapper
@@ -72,6 +150,7 @@ class PluginManager:
         插件实例中通过 config.pconf(plugin_name) 即可获取该插件的配置
         """
         all_config_path = "./plugins/config.json"
+        all_conf = {}
         try:
             if os.path.exists(all_config_path):
                 # read from all plugins config
@@ -83,6 +162,33 @@ class PluginManager:
                 write_plugin_config(all_conf)
         except Exception as e:
             logger.error(e)
+        return {k.lower(): v for k, v in all_conf.items()}
+
+    @staticmethod
+    def _config_digest(plugincls, all_conf: dict):
+        """
+        插件配置的摘要，优先取 plugins/config.json 中的配置，否则取插件目录下的 config.json
+        """
+        name = plugincls.name.lower()
+        if all_conf.get(name):
+            return json.dumps(all_conf[name], sort_keys=True, ensure_ascii=False)
+        try:
+            with open(os.path.join(plugincls.path, "config.json"), "rb") as f:
+                return hashlib.sha256(f.read()).hexdigest()
+        except OSError:
+            return None
+
+    def _is_stale(self, name, plugincls, all_conf: dict) -> bool:
+        """
+        插件是否需要(重新)实例化：尚未实例化、模块已重新加载，或插件配置、初始化时读取的全局配置发生了变化
+        """
+        instance = self.instances.get(name)
+        if instance is None or type(instance) is not plugincls:
+            return True
+        if name not in self.instance_deps:
+            return False
+        digest, deps = self.instance_deps[name]
+        return digest != self._config_digest(plugincls, all_conf) or bool(deps.changed())
 
     def scan_plugins(self):
         logger.info("Scaning plugins ...")
@@ -96,6 +202,15 @@ class PluginManager:
                 if os.path.isfile(main_module_path):
                     # 导入插件
                     import_path = "plugins.{}".format(plugin_name)
+                    self.plugin_paths[import_path] = plugin_path
+                    if plugin_path not in self.loaded and conf().get("plugin_lazy_import", True):
+                        metas = read_plugin_metadata(plugin_path)
+                        if metas is not None:
+                            for meta in metas:
+                                if meta["name"].upper() not in self.plugins:
+                                    self.plugins[meta["name"].upper()] = LazyPlugin(import_path, plugin_path, **meta)
+                                    logger.info("Plugin %s_v%s found, path=%s" % (meta["name"], meta.get("version") or "1.0", plugin_path))
+                            continue
                     try:
                         self.current_plugin_path = plugin_path
                         if plugin_path in self.loaded:
@@ -108,10 +223,11 @@ class PluginManager:
                                     importlib.reload(sys.modules[name])
                         else:
                             self.loaded[plugin_path] = importlib.import_module(import_path)
-                        self.current_plugin_path = None
                     except Exception as e:
                         logger.warn("Failed to import plugin %s: %s" % (plugin_name, e))
                         continue
+                    finally:
+                        self.current_plugin_path = None
         pconf = self.pconf
         news = [self.plugins[name] for name in self.plugins]
         new_plugins = list(set(news) - set(raws))
@@ -136,43 +252,104 @@ class PluginManager:
     def refresh_order(self):
         for event in self.listening_plugins.keys():
             self.listening_plugins[event].sort(key=lambda name: self.plugins[name].priority, reverse=True)
+        self.rebuild_dispatch_table()
 
-    def activate_plugins(self):  # 生成新开启的插件实例
+    def rebuild_dispatch_table(self):
+        """
+        预先生成每个事件的处理函数列表，只包含已启用的插件，插件开启/关闭/重载/调整优先级后调用
+        """
+        table = {}
+        for event, names in self.listening_plugins.items():
+            handlers = []
+            for name in names:
+                instance = self.instances.get(name)
+                if not self.plugins[name].enabled or instance is None or event not in instance.handlers:
+                    continue
+                context_types = getattr(instance, "context_types", {}).get(event)
+                # plugins.json中可为单个插件设置timeout，覆盖全局的plugin_timeout
+                timeout = self.pconf.get("plugins", {}).get(self.plugins[name].name, {}).get("timeout")
+                handlers.append((name, instance.handlers[event], frozenset(context_types) if context_types else None, timeout))
+            if handlers:
+                table[event] = tuple(handlers)
+        self.dispatch_table = table
+
+    def activate_plugins(self, force=()):
+        """
+        生成新开启的插件实例，已有实例只在配置变化或模块重新加载后重建，新实例全部创建完成后再替换
+        :param force: 需要强制重建的插件名列表
+        :return: 初始化失败的插件名列表
+        """
         failed_plugins = []
-        self._load_all_config() # 重新读取全局插件配置，支持使用#reloadp命令对插件配置热更新
+        all_conf = self._load_all_config() # 重新读取全局插件配置，支持使用#reloadp命令对插件配置热更新
+        targets = []
         for name, plugincls in self.plugins.items():
             if plugincls.enabled:
                 if 'GODCMD' in self.instances and name == 'GODCMD':
                     continue
-                # if name not in self.instances:
-                try:
-                    instance = plugincls()
-                except Exception as e:
-                    logger.warn("Failed to init %s, diabled. %s" % (name, e))
-                    self.disable_plugin(name)
-                    failed_plugins.append(name)
-                    continue
-                if name in self.instances:
-                    self.instances[name].handlers.clear()
-                self.instances[name] = instance
-                for event in instance.handlers:
-                    if event not in self.listening_plugins:
-                        self.listening_plugins[event] = []
+                if name in force or self._is_stale(name, plugincls, all_conf):
+                    if name.lower() not in all_conf:
+                        remove_plugin_config(name)  # 丢弃缓存的插件目录配置，初始化时重新读取
+                    targets.append((name, plugincls))
+        if not targets:
+            self.refresh_order()
+            return failed_plugins
+        # 各插件相互独立，并发导入和初始化
+        workers = max(1, min(len(targets), conf().get("plugin_init_workers", 8)))
+        begin = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="plugin-init") as executor:
+            results = list(executor.map(lambda target: self._init_plugin(*target), targets))
+        for name, instance, cost, error, deps in results:
+            self.load_times[name] = cost
+            if getattr(self.plugins.get(name), "lazy", False):
+                # 与启动时导入失败的处理一致：移除该插件，安装依赖后可通过#scanp重新扫描
+                logger.warn("Failed to import plugin %s: %s" % (name, error))
+                del self.plugins[name]
+                failed_plugins.append(name)
+                continue
+            if error is not None:
+                logger.warn("Failed to init %s, diabled. %s" % (name, error))
+                self.disable_plugin(name)
+                failed_plugins.append(name)
+                continue
+            logger.info("Plugin %s activated in %.3fs" % (name, cost))
+            self.instance_deps[name] = (self._config_digest(self.plugins[name], all_conf), deps)
+            if name in self.instances:
+                self.instances[name].handlers.clear()
+            self.instances[name] = instance
+            for event in instance.handlers:
+                if event not in self.listening_plugins:
+                    self.listening_plugins[event] = []
+                if name not in self.listening_plugins[event]:  # 重新激活时避免重复注册
                     self.listening_plugins[event].append(name)
+        logger.info("%d plugins activated in %.3fs" % (len(results) - len(failed_plugins), time.perf_counter() - begin))
         self.refresh_order()
         return failed_plugins
 
+    def _init_plugin(self, name, plugincls):
+        """
+        导入(延迟导入的插件)并实例化插件
+        :return: (插件名, 实例, 耗时, 异常, 初始化时读取的全局配置项)
+        """
+        begin = time.perf_counter()
+        try:
+            if getattr(plugincls, "lazy", False):
+                import_path = plugincls.import_path
+                self.loaded[plugincls.path] = importlib.import_module(import_path)
+                plugincls = self.plugins.get(name)
+                if plugincls is None or getattr(plugincls, "lazy", False):
+                    raise Exception("plugin class not registered after importing %s" % import_path)
+            with record_config_reads() as deps:
+                instance = plugincls()
+        except Exception as e:
+            return name, None, time.perf_counter() - begin, e, None
+        return name, instance, time.perf_counter() - begin, None, deps
+
     def reload_plugin(self, name: str):
         name = name.upper()
         remove_plugin_config(name)
         if name in self.instances:
-            for event in self.listening_plugins:
-                if name in self.listening_plugins[event]:
-                    self.listening_plugins[event].remove(name)
-            if name in self.instances:
-                self.instances[name].handlers.clear()
-            del self.instances[name]
-            self.activate_plugins()
+            # 新实例创建完成后才替换旧实例，重载期间旧实例继续处理消息
+            self.activate_plugins(force=(name,))
             return True
         return False
 
@@ -189,15 +366,41 @@ class PluginManager:
         self.activate_plugins()
 
     def emit_event(self, e_context: EventContext, *args, **kwargs):
-        if e_context.event in self.listening_plugins:
-            for name in self.listening_plugins[e_context.event]:
-                if self.plugins[name].enabled and e_context.action == EventAction.CONTINUE:
-                    logger.debug("Plugin %s triggered by event %s" % (name, e_context.event))
-                    instance = self.instances[name]
-                    instance.handlers[e_context.event](e_context, *args, **kwargs)
-                    if e_context.is_break():
-                        e_context["breaked_by"] = name
-                        logger.debug("Plugin %s breaked event %s" % (name, e_context.event))
+        for name, handler, context_types, timeout in self.dispatch_table.get(e_context.event, ()):
+            if context_types is not None:
+                context = e_context.econtext.get("context")
+                if context is None or context.type not in context_types:
+                    continue
+            if not circuit_breaker.allow(name):
+                logger.debug("Plugin %s is suspended, skip event %s" % (name, e_context.event))
+                continue
+            logger.debug("Plugin %s triggered by event %s" % (name, e_context.event))
+            if timeout is None:
+                timeout = conf().get("plugin_timeout", 0)
+            call = plugin_metrics.start(name, e_context.event.name)
+            try:
+                if timeout and timeout > 0:
+                    call_with_timeout(handler, e_context, timeout, *args, **kwargs)
+                else:
+                    handler(e_context, *args, **kwargs)
+            except PluginTimeoutError:
+                plugin_metrics.finish(call, name, e_context.event.name, timeout=True)
+                logger.warning("Plugin %s timed out after %ss on event %s, skipped" % (name, timeout, e_context.event))
+                if name != "GODCMD":
+                    circuit_breaker.record_failure(name)
+                continue
+            except Exception as e:
+                plugin_metrics.finish(call, name, e_context.event.name, error=True)
+                logger.exception("Plugin %s failed on event %s: %s" % (name, e_context.event, e))
+                if name != "GODCMD":
+                    circuit_breaker.record_failure(name)
+                continue
+            plugin_metrics.finish(call, name, e_context.event.name, e_context.action.name)
+            circuit_breaker.record_success(name)
+            if e_context.is_break():
+                e_context["breaked_by"] = name
+                logger.debug("Plugin %s breaked event %s" % (name, e_context.event))
+                break
         return e_context
 
     def set_plugin_priority(self, name: str, priority: int):
@@ -219,6 +422,7 @@ class PluginManager:
         name = name.upper()
         if name not in self.plugins:
             return False, "插件不存在"
+        circuit_breaker.reset(name)  # 手动开启时解除熔断暂停
         if not self.plugins[name].enabled:
             self.plugins[name].enabled = True
             rawname = self.plugins[name].name
@@ -239,6 +443,7 @@ class PluginManager:
             rawname = self.plugins[name].name
             self.pconf["plugins"][rawname]["enabled"] = False
             self.save_config()
+            self.rebuild_dispatch_table()
             return True
         return True
 
@@ -337,6 +542,7 @@ class PluginManager:
                 if name in self.listening_plugins[event]:
                     self.listening_plugins[event].remove(name)
             del self.plugins[name]
+            self.rebuild_dispatch_table()
             del self.pconf["plugins"][rawname]
             self.loaded[dirname] = None
             self.save_config()
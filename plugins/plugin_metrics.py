@@ -0,0 +1,197 @@
+# encoding:utf-8
+
+import bisect
+import sys
+import threading
+import time
+import traceback
+
+from common.log import logger
+from common.metrics_server import register_collector
+from config import conf
+
+# 处理耗时直方图的桶上限(秒)，最后一个桶为+Inf
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+
+
+class HandlerStats(object):
+    """
+    单个插件处理单个事件的统计
+    """
+
+    __slots__ = ("calls", "errors", "timeouts", "breaks", "passes", "total", "max", "buckets")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.breaks = 0  # 以BREAK结束事件的次数
+        self.passes = 0  # 以BREAK_PASS结束事件的次数
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def observe(self, cost):
+        self.calls += 1
+        self.total += cost
+        if cost > self.max:
+            self.max = cost
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, cost)] += 1
+
+    def quantile(self, q):
+        """
+        由直方图估算分位数，返回所在桶的上限
+        """
+        if not self.calls:
+            return 0.0
+        rank = q * self.calls
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "breaks": self.breaks,
+            "passes": self.passes,
+            "total": self.total,
+            "avg": self.total / self.calls if self.calls else 0.0,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "buckets": list(self.buckets),
+        }
+
+
+class PluginMetrics(object):
+    """
+    插件事件处理的耗时、异常和中断统计，并在处理函数超过plugin_slow_threshold秒时记录一次调用栈
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}  # (插件名, 事件名) -> HandlerStats
+        self._inflight = {}  # 调用序号 -> [线程id, 插件名, 事件名, 开始时间, 是否已采样]
+        self._seq = 0
+        self._watchdog = None
+
+    def start(self, name, event):
+        """
+        记录一次处理开始
+        :return: 调用令牌，传给finish
+        """
+        threshold = conf().get("plugin_slow_threshold", 0)
+        begin = time.perf_counter()
+        if not threshold or threshold <= 0:
+            return None, begin
+        with self._lock:
+            self._seq += 1
+            token = self._seq
+            self._inflight[token] = [threading.get_ident(), name, event, begin, False]
+            if self._watchdog is None or not self._watchdog.is_alive():
+                self._watchdog = threading.Thread(target=self._watch, name="plugin-watchdog", daemon=True)
+                self._watchdog.start()
+        return token, begin
+
+    def finish(self, call, name, event, action=None, error=False, timeout=False):
+        """
+        记录一次处理结束
+        :param call: start返回的调用令牌
+        :param action: 处理后的EventAction名称，BREAK/BREAK_PASS时计入中断次数
+        """
+        token, begin = call
+        cost = time.perf_counter() - begin
+        key = (name, event)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = HandlerStats()
+            stats.observe(cost)
+            if timeout:
+                stats.timeouts += 1
+            elif error:
+                stats.errors += 1
+            elif action == "BREAK":
+                stats.breaks += 1
+            elif action == "BREAK_PASS":
+                stats.passes += 1
+            if token is not None:
+                self._inflight.pop(token, None)
+        threshold = conf().get("plugin_slow_threshold", 0)
+        if threshold and cost >= threshold:
+            logger.warning("[PluginMetrics] slow handler: plugin={}, event={}, cost={:.3f}s".format(name, event, cost))
+
+    def _watch(self):
+        """
+        后台巡检正在执行的处理函数，超过阈值的调用采样一次调用栈
+        """
+        while True:
+            threshold = conf().get("plugin_slow_threshold", 0)
+            if not threshold or threshold <= 0:
+                with self._lock:
+                    self._inflight.clear()
+                    self._watchdog = None
+                return
+            time.sleep(max(threshold / 2, 0.05))
+            now = time.perf_counter()
+            slow = []
+            with self._lock:
+                for call in self._inflight.values():
+                    if not call[4] and now - call[3] >= threshold:
+                        call[4] = True
+                        slow.append(list(call))
+            if not slow:
+                continue
+            frames = sys._current_frames()
+            for thread_id, name, event, begin, _ in slow:
+                frame = frames.get(thread_id)
+                stack = "".join(traceback.format_stack(frame)) if frame else "<thread finished>"
+                logger.warning("[PluginMetrics] handler running for {:.3f}s: plugin={}, event={}, stack:\n{}".format(now - begin, name, event, stack))
+
+    def snapshot(self) -> dict:
+        """
+        :return: {插件名: {事件名: 统计}}
+        """
+        with self._lock:
+            items = [(key, stats.to_dict()) for key, stats in self._stats.items()]
+        result = {}
+        for (name, event), stats in items:
+            result.setdefault(name, {})[event] = stats
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def export_prometheus(self) -> str:
+        """
+        以Prometheus文本格式导出
+        """
+        lines = [
+            "# TYPE plugin_handler_seconds histogram",
+        ]
+        counters = []
+        for name, events in sorted(self.snapshot().items()):
+            for event, stats in sorted(events.items()):
+                labels = 'plugin="{}",event="{}"'.format(name, event)
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), stats["buckets"]):
+                    cumulative += count
+                    lines.append('plugin_handler_seconds_bucket{{{},le="{}"}} {}'.format(labels, bound, cumulative))
+                lines.append("plugin_handler_seconds_sum{{{}}} {}".format(labels, stats["total"]))
+                lines.append("plugin_handler_seconds_count{{{}}} {}".format(labels, stats["calls"]))
+                counters.append((labels, stats))
+        for metric, field in (("plugin_handler_errors_total", "errors"), ("plugin_handler_timeouts_total", "timeouts"), ("plugin_handler_breaks_total", "breaks"), ("plugin_handler_passes_total", "passes")):
+            lines.append("# TYPE {} counter".format(metric))
+            for labels, stats in counters:
+                lines.append("{}{{{}}} {}".format(metric, labels, stats[field]))
+        return "\n".join(lines) + "\n"
+
+
+plugin_metrics = PluginMetrics()
+register_collector("plugin", plugin_metrics.export_prometheus)
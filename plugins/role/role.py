@@ -28,6 +28,7 @@ class RolePlay:
         session = self.bot.sessions.build_session(self.sessionid)
         if session.system_prompt != self.desc:  # 目前没有触发session过期事件，这里先简单判断，然后重置
             session.set_system_prompt(self.desc)
+            self.bot.sessions.save_session(session)
         prompt = self.wrapper % user_action
         return prompt
 
@@ -66,6 +67,7 @@ class Role(Plugin):
             if len(self.roles) == 0:
                 raise Exception("no role found")
             self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context
+            self.context_types[Event.ON_HANDLE_CONTEXT] = [ContextType.TEXT]
             self.roleplays = {}
             logger.info("[Role] inited")
         except Exception as e:
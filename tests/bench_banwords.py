@@ -0,0 +1,98 @@
+"""
+敏感词匹配 WordsSearch 与 CompactWordsSearch 性能对比
+
+随机生成10万个中文敏感词和1MB中文文本，分别测试构建耗时、构建后常驻内存增量、
+新进程中mmap加载磁盘缓存的耗时和内存，以及ContainsAny/FindAll/Replace扫描整段文本的吞吐。
+每个实现在独立子进程中运行，内存数据互不影响。
+
+运行方式: python tests/bench_banwords.py [敏感词数量] [文本MB数]
+"""
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+LIB_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "plugins", "banwords", "lib")
+sys.path.insert(0, LIB_DIR)  # 直接导入lib，避免导入插件包时触发插件注册
+
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+def gen_data(word_count, text_mb, seed=42):
+    rng = random.Random(seed)
+    charset = [chr(0x4E00 + i) for i in range(3000)]  # 3000个常用汉字范围
+    words = sorted({"".join(rng.choice(charset) for _ in range(rng.randint(2, 5))) for _ in range(word_count)})
+    text = "".join(rng.choice(charset) for _ in range(text_mb * 1024 * 1024 // 3))  # utf-8下每个汉字3字节
+    return words, text
+
+
+def timeit(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def run_engine(engine, word_count, text_mb, cache_path):
+    words, text = gen_data(word_count, text_mb)
+    base_rss = rss_mb()
+    load = None
+    if engine == "WordsSearch":
+        from WordsSearch import WordsSearch
+
+        search = WordsSearch()
+        build, _ = timeit(lambda: search.SetKeywords(words))
+    elif engine == "CompactWordsSearch":
+        from compact_search import CompactWordsSearch
+
+        search = CompactWordsSearch()
+        build, _ = timeit(lambda: search.SetKeywords(words))
+        search.save(cache_path)
+    else:
+        # 新进程直接映射上一步保存的缓存文件
+        from compact_search import load_or_build
+
+        build = None
+        load, search = timeit(lambda: load_or_build(words, cache_path))
+    rss = rss_mb() - base_rss
+    findall, matches = timeit(lambda: search.FindAll(text))
+    replace, clean = timeit(lambda: search.Replace(text))
+    contains, _ = timeit(lambda: search.ContainsAny(clean))  # 替换后不含敏感词，ContainsAny需要扫描全文
+    size_mb = len(text.encode("utf-8")) / 1024 / 1024
+    return {
+        "engine": engine,
+        "build": build,
+        "load": load,
+        "rss": rss,
+        "matches": len(matches),
+        "findall": size_mb / findall,
+        "replace": size_mb / replace,
+        "contains": len(clean.encode("utf-8")) / 1024 / 1024 / contains,
+    }
+
+
+def main(word_count=100000, text_mb=1):
+    print("words: {}, text: {}MB".format(word_count, text_mb))
+    cache_path = os.path.join(tempfile.mkdtemp(), "banwords.cache")
+    for engine in ("WordsSearch", "CompactWordsSearch", "CompactWordsSearch(mmap)"):
+        output = subprocess.check_output([sys.executable, __file__, "--engine", engine, str(word_count), str(text_mb), cache_path])
+        r = json.loads(output)
+        build = "{:6.2f}s".format(r["build"]) if r["build"] is not None else "      -"
+        load = "{:6.3f}s".format(r["load"]) if r["load"] is not None else "      -"
+        print(
+            "{:<25} build: {}  load: {}  rss: {:6.1f}MB  ContainsAny: {:5.2f}MB/s  FindAll: {:5.2f}MB/s  Replace: {:5.2f}MB/s  matches: {}".format(
+                r["engine"], build, load, r["rss"], r["contains"], r["findall"], r["replace"], r["matches"]
+            )
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--engine":
+        print(json.dumps(run_engine(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]), sys.argv[5])))
+    else:
+        main(*[int(a) for a in sys.argv[1:3]])
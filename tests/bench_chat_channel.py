@@ -0,0 +1,73 @@
+"""
+ChatChannel 调度延迟基准测试
+
+向ChatChannel推送10k条合成context，经过一个只sleep的桩bot处理，统计从produce到开始处理的排队延迟p50/p99。
+
+运行方式: python tests/bench_chat_channel.py [消息数] [session数]
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bridge.context import Context, ContextType
+from bridge.reply import Reply, ReplyType
+from channel.chat_channel import ChatChannel
+from config import conf
+
+
+class StubBot(object):
+    def __init__(self, latency=0.001):
+        self.latency = latency
+
+    def reply(self, query, context=None):
+        time.sleep(self.latency)
+        return Reply(ReplyType.TEXT, query)
+
+
+class StubChannel(ChatChannel):
+    def __init__(self, total):
+        super().__init__()
+        self.bot = StubBot()
+        self.delays = []
+        self.delays_lock = threading.Lock()
+        self.done = threading.Event()
+        self.total = total
+
+    def _handle(self, context: Context):
+        delay = time.perf_counter() - context["produce_time"]
+        self.bot.reply(context.content, context)
+        with self.delays_lock:
+            self.delays.append(delay)
+            if len(self.delays) >= self.total:
+                self.done.set()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    idx = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[idx]
+
+
+def main(total=10000, session_count=1000):
+    conf()["concurrency_in_session"] = 1
+    channel = StubChannel(total)
+    start = time.perf_counter()
+    for i in range(total):
+        context = Context(ContextType.TEXT, "msg {}".format(i), kwargs={})
+        context["session_id"] = "session_{}".format(i % session_count)
+        context["produce_time"] = time.perf_counter()
+        channel.produce(context)
+    if not channel.done.wait(timeout=600):
+        print("timeout, handled {}/{}".format(len(channel.delays), total))
+        return
+    cost = time.perf_counter() - start
+    print("contexts: {}, sessions: {}, total: {:.2f}s".format(total, session_count, cost))
+    print("queueing delay p50: {:.2f}ms, p99: {:.2f}ms".format(percentile(channel.delays, 50) * 1000, percentile(channel.delays, 99) * 1000))
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    main(*args)
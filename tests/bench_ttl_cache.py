@@ -0,0 +1,52 @@
+"""
+TTLCache 与 ExpiredDict 性能对比
+
+对10万个key分别测试写入、命中读取、in判断以及keys()全量遍历的耗时。
+
+运行方式: python tests/bench_ttl_cache.py [key数量]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.expired_dict import ExpiredDict
+from common.ttl_cache import TTLCache
+
+
+def timeit(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def bench(name, cache, keys):
+    def write():
+        for k in keys:
+            cache[k] = k
+
+    def read():
+        for k in keys:
+            cache[k]
+
+    def contains():
+        for k in keys:
+            k in cache
+
+    def scan():
+        list(cache.keys())
+
+    results = [timeit(write), timeit(read), timeit(contains), timeit(scan)]
+    print("{:<12} set: {:7.1f}ms  get: {:7.1f}ms  in: {:7.1f}ms  keys(): {:7.1f}ms".format(name, *[r * 1000 for r in results]))
+
+
+def main(count=100000):
+    keys = ["session_{}".format(i) for i in range(count)]
+    print("keys: {}".format(count))
+    bench("ExpiredDict", ExpiredDict(3600), keys)
+    bench("TTLCache", TTLCache(3600), keys)
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:2]])
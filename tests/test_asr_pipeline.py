@@ -0,0 +1,73 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+from unittest import mock
+
+import config
+from bridge.reply import Reply, ReplyType
+from voice import audio_convert
+from voice.asr_pipeline import join_transcripts, voice_to_text
+from voice.audio_convert import PcmAudio, split_on_silence
+from voice.voice import Voice
+
+RATE = 16000
+
+
+def tone(ms, level=8000):
+    # 方波，便于按峰值判断是否静音
+    count = RATE * ms // 1000
+    return b"".join(struct.pack("<h", level if (i // 20) % 2 else -level) for i in range(count))
+
+
+def silence(ms):
+    return b"\x00\x00" * (RATE * ms // 1000)
+
+
+class FakeVoice(Voice):
+    def voiceToText(self, voice_file):
+        # 按片段时长返回文本，便于检查拼接顺序
+        pcm = audio_convert.load_pcm(voice_file, RATE)
+        return Reply(ReplyType.TEXT, "{}ms".format(audio_convert.pcm_duration(pcm, RATE)))
+
+
+class TestAsrPipeline(unittest.TestCase):
+    def test_split_on_silence(self):
+        pcm = tone(4000) + silence(500) + tone(3000) + silence(1000) + tone(6000) + silence(2000)
+        segments = split_on_silence(pcm, RATE, max_segment_ms=8000)
+        durations = [audio_convert.pcm_duration(s.pcm, RATE) for s in segments]
+        # 4s+静音在第一个静音中点切开，6s的片段单独一段，末尾纯静音被丢弃
+        self.assertEqual(len(segments), 2)
+        self.assertAlmostEqual(durations[0], 4000 + 500 + 3000 + 500, delta=20)
+        self.assertAlmostEqual(durations[1], 500 + 6000 + 1000, delta=20)
+        # 没有静音时在最大长度处硬切
+        self.assertEqual([len(s.pcm) for s in split_on_silence(tone(5000), RATE, 2000)], [64000, 64000, 32000])
+
+    def test_pcm_audio_loaders(self):
+        audio = PcmAudio(tone(100), RATE)
+        self.assertEqual(audio_convert.load_pcm(audio, RATE), audio.pcm)
+        self.assertEqual(audio_convert.load_for_upload(audio, ("mp3", "wav")), ("segment.wav", audio_convert.pcm_to_wav(audio.pcm, RATE)))
+
+    def test_join(self):
+        self.assertEqual(join_transcripts(["你好，", " world", "and more", "再见"]), "你好，world and more再见")
+
+    def test_voice_to_text(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        path = os.path.join(tmp, "voice.wav")
+        with open(path, "wb") as f:
+            f.write(audio_convert.pcm_to_wav(tone(9000) + silence(1000) + tone(5000) + silence(1000) + tone(9000), RATE))
+        with mock.patch.dict(config.conf(), {"asr_segment_duration": 12}):
+            self.assertEqual(voice_to_text(FakeVoice(), path).content, "9500ms 6000ms 9500ms")
+        with mock.patch.dict(config.conf(), {"asr_segment_duration": 0}):
+            self.assertEqual(voice_to_text(FakeVoice(), path).content, "25000ms")
+        # 不需要切分时把已解码的pcm交给引擎，不再传文件路径
+        voice = FakeVoice()
+        with mock.patch.dict(config.conf(), {"asr_segment_duration": 30}), mock.patch.object(voice, "voiceToText", wraps=voice.voiceToText) as recognize:
+            self.assertEqual(voice_to_text(voice, path).content, "25000ms")
+        self.assertIsInstance(recognize.call_args[0][0], PcmAudio)
+
+
+if __name__ == "__main__":
+    unittest.main()
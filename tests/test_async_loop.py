@@ -0,0 +1,160 @@
+import asyncio
+import threading
+import unittest
+from queue import Queue
+from unittest import mock
+
+from aiohttp import web
+
+from bot.bot import AsyncBot
+from bot.chatgpt.chat_gpt_bot import ChatGPTBot
+from bot.dify.dify_bot import DifyBot
+from bridge.bridge import Bridge
+from bridge.context import Context, ContextType
+from bridge.reply import Reply, ReplyType
+from channel.chat_channel import ChatChannel
+from common.async_loop import AsyncLoop
+from voice.voice import AsyncVoice
+
+
+class StalledVoice(AsyncVoice):
+    def __init__(self):
+        self.cancelled = threading.Event()
+
+    async def atextToVoice(self, text):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            self.cancelled.set()
+            raise
+
+
+class Msg(object):
+    def __init__(self, user_id):
+        self.from_user_id = user_id
+        self.actual_user_id = user_id
+        self.other_user_id = user_id
+        self.other_user_nickname = user_id
+
+
+class BarrierBot(AsyncBot):
+    """所有请求都在等待时才一起返回，只有在事件循环中并发执行才能完成"""
+
+    def __init__(self, parties):
+        self.parties = parties
+        self.waiting = 0
+        self.threads = set()
+        self.all_arrived = None
+
+    async def areply(self, query, context=None):
+        self.threads.add(threading.current_thread().name)
+        if self.all_arrived is None:
+            self.all_arrived = asyncio.Event()
+        self.waiting += 1
+        if self.waiting == self.parties:
+            self.all_arrived.set()
+        await asyncio.wait_for(self.all_arrived.wait(), 5)
+        return Reply(ReplyType.TEXT, "re:" + query)
+
+
+class RecordChannel(ChatChannel):
+    # 会话和调度队列是ChatChannel的类属性，单独一份避免和其他测试的channel互相消费
+    futures = {}
+    sessions = {}
+    lock = threading.Lock()
+    ready_sessions = Queue()
+
+    def __init__(self):
+        super().__init__()
+        self.sent = []
+        self.done = threading.Event()
+
+    def send(self, reply, context):
+        self.sent.append(reply.content)
+        if len(self.sent) == 3:
+            self.done.set()
+
+
+class TestAsyncLoop(unittest.TestCase):
+    def test_voice_timeout_cancels(self):
+        """测试异步语音合成超时后返回错误，并取消共享事件循环中的协程"""
+        voice = StalledVoice()
+        with mock.patch.dict("config.config", {"text_to_voice_timeout": 0.05}):
+            reply = voice.textToVoice("hi")
+        self.assertEqual(reply.type, ReplyType.ERROR)
+        self.assertTrue(voice.cancelled.wait(timeout=5))
+        self.assertEqual(AsyncLoop().run(asyncio.sleep(0, result="ok"), 5), "ok")  # 事件循环不受影响
+
+    def test_channel_async_pipeline(self):
+        """测试异步模式下不同会话的消息在共享事件循环中并发调用bot，回复正常发送"""
+        bot = BarrierBot(3)
+        channel = RecordChannel()
+        with mock.patch.dict("config.config", {"async_pipeline": True}), mock.patch.object(Bridge(), "bots", {**Bridge().bots, "chat": bot}):
+            for i in range(3):
+                channel.produce(Context(ContextType.TEXT, "q{}".format(i), kwargs={"msg": Msg("u{}".format(i)), "session_id": "async-{}".format(i), "receiver": "u{}".format(i)}))
+            self.assertTrue(channel.done.wait(timeout=5))
+        self.assertEqual(sorted(channel.sent), ["re:q0", "re:q1", "re:q2"])
+        self.assertEqual(bot.threads, {"async_loop"})
+
+    def test_chatgpt_session_off_loop(self):
+        """测试ChatGPTBot.areply在线程池中读写会话，不阻塞事件循环"""
+        bot = ChatGPTBot()
+        threads = []
+        session_query = bot.sessions.session_query
+
+        def record_query(query, session_id):
+            threads.append(threading.current_thread().name)
+            return session_query(query, session_id)
+
+        async def areply_text(session_id, session, api_key=None, args=None, retry_count=0):
+            return {"total_tokens": 2, "completion_tokens": 1, "content": "hello"}
+
+        context = Context(ContextType.TEXT, "hi", kwargs={"session_id": "chatgpt-async"})
+        with mock.patch.object(bot.sessions, "session_query", record_query), mock.patch.object(bot, "areply_text", areply_text):
+            reply = AsyncLoop().run(bot.areply("hi", context), 5)
+        self.assertEqual((reply.type, reply.content), (ReplyType.TEXT, "hello"))
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], "async_loop")
+        self.assertEqual(bot.sessions.sessions["chatgpt-async"].messages[-1]["content"], "hello")
+
+    def test_dify_chatbot_aiohttp(self):
+        """测试DifyBot通过共享aiohttp会话请求chatbot接口，并记录conversation_id"""
+        requests = []
+
+        async def chat_messages(request):
+            requests.append(await request.json())
+            return web.json_response({"answer": "你好", "conversation_id": "c1", "metadata": {}})
+
+        async def start_server():
+            app = web.Application()
+            app.router.add_post("/v1/chat-messages", chat_messages)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            return runner, runner.addresses[0][1]
+
+        runner, port = AsyncLoop().run(start_server(), 5)
+        try:
+            bot = DifyBot()
+            context = Context(
+                ContextType.TEXT,
+                "hi",
+                kwargs={
+                    "msg": Msg("u1"),
+                    "session_id": "dify-async",
+                    "dify_api_base": "http://127.0.0.1:{}/v1".format(port),
+                    "dify_app_type": "chatbot",
+                },
+            )
+            with mock.patch.dict("config.config", {"channel_type": "wx"}):
+                reply = AsyncLoop().run(bot.areply("hi", context), 5)
+        finally:
+            AsyncLoop().run(runner.cleanup(), 5)
+        self.assertEqual((reply.type, reply.content), (ReplyType.TEXT, "你好"))
+        self.assertEqual(requests[0]["query"], "hi")
+        self.assertEqual(bot.sessions.get_session("dify-async", "u1").get_conversation_id(), "c1")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import math
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from voice import audio_convert
+
+
+def sine_pcm(rate, ms=500, freq=440):
+    count = rate * ms // 1000
+    return b"".join(struct.pack("<h", int(8000 * math.sin(2 * math.pi * freq * i / rate))) for i in range(count))
+
+
+class TestAudioConvert(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def write(self, name, data):
+        path = os.path.join(self.tmp, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_format_and_duration(self):
+        self.assertEqual(audio_convert.audio_format("a/b.SLK"), "silk")
+        self.assertEqual(audio_convert.audio_format("b.mp3"), "mp3")
+        self.assertEqual(audio_convert.pcm_duration(sine_pcm(16000, 1500), 16000), 1500)
+
+    def test_wav_in_memory(self):
+        """测试wav与pcm在内存中互转，采样率一致时不调用ffmpeg"""
+        pcm = sine_pcm(16000)
+        path = self.write("a.wav", audio_convert.pcm_to_wav(pcm, 16000))
+        self.assertEqual(audio_convert.load_pcm(path, 16000), pcm)
+        self.assertEqual(audio_convert.load_audio(path, "pcm", 16000), pcm)
+        self.assertEqual(audio_convert.load_for_upload(path, ("wav",)), ("a.wav", audio_convert.pcm_to_wav(pcm, 16000)))
+
+    @unittest.skipUnless(shutil.which("ffmpeg"), "ffmpeg not installed")
+    def test_ffmpeg_pipe(self):
+        """测试通过管道调用ffmpeg转码"""
+        pcm = sine_pcm(16000, 1000)
+        mp3 = audio_convert.encode_pcm(pcm, "mp3", 16000)
+        self.assertTrue(mp3)
+        decoded = audio_convert.decode_pcm(mp3, "mp3", 8000)
+        self.assertAlmostEqual(audio_convert.pcm_duration(decoded, 8000), 1000, delta=100)
+        name, data = audio_convert.load_for_upload(self.write("b.wav", audio_convert.pcm_to_wav(pcm, 16000)), ("mp3",))
+        self.assertEqual(name, "b.mp3")
+        self.assertTrue(data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "plugins", "banwords", "lib"))
+
+from compact_search import CompactWordsSearch, load_or_build
+from WordsSearch import WordsSearch
+
+
+class TestCompactWordsSearch(unittest.TestCase):
+    def test_same_as_words_search(self):
+        """测试随机词库和文本下各接口结果与WordsSearch完全一致"""
+        rng = random.Random(0)
+        alphabet = "abcd你好坏蛋😀"
+        for _ in range(200):
+            words = ["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 20))]
+            expected = WordsSearch()
+            expected.SetKeywords(words)
+            search = CompactWordsSearch()
+            search.SetKeywords(words)
+            for _ in range(10):
+                text = "".join(rng.choice(alphabet + "xyz") for _ in range(rng.randint(0, 30)))
+                self.assertEqual(search.FindFirst(text), expected.FindFirst(text), (words, text))
+                self.assertEqual(search.FindAll(text), expected.FindAll(text), (words, text))
+                self.assertEqual(search.ContainsAny(text), expected.ContainsAny(text), (words, text))
+                self.assertEqual(search.Replace(text), expected.Replace(text), (words, text))
+
+    def test_empty(self):
+        search = CompactWordsSearch()
+        self.assertIsNone(search.FindFirst("abc"))
+        self.assertFalse(search.ContainsAny("abc"))
+        self.assertEqual(search.Replace("abc"), "abc")
+
+    def test_stream_across_chunks(self):
+        """测试流式过滤跨段匹配，拼接结果与整段Replace一致"""
+        rng = random.Random(1)
+        alphabet = "ab你好坏蛋。"
+        for _ in range(200):
+            words = ["".join(rng.choice(alphabet[:-1]) for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 10))]
+            search = CompactWordsSearch()
+            search.SetKeywords(words)
+            text = "".join(rng.choice(alphabet + "x") for _ in range(rng.randint(0, 40)))
+            cuts = sorted(rng.sample(range(len(text) + 1), min(len(text) + 1, 4)))
+            chunks = [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+            stream = search.stream()
+            self.assertEqual("".join(stream.feed_batch(chunks)) + stream.flush(), search.Replace(text), (words, chunks))
+            stream = search.stream(block=True)
+            self.assertEqual(None in stream.feed_batch(chunks), search.ContainsAny(text), (words, chunks))
+
+    def test_stream_hold_back(self):
+        """测试可能是敏感词前缀的末尾字符暂不输出，句子结束时不保留"""
+        search = CompactWordsSearch()
+        search.SetKeywords(["坏蛋"])
+        stream = search.stream()
+        self.assertEqual(stream.feed("你是坏"), "你是")
+        self.assertEqual(stream.feed("蛋。"), "**。")
+        self.assertEqual(stream.feed("好人。"), "好人。")
+        self.assertEqual(stream.flush(), "")
+        self.assertEqual(stream.matches, ["坏蛋"])
+        self.assertTrue(stream.closed)
+
+    def test_cache(self):
+        """测试缓存文件mmap加载，词库变化后重新构建"""
+        path = os.path.join(tempfile.mkdtemp(), "banwords.cache")
+        search = load_or_build(["坏蛋", "笨蛋"], path)
+        self.assertIsNone(search._mmap)
+        cached = load_or_build(["坏蛋", "笨蛋"], path)
+        self.assertIsNotNone(cached._mmap)
+        self.assertEqual(cached.Replace("你这个笨蛋"), "你这个**")
+        self.assertEqual(cached.FindFirst("坏蛋")["Keyword"], "坏蛋")
+        rebuilt = load_or_build(["傻瓜"], path)
+        self.assertIsNone(rebuilt._mmap)
+        self.assertFalse(rebuilt.ContainsAny("你这个笨蛋"))
+        self.assertTrue(load_or_build(["傻瓜"], path).ContainsAny("傻瓜"))
+
+
+if __name__ == "__main__":
+    unittest.main()
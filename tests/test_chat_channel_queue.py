@@ -0,0 +1,120 @@
+import threading
+import time
+import unittest
+
+from bridge.context import Context, ContextType
+from channel.chat_channel import ChatChannel
+from common.dequeue import Dequeue
+from config import conf
+
+
+class Msg(object):
+    def __init__(self, user_id):
+        self.from_user_id = user_id
+        self.actual_user_id = user_id
+
+
+class BlockingChannel(ChatChannel):
+    def reset(self):
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.handled = []
+        self.queue_stats = {"queued": 0, "shed": 0, "expired": 0, "merged": 0}
+
+    def _handle(self, context: Context):
+        self.started.set()
+        self.release.wait(timeout=5)
+        self.handled.append(context.content)
+
+
+class TestSessionQueue(unittest.TestCase):
+    SETTINGS = ["concurrency_in_session", "session_queue_max_size", "global_queue_max_size", "session_queue_drop_policy", "message_expire_seconds"]
+
+    @classmethod
+    def setUpClass(cls):
+        # ChatChannel的会话和调度队列是类属性，整个测试共用一个channel实例
+        cls.channel = BlockingChannel()
+
+    def setUp(self):
+        self.old = {k: conf().get(k) for k in self.SETTINGS}
+        conf()["concurrency_in_session"] = 1
+        self.channel.reset()
+
+    def tearDown(self):
+        self.channel.release.set()
+        for k, v in self.old.items():
+            conf()[k] = v
+
+    def produce(self, content, user="u1", session_id="s1"):
+        context = Context(ContextType.TEXT, content, kwargs={"msg": Msg(user), "session_id": session_id})
+        self.channel.produce(context)
+
+    def run_session(self, contents, **kwargs):
+        self.produce("first", **kwargs)
+        self.assertTrue(self.channel.started.wait(timeout=5))
+        for content in contents:
+            self.produce(content, **kwargs)
+        self.channel.release.set()
+        for _ in range(100):
+            if self.channel.queue_metrics()["queued"] == 0 and len(self.channel.handled) > 0 and "s1" not in self.channel.sessions:
+                break
+            time.sleep(0.02)
+        return self.channel.handled
+
+    def test_drop_oldest(self):
+        conf()["session_queue_max_size"] = 2
+        conf()["session_queue_drop_policy"] = "oldest"
+        self.assertEqual(self.run_session(["a", "b", "c"]), ["first", "b", "c"])
+        self.assertEqual(self.channel.queue_metrics()["shed"], 1)
+
+    def test_drop_oldest_keeps_admin_command(self):
+        conf()["session_queue_max_size"] = 2
+        conf()["session_queue_drop_policy"] = "oldest"
+        self.assertEqual(self.run_session(["#cmd", "a", "b"]), ["first", "#cmd", "b"])
+        self.assertEqual(self.channel.queue_metrics()["shed"], 1)
+
+    def test_drop_newest(self):
+        conf()["session_queue_max_size"] = 2
+        conf()["session_queue_drop_policy"] = "newest"
+        self.assertEqual(self.run_session(["a", "b", "c"]), ["first", "a", "b"])
+
+    def test_merge(self):
+        conf()["session_queue_max_size"] = 1
+        conf()["session_queue_drop_policy"] = "merge"
+        self.assertEqual(self.run_session(["a", "b", "c"]), ["first", "a\nb\nc"])
+        self.assertEqual(self.channel.queue_metrics()["merged"], 2)
+
+    def test_expire(self):
+        conf()["message_expire_seconds"] = 0.05
+        self.produce("first")
+        self.assertTrue(self.channel.started.wait(timeout=5))
+        self.produce("stale")
+        time.sleep(0.1)
+        self.channel.release.set()
+        for _ in range(100):
+            if self.channel.queue_metrics()["expired"]:
+                break
+            time.sleep(0.02)
+        self.assertEqual(self.channel.queue_metrics()["expired"], 1)
+        self.assertEqual(self.channel.handled, ["first"])
+
+
+class TestDequeue(unittest.TestCase):
+    def test_remove_first_finishes_task(self):
+        """测试remove_first取出的元素计为已处理，join不会一直等待"""
+        queue = Dequeue()
+        for item in ["#cmd", "a", "b"]:
+            queue.put(item)
+        self.assertEqual(queue.remove_first(lambda item: not item.startswith("#")), "a")
+        self.assertIsNone(queue.remove_first(lambda item: item == "x"))
+        while not queue.empty():
+            queue.get()
+            queue.task_done()
+        joined = threading.Thread(target=queue.join, daemon=True)
+        joined.start()
+        joined.join(timeout=5)
+        self.assertFalse(joined.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+
+from bot.chatgpt.chat_gpt_session import ChatGPTSession, num_tokens_from_messages
+
+
+class TestChatGPTSession(unittest.TestCase):
+    def new_session(self):
+        # wenxin按字符数计数，不依赖tiktoken
+        return ChatGPTSession("s1", system_prompt="sys", model="wenxin")
+
+    def test_incremental_count(self):
+        """测试增量计数与全量计数一致，且每条消息只计算一次"""
+        session = self.new_session()
+        session.add_query("你好")
+        self.assertEqual(session.calc_tokens(), 5)
+        session.add_reply("你好呀")
+        self.assertEqual(session.calc_tokens(), num_tokens_from_messages(session.messages, "wenxin"))
+        self.assertEqual(session.message_tokens, [3, 2, 3])
+
+    def test_discard_exceeding(self):
+        """测试超出max_tokens时从最早的消息开始丢弃，并同步更新缓存"""
+        session = self.new_session()
+        for i in range(10):
+            session.add_query("q" * 10)
+            session.add_reply("a" * 10)
+        tokens = session.discard_exceeding(50)
+        self.assertEqual(tokens, 43)
+        self.assertEqual(len(session.messages), 5)
+        self.assertEqual(session.message_tokens, [len(m["content"]) for m in session.messages])
+        self.assertEqual(tokens, session.calc_tokens())
+
+    def test_reset_clears_cache(self):
+        """测试重置会话后缓存失效"""
+        session = self.new_session()
+        session.add_query("hello")
+        session.calc_tokens()
+        session.set_system_prompt("new")
+        self.assertEqual(session.calc_tokens(), 3)
+
+    def test_modified_messages(self):
+        """测试消息被原地修改或整体替换(数量不变)后重新计数"""
+        session = self.new_session()
+        session.add_query("hello")
+        session.calc_tokens()
+        session.messages[0]["content"] = "a longer system prompt"
+        self.assertEqual(session.calc_tokens(), num_tokens_from_messages(session.messages, "wenxin"))
+        session.messages = [{"role": "system", "content": "s"}, {"role": "user", "content": "hi"}]
+        self.assertEqual(session.calc_tokens(), 3)
+        self.assertEqual(session.message_tokens, [1, 2])
+
+    def test_dump_keeps_cache(self):
+        """测试持久化后恢复的会话沿用token缓存"""
+        session = self.new_session()
+        session.add_query("hello")
+        session.calc_tokens()
+        state = session.dump()
+        self.assertNotIn("counted_messages", state)
+        restored = self.new_session()
+        restored.load(state)
+        self.assertEqual(restored.message_tokens, [3, 5])
+        restored.messages[1]["content"] = "hi"
+        self.assertEqual(restored.calc_tokens(), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
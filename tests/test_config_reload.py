@@ -0,0 +1,154 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import bot.session_manager as session_manager_module
+import bridge.bridge as bridge_module
+import config as config_module
+from bot.session_manager import Session, SessionManager
+from bridge.bridge import Bridge
+from common.session_store import create_session_store
+from config import Config, conf, config_snapshot, record_config_reads
+
+
+class FakeBot(object):
+    def __init__(self):
+        self.model = conf().get("model")
+        self.sessions = SessionManager(Session)
+
+
+class TestConfigDeps(unittest.TestCase):
+    def test_record_reads(self):
+        """测试记录读取的配置项，只有这些配置项变化才算变化"""
+        config = Config({"model": "a", "debug": False})
+        with mock.patch("config.config", config):
+            with record_config_reads() as deps:
+                conf().get("model")
+                with record_config_reads() as inner:
+                    conf().get("proxy")  # 未配置的项也需要记录
+            self.assertEqual(set(deps.values), {"model", "proxy"})
+            self.assertEqual(set(inner.values), {"proxy"})
+            config["debug"] = True
+            self.assertEqual(deps.changed(), [])
+            config["proxy"] = "http://127.0.0.1"
+            self.assertEqual(inner.changed(), ["proxy"])
+
+
+class TestConfigSnapshot(unittest.TestCase):
+    def test_snapshot(self):
+        """测试快照只读、按版本替换，派生值每个版本只计算一次"""
+        config = Config({"model": "a", "single_chat_prefix": ["bot"]})
+        calls = []
+        with mock.patch("config.config", config), mock.patch.dict(config_module._derivations, {"test_derived": lambda s: calls.append(s.model) or len(calls)}):
+            snapshot = config_snapshot()
+            self.assertIs(config_snapshot(), snapshot)
+            self.assertEqual(snapshot.model, "a")
+            self.assertIsNone(snapshot.proxy)  # 未配置的项
+            self.assertEqual(snapshot.get("proxy", ""), "")
+            self.assertEqual(snapshot.test_derived, 1)
+            with self.assertRaises(AttributeError):
+                snapshot.model = "b"
+            with self.assertRaises(AttributeError):
+                snapshot.not_a_setting
+            config["single_chat_prefix"].append("@bot")  # 快照不受原配置修改影响
+            self.assertEqual(snapshot.single_chat_prefix, ["bot"])
+            config["model"] = "b"
+            new_snapshot = config_snapshot()
+            self.assertEqual((snapshot.model, new_snapshot.model), ("a", "b"))
+            self.assertEqual(new_snapshot.test_derived, 2)
+            self.assertEqual(calls, ["a", "b"])
+
+    def test_snapshot_after_update(self):
+        """测试update、clear等方法修改配置后同样生成新快照"""
+        config = Config({"model": "a"})
+        with mock.patch("config.config", config):
+            self.assertEqual(config_snapshot().model, "a")
+            with mock.patch.dict(config, {"model": "b"}):
+                self.assertEqual(config_snapshot().model, "b")
+            self.assertEqual(config_snapshot().model, "a")
+            config.clear()
+            self.assertIsNone(config_snapshot().model)
+
+
+class TestBridgeReset(unittest.TestCase):
+    def setUp(self):
+        self.config = Config({"model": "gpt-4o", "bot_type": "chatGPT"})
+        patches = [
+            mock.patch("config.config", self.config),
+            mock.patch.object(bridge_module, "create_bot", lambda bot_type: FakeBot()),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def new_bridge(self):
+        # Bridge被singleton包装，从闭包中取出原始类，避免影响全局单例
+        cls = next(c.cell_contents for c in Bridge.__closure__ if isinstance(c.cell_contents, type))
+        return cls()
+
+    def test_keep_unchanged_bot(self):
+        """测试无关配置变化时保留原bot，依赖的配置变化时重建并沿用会话"""
+        bridge = self.new_bridge()
+        bot = bridge.get_bot("chat")
+        bot.sessions.build_session("u1")
+        self.config["debug"] = True
+        self.assertEqual(bridge.reset_bot(), [])
+        self.assertIs(bridge.get_bot("chat"), bot)
+
+        self.config["model"] = "gpt-4o-mini"
+        self.assertEqual(bridge.reset_bot(), ["chat"])
+        new_bot = bridge.get_bot("chat")
+        self.assertIsNot(new_bot, bot)
+        self.assertEqual(new_bot.model, "gpt-4o-mini")
+        self.assertIsNotNone(new_bot.sessions.sessions.get("u1"))
+
+    def test_close_replaced_store(self):
+        """测试重建bot时关闭新bot自带的sqlite会话存储，只保留沿用的那一份"""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.config["session_store"] = "sqlite"
+        self.config["session_store_path"] = os.path.join(tmp.name, "sessions.db")
+        stores = []
+
+        def record_store(namespace, factory):
+            stores.append(create_session_store(namespace, factory))
+            self.addCleanup(stores[-1].close)
+            return stores[-1]
+
+        with mock.patch.object(session_manager_module, "create_session_store", record_store):
+            bridge = self.new_bridge()
+            bot = bridge.get_bot("chat")
+            bot.sessions.build_session("u1")
+            self.config["model"] = "gpt-4o-mini"
+            self.assertEqual(bridge.reset_bot(), ["chat"])
+        new_bot = bridge.get_bot("chat")
+        self.assertEqual(len(stores), 2)
+        self.assertIs(new_bot.sessions.sessions, stores[0])
+        self.assertFalse(stores[0]._stop.is_set())
+        self.assertFalse(stores[1]._thread.is_alive())
+        with self.assertRaises(sqlite3.ProgrammingError):  # 连接已关闭
+            stores[1]._conn.execute("SELECT 1")
+        self.assertIsNotNone(new_bot.sessions.sessions.get("u1"))
+
+    def test_keep_dify_sessions(self):
+        """测试DifySessionManager同样沿用会话，重建后conversation_id不丢失"""
+        from bot.dify.dify_bot import DifyBot
+
+        self.config["bot_type"] = "dify"
+        with mock.patch.object(bridge_module, "create_bot", lambda bot_type: DifyBot()):
+            bridge = self.new_bridge()
+            bot = bridge.get_bot("chat")
+            session = bot.sessions.get_session("u1", "user1")
+            session.set_conversation_id("conv-1")
+            bot.sessions.save_session(session)
+            self.config["dify_read_timeout"] = 60
+            self.assertEqual(bridge.reset_bot(), ["chat"])
+            new_bot = bridge.get_bot("chat")
+            self.assertIsNot(new_bot, bot)
+            self.assertEqual(new_bot.sessions.get_session("u1", "user1").get_conversation_id(), "conv-1")
+
+
+if __name__ == "__main__":
+    unittest.main()
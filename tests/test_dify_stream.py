@@ -0,0 +1,80 @@
+import os
+import sys
+import unittest
+
+from bot.dify.dify_bot import DifyBot
+from bot.dify.dify_session import DifySession
+from bot.dify.dify_stream import DifyStreamSplitter
+from bridge.context import Context, ContextType
+from bridge.reply import ReplyType
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "plugins", "banwords", "lib"))
+from compact_search import CompactWordsSearch, WordsStream  # noqa: E402
+
+
+def agent_message(answer):
+    return {"event": "agent_message", "answer": answer, "conversation_id": "c1"}
+
+
+class TestDifyStreamSplitter(unittest.TestCase):
+    def test_flush_paragraph(self):
+        """测试段落结束时立即切分"""
+        splitter = DifyStreamSplitter(min_chars=100, send_interval=0)
+        self.assertEqual(splitter.feed(agent_message("你好")), [])
+        msgs = splitter.feed(agent_message("。\n\n第二段"))
+        self.assertEqual(msgs, [{"type": "agent_message", "content": "你好。"}])
+        self.assertEqual(splitter.finish(), [{"type": "agent_message", "content": "第二段"}])
+        self.assertEqual(splitter.conversation_id, "c1")
+
+    def test_flush_sentence_after_min_chars(self):
+        """测试积累足够字符后按句子切分"""
+        splitter = DifyStreamSplitter(min_chars=5, send_interval=0)
+        msgs = splitter.feed(agent_message("一二三四五六。七八"))
+        self.assertEqual(msgs, [{"type": "agent_message", "content": "一二三四五六。"}])
+        self.assertEqual(splitter.buffer, "七八")
+
+    def test_send_interval(self):
+        """测试发送间隔内的内容合并到下一条"""
+        splitter = DifyStreamSplitter(min_chars=0, send_interval=60)
+        self.assertEqual(len(splitter.feed(agent_message("第一句。"))), 1)
+        self.assertEqual(splitter.feed(agent_message("第二句。")), [])
+        self.assertEqual(splitter.finish(), [{"type": "agent_message", "content": "第二句。"}])
+
+    def test_message_file_and_end(self):
+        """测试文件事件前先发出缓冲内容，message_end后结束"""
+        splitter = DifyStreamSplitter(send_interval=0)
+        splitter.feed(agent_message("图片如下"))
+        msgs = splitter.feed({"event": "message_file", "type": "image", "url": "/files/1.png"})
+        self.assertEqual([m["type"] for m in msgs], ["agent_message", "message_file"])
+        splitter.feed({"event": "message_end", "metadata": {"usage": {}}})
+        self.assertTrue(splitter.finished)
+
+
+class FakeChannel(object):
+    def __init__(self):
+        self.sent = []
+
+    def send(self, reply, context):
+        self.sent.append((reply.type, reply.content))
+
+
+class TestDifyReplyFilter(unittest.TestCase):
+    def test_text_then_file(self):
+        """测试最后一条是文件时，过滤器暂存的文本仍会发出并结束过滤"""
+        search = CompactWordsSearch()
+        search.SetKeywords(["坏人"])
+        stream = WordsStream(search)
+        channel = FakeChannel()
+        context = Context(ContextType.TEXT, "q", kwargs={"channel": channel, "reply_stream_filters": [stream]})
+        msgs = [
+            {"type": "agent_message", "content": "这是坏"},
+            {"type": "message_file", "content": {"url": "https://example.com/1.png"}},
+        ]
+        reply, error = DifyBot()._process_agent_messages(msgs, "c1", DifySession("s1", "u1"), context)
+        self.assertEqual(channel.sent, [(ReplyType.TEXT, "这是"), (ReplyType.TEXT, "坏")])
+        self.assertEqual((reply.type, reply.content), (ReplyType.IMAGE_URL, "https://example.com/1.png"))
+        self.assertTrue(stream.closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import unittest
+
+from bridge.context import Context, ContextType
+from bridge.reply import Reply
+from plugins.event import Event, EventAction, EventContext
+from plugins.plugin_manager import PluginManager
+
+GODCMD_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "plugins", "godcmd")
+
+
+class TestGodcmdStop(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        PluginManager().plugin_paths.setdefault("plugins.godcmd", GODCMD_PATH)
+        import plugins.godcmd  # noqa: F401
+
+        Godcmd = PluginManager().plugins["GODCMD"]
+        cls.godcmd = Godcmd()
+        manager_cls = next(c.cell_contents for c in PluginManager.__closure__ if isinstance(c.cell_contents, type))
+        cls.manager = manager_cls()
+        cls.manager.plugins["GODCMD"] = Godcmd
+        cls.manager.instances["GODCMD"] = cls.godcmd
+        cls.manager.listening_plugins[Event.ON_HANDLE_CONTEXT] = ["GODCMD"]
+        cls.manager.pconf = {"plugins": {}}
+        cls.manager.rebuild_dispatch_table()
+
+    def emit(self, context):
+        return self.manager.emit_event(EventContext(Event.ON_HANDLE_CONTEXT, {"channel": None, "context": context, "reply": Reply()}))
+
+    def test_stopped_breaks_voice(self):
+        """测试#stop后语音等非文本消息也被拦截，不再交给bot处理"""
+        self.godcmd.isrunning = False
+        try:
+            e_context = self.emit(Context(ContextType.VOICE, "/tmp/voice.mp3", kwargs={"session_id": "s1"}))
+        finally:
+            self.godcmd.isrunning = True
+        self.assertEqual(e_context.action, EventAction.BREAK_PASS)
+
+    def test_running_passes_voice(self):
+        """测试运行中不拦截非文本消息"""
+        e_context = self.emit(Context(ContextType.VOICE, "/tmp/voice.mp3", kwargs={"session_id": "s1"}))
+        self.assertEqual(e_context.action, EventAction.CONTINUE)
+
+
+if __name__ == "__main__":
+    unittest.main()
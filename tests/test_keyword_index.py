@@ -0,0 +1,83 @@
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "plugins", "keyword"))
+
+from keyword_index import KeywordIndex, KeywordRule, load_rules
+
+
+def brute_force(rules, content):
+    matched = []
+    for rule in rules:
+        if rule.type == "exact":
+            ok = content == rule.pattern
+        elif rule.type == "prefix":
+            ok = content.startswith(rule.pattern)
+        elif rule.type == "contains":
+            ok = rule.pattern != "" and rule.pattern in content
+        else:
+            ok = rule.regex.search(content) is not None
+        if ok:
+            matched.append(rule)
+    return min(matched, key=lambda r: r.key) if matched else None
+
+
+class TestKeywordIndex(unittest.TestCase):
+    def test_type_order(self):
+        """测试优先级相同时 完全匹配 > 前缀 > 包含 > 正则"""
+        rules = load_rules(
+            {
+                "keyword": {"你好": "exact"},
+                "rules": [
+                    {"type": "regex", "pattern": "好$", "reply": "regex"},
+                    {"type": "contains", "pattern": "好", "reply": "contains"},
+                    {"type": "prefix", "pattern": "你", "reply": "prefix"},
+                ],
+            }
+        )
+        index = KeywordIndex(rules)
+        self.assertEqual(index.match("你好").reply, "exact")
+        self.assertEqual(index.match("你真好").reply, "prefix")
+        self.assertEqual(index.match("很好呀").reply, "contains")
+        self.assertIsNone(index.match("再见"))
+
+    def test_priority(self):
+        """测试priority高的规则优先于匹配方式"""
+        index = KeywordIndex(
+            load_rules(
+                {
+                    "keyword": {"退款": "exact"},
+                    "rules": [{"type": "regex", "pattern": "^退款\\d*$", "reply": "regex", "priority": 1}],
+                }
+            )
+        )
+        self.assertEqual(index.match("退款").reply, "regex")
+
+    def test_legacy_format(self):
+        """测试旧格式keyword配置为完全匹配，列表回复随机选择"""
+        index = KeywordIndex(load_rules({"keyword": {"a": ["x", "y"]}}))
+        rule = index.match("a")
+        self.assertEqual(rule.type, "exact")
+        self.assertIn(rule.pick_reply(), ["x", "y"])
+        self.assertIsNone(index.match("ab"))
+
+    def test_same_as_brute_force(self):
+        """测试随机规则下索引结果与逐条匹配一致"""
+        rng = random.Random(0)
+        alphabet = "ab你好"
+        for _ in range(200):
+            rules = []
+            for i in range(rng.randint(1, 15)):
+                type = rng.choice(["exact", "prefix", "contains", "regex"])
+                pattern = "".join(rng.choice(alphabet) for _ in range(rng.randint(0 if type == "prefix" else 1, 3)))
+                rules.append(KeywordRule(type, pattern, str(i), rng.randint(0, 2), i))
+            index = KeywordIndex(rules)
+            for _ in range(10):
+                content = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 6)))
+                self.assertIs(index.match(content), brute_force(rules, content), content)
+
+
+if __name__ == "__main__":
+    unittest.main()
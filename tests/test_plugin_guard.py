@@ -0,0 +1,119 @@
+import threading
+import time
+import unittest
+
+from bridge.context import Context, ContextType
+from bridge.reply import Reply, ReplyType
+from config import conf
+from plugins.event import Event, EventAction, EventContext
+from plugins.plugin_guard import CircuitBreaker, PluginTimeoutError, call_with_timeout
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self):
+        self.old = {k: conf().get(k) for k in ("plugin_breaker_threshold", "plugin_breaker_cooldown", "plugin_breaker_max_cooldown")}
+        conf()["plugin_breaker_threshold"] = 2
+        conf()["plugin_breaker_cooldown"] = 0.05
+        conf()["plugin_breaker_max_cooldown"] = 0.15
+
+    def tearDown(self):
+        for k, v in self.old.items():
+            conf()[k] = v
+
+    def test_trip_and_recover(self):
+        """测试连续失败后暂停，到期后只放行一次试探调用，成功后恢复"""
+        breaker = CircuitBreaker()
+        breaker.record_failure("A")
+        self.assertTrue(breaker.allow("A"))
+        breaker.record_failure("A")
+        self.assertFalse(breaker.allow("A"))
+        self.assertIn("A", breaker.status())
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow("A"))
+        self.assertFalse(breaker.allow("A"))  # 试探中
+        breaker.record_success("A")
+        self.assertTrue(breaker.allow("A"))
+        self.assertEqual(breaker.status(), {})
+
+    def test_exponential_cooldown(self):
+        """测试试探失败后暂停时间翻倍，且不超过最大值"""
+        breaker = CircuitBreaker()
+        breaker.record_failure("A")
+        breaker.record_failure("A")
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow("A"))
+        breaker.record_failure("A")  # 试探失败，立即再次暂停
+        self.assertAlmostEqual(breaker.status()["A"], 0.1, delta=0.02)
+        breaker._trips["A"] = 10
+        breaker.record_failure("A")
+        breaker.record_failure("A")
+        self.assertLessEqual(breaker.status()["A"], 0.15)
+        breaker.reset("A")
+        self.assertTrue(breaker.allow("A"))
+
+
+class TestCallWithTimeout(unittest.TestCase):
+    def test_result_written_back(self):
+        def handler(e_context):
+            e_context["reply"] = "ok"
+            e_context.action = EventAction.BREAK_PASS
+
+        e_context = EventContext(Event.ON_HANDLE_CONTEXT, {"reply": None})
+        call_with_timeout(handler, e_context, 1)
+        self.assertEqual(e_context["reply"], "ok")
+        self.assertTrue(e_context.is_pass())
+
+    def test_timeout_discards_changes(self):
+        """测试超时后放弃的处理函数不会影响原e_context"""
+        done = threading.Event()
+
+        def handler(e_context):
+            time.sleep(0.1)
+            e_context["reply"] = "late"
+            e_context.action = EventAction.BREAK_PASS
+            done.set()
+
+        e_context = EventContext(Event.ON_HANDLE_CONTEXT, {"reply": None})
+        with self.assertRaises(PluginTimeoutError):
+            call_with_timeout(handler, e_context, 0.02)
+        done.wait(1)
+        self.assertIsNone(e_context["reply"])
+        self.assertEqual(e_context.action, EventAction.CONTINUE)
+
+    def test_timeout_keeps_context_and_reply(self):
+        """测试超时后放弃的处理函数原地修改context和reply也不会影响后续流程，成功时写回原对象"""
+        done = threading.Event()
+
+        def slow(e_context):
+            time.sleep(0.1)
+            e_context["context"].content = "late"
+            e_context["context"]["session_id"] = "late"
+            e_context["reply"].content = "late"
+            done.set()
+
+        context = Context(ContextType.TEXT, "hi", kwargs={"session_id": "s1"})
+        reply = Reply(ReplyType.TEXT, "")
+        e_context = EventContext(Event.ON_HANDLE_CONTEXT, {"context": context, "reply": reply})
+        with self.assertRaises(PluginTimeoutError):
+            call_with_timeout(slow, e_context, 0.02)
+        done.wait(1)
+        self.assertEqual((context.content, context["session_id"], reply.content), ("hi", "s1", ""))
+
+        def fast(e_context):
+            e_context["context"].type = ContextType.IMAGE_CREATE
+            e_context["context"].content = "draw"
+
+        call_with_timeout(fast, e_context, 1)
+        self.assertIs(e_context["context"], context)
+        self.assertEqual((context.type, context.content), (ContextType.IMAGE_CREATE, "draw"))
+
+    def test_exception_propagates(self):
+        def handler(e_context):
+            raise ValueError("boom")
+
+        with self.assertRaises(ValueError):
+            call_with_timeout(handler, EventContext(Event.ON_HANDLE_CONTEXT, {}), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import tempfile
+import unittest
+
+from plugins.plugin_manager import LazyPlugin, PluginManager, read_plugin_metadata
+
+
+class TestPluginMetadata(unittest.TestCase):
+    def _write(self, source):
+        path = tempfile.mkdtemp()
+        with open(os.path.join(path, "demo.py"), "w", encoding="utf-8") as f:
+            f.write(source)
+        return path
+
+    def test_read_builtin_plugin(self):
+        """测试不导入模块读取内置插件的注册信息"""
+        plugin_path = os.path.join(os.path.dirname(__file__), "..", "plugins", "role")
+        metas = read_plugin_metadata(plugin_path)
+        self.assertEqual(len(metas), 1)
+        self.assertEqual(metas[0]["name"], "Role")
+        self.assertEqual(metas[0]["namecn"], "角色扮演")
+        self.assertFalse(metas[0]["enabled"])
+
+        plugin = LazyPlugin("plugins.role", plugin_path, **metas[0])
+        self.assertTrue(plugin.lazy)
+        self.assertEqual((plugin.name, plugin.priority, plugin.version, plugin.hidden), ("Role", 0, "1.0", False))
+
+    def test_positional_args(self):
+        path = self._write("@plugins.register('Demo', 5, desc='d')\nclass Demo(Plugin):\n    pass\n")
+        self.assertEqual(read_plugin_metadata(path), [{"name": "Demo", "desire_priority": 5, "desc": "d"}])
+
+    def test_fallback_to_import(self):
+        """测试参数不是字面量或没有注册装饰器时返回None，由调用方导入模块"""
+        path = self._write("VERSION = '1.0'\n@plugins.register(name='Demo', version=VERSION)\nclass Demo(Plugin):\n    pass\n")
+        self.assertIsNone(read_plugin_metadata(path))
+        path = self._write("class Demo(Plugin):\n    pass\n")
+        self.assertIsNone(read_plugin_metadata(path))
+
+
+class TestRegisterPath(unittest.TestCase):
+    def test_lazy_register_uses_module_path(self):
+        """测试延迟导入的插件按模块路径取插件目录，不受之前导入失败的插件影响"""
+        cls = next(c.cell_contents for c in PluginManager.__closure__ if isinstance(c.cell_contents, type))
+        manager = cls()
+        manager.plugin_paths = {"plugins.demo": "/plugins/demo"}
+        manager.current_plugin_path = "/plugins/broken"
+        demo = type("Demo", (object,), {"__module__": "plugins.demo.demo"})
+        manager.register(name="Demo")(demo)
+        self.assertEqual(manager.plugins["DEMO"].path, "/plugins/demo")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import time
+import unittest
+
+from config import conf
+from plugins.plugin_metrics import LATENCY_BUCKETS, PluginMetrics
+
+
+class TestPluginMetrics(unittest.TestCase):
+    def test_counts(self):
+        """测试调用、异常和中断次数统计"""
+        metrics = PluginMetrics()
+        metrics.finish(metrics.start("A", "ON_HANDLE_CONTEXT"), "A", "ON_HANDLE_CONTEXT", "CONTINUE")
+        metrics.finish(metrics.start("A", "ON_HANDLE_CONTEXT"), "A", "ON_HANDLE_CONTEXT", "BREAK")
+        metrics.finish(metrics.start("A", "ON_HANDLE_CONTEXT"), "A", "ON_HANDLE_CONTEXT", "BREAK_PASS")
+        metrics.finish(metrics.start("A", "ON_HANDLE_CONTEXT"), "A", "ON_HANDLE_CONTEXT", error=True)
+        stats = metrics.snapshot()["A"]["ON_HANDLE_CONTEXT"]
+        self.assertEqual((stats["calls"], stats["errors"], stats["breaks"], stats["passes"]), (4, 1, 1, 1))
+        self.assertEqual(sum(stats["buckets"]), 4)
+        metrics.reset()
+        self.assertEqual(metrics.snapshot(), {})
+
+    def test_export_prometheus(self):
+        metrics = PluginMetrics()
+        metrics.finish(metrics.start("A", "ON_SEND_REPLY"), "A", "ON_SEND_REPLY", "CONTINUE")
+        text = metrics.export_prometheus()
+        self.assertIn('plugin_handler_seconds_bucket{plugin="A",event="ON_SEND_REPLY",le="+Inf"} 1', text)
+        self.assertIn('plugin_handler_seconds_count{plugin="A",event="ON_SEND_REPLY"} 1', text)
+        self.assertIn('plugin_handler_errors_total{plugin="A",event="ON_SEND_REPLY"} 0', text)
+        self.assertEqual(text.count("_bucket{"), len(LATENCY_BUCKETS) + 1)
+
+    def test_slow_handler_stack_sample(self):
+        """测试处理超时时采样调用栈"""
+        old = conf().get("plugin_slow_threshold")
+        conf()["plugin_slow_threshold"] = 0.05
+        try:
+            metrics = PluginMetrics()
+            with self.assertLogs("log", level="WARNING") as logs:
+                call = metrics.start("A", "ON_HANDLE_CONTEXT")
+                time.sleep(0.2)
+                metrics.finish(call, "A", "ON_HANDLE_CONTEXT", "CONTINUE")
+            output = "\n".join(logs.output)
+            self.assertIn("stack", output)
+            self.assertIn("test_slow_handler_stack_sample", output)
+            self.assertIn("slow handler", output)
+        finally:
+            conf()["plugin_slow_threshold"] = old
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from bot.bytedance.coze_session import CozeSession
+from bot.chatgpt.chat_gpt_session import ChatGPTSession
+from bot.dify.dify_session import DifySession
+from common.session_store import (
+    MemorySessionStore,
+    SqliteSessionStore,
+    decode_state,
+    encode_state,
+)
+
+
+class TestSqliteSessionStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "sessions.db")
+        self.stores = []
+
+    def tearDown(self):
+        for store in self.stores:
+            store.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def new_store(self, namespace="ChatGPTSession", factory=None, **kwargs):
+        factory = factory or (lambda session_id: ChatGPTSession(session_id, model="gpt-3.5-turbo"))
+        store = SqliteSessionStore(namespace, factory, path=self.path, flush_interval=60, **kwargs)
+        self.stores.append(store)
+        return store
+
+    def test_share_after_flush(self):
+        """测试写入先进入待写队列，flush后其他实例(进程)可见"""
+        writer = self.new_store()
+        reader = self.new_store()
+        session = ChatGPTSession("s1", system_prompt="prompt", model="gpt-3.5-turbo")
+        session.add_query("hello")
+        writer["s1"] = session
+        self.assertEqual(writer["s1"].messages, session.messages)
+        self.assertNotIn("s1", reader)
+        writer.flush()
+        self.assertEqual(reader["s1"].messages, session.messages)
+        self.assertEqual(reader["s1"].system_prompt, "prompt")
+
+    def test_restore_dify_session(self):
+        """测试重启后恢复dify conversation_id"""
+        factory = lambda session_id: DifySession(session_id, "")
+        store = self.new_store("DifySession", factory)
+        session = DifySession("s1", "user")
+        session.set_conversation_id("conv")
+        store["s1"] = session
+        store.close()
+        restored = self.new_store("DifySession", factory)["s1"]
+        self.assertEqual(restored.get_conversation_id(), "conv")
+        self.assertEqual(restored.get_user(), "user")
+
+    def test_restore_coze_session(self):
+        """测试重启后恢复coze conversation_id和消息"""
+        factory = lambda session_id: CozeSession(session_id, None)
+        store = self.new_store("CozeSession", factory)
+        session = CozeSession("s1", "user")
+        session.set_conversation_id("conv")
+        session.add_query("hello")
+        store["s1"] = session
+        store.close()
+        restored = self.new_store("CozeSession", factory)["s1"]
+        self.assertEqual((restored.get_session_id(), restored.get_user_id(), restored.get_conversation_id()), ("s1", "user", "conv"))
+        self.assertEqual(restored.messages, session.messages)
+
+    def test_delete_and_expire(self):
+        """测试删除和过期"""
+        store = self.new_store(ttl=-1)
+        store["s1"] = ChatGPTSession("s1", model="gpt-3.5-turbo")
+        self.assertNotIn("s1", store)
+        store = self.new_store()
+        store["s2"] = ChatGPTSession("s2", model="gpt-3.5-turbo")
+        store.flush()
+        del store["s2"]
+        store.flush()
+        self.assertIsNone(store.get("s2"))
+
+    def test_encode_state(self):
+        """测试较大的状态会被压缩"""
+        state = {"messages": [{"role": "user", "content": "你好" * 500}]}
+        data = encode_state(state)
+        self.assertTrue(data.startswith(b"z"))
+        self.assertEqual(decode_state(data), state)
+        self.assertEqual(decode_state(encode_state({"a": 1})), {"a": 1})
+
+
+class TestMemorySessionStore(unittest.TestCase):
+    def test_keep_object(self):
+        """测试内存存储直接保存会话对象"""
+        store = MemorySessionStore(None)
+        session = ChatGPTSession("s1", model="gpt-3.5-turbo")
+        store["s1"] = session
+        self.assertIs(store["s1"], session)
+        self.assertIn("s1", store)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import threading
+import unittest
+
+from common.thread_pool import ElasticThreadPool, PoolRejectedError
+
+
+class TestElasticThreadPool(unittest.TestCase):
+    def test_submit_result(self):
+        """测试任务正常执行"""
+        pool = ElasticThreadPool("test", max_workers=2)
+        self.assertEqual(pool.submit(lambda a, b: a + b, 1, 2).result(timeout=5), 3)
+        pool.shutdown()
+
+    def test_grow_to_max_workers(self):
+        """测试排队时扩容，且不超过最大线程数"""
+        pool = ElasticThreadPool("test", max_workers=3)
+        event = threading.Event()
+        futures = [pool.submit(event.wait) for _ in range(6)]
+        self.assertEqual(pool.metrics()["workers"], 3)
+        event.set()
+        for f in futures:
+            f.result(timeout=5)
+        self.assertEqual(pool.metrics()["completed"], 6)
+        pool.shutdown()
+
+    def test_reject_when_queue_full(self):
+        """测试队列满时返回失败的future并计数"""
+        pool = ElasticThreadPool("test", max_workers=1, max_queue_size=1)
+        event = threading.Event()
+        started = threading.Event()
+        running = pool.submit(lambda: (started.set(), event.wait()))
+        started.wait(timeout=5)
+        queued = pool.submit(lambda: None)
+        rejected = pool.submit(lambda: None)
+        self.assertIsInstance(rejected.exception(timeout=5), PoolRejectedError)
+        self.assertEqual(pool.metrics()["rejected"], 1)
+        event.set()
+        running.result(timeout=5)
+        queued.result(timeout=5)
+        pool.shutdown()
+
+    def test_shrink_when_idle(self):
+        """测试空闲线程回收"""
+        pool = ElasticThreadPool("test", max_workers=2, min_workers=0, idle_seconds=0.05)
+        pool.submit(lambda: None).result(timeout=5)
+        for _ in range(100):
+            if pool.metrics()["workers"] == 0:
+                break
+            threading.Event().wait(0.02)
+        self.assertEqual(pool.metrics()["workers"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+import time
+import unittest
+from unittest import mock
+
+import config
+from common.time_check import ServiceSchedule, time_checker
+
+
+def at(weekday, hhmm):
+    """构造周weekday(1-7)的hh:mm时刻"""
+    hour, minute = map(int, hhmm.split(":"))
+    return time.struct_time((2024, 1, weekday, hour, minute, 0, weekday - 1, weekday, 0))
+
+
+class TestServiceSchedule(unittest.TestCase):
+    def test_windows(self):
+        schedule = ServiceSchedule(["09:00-12:00", "1-5 14:00-18:00", "6,7 22:00-02:00"])
+        self.assertTrue(schedule.is_open(at(3, "09:00")))
+        self.assertTrue(schedule.is_open(at(3, "12:00")))  # 结束时间所在分钟包含在内
+        self.assertFalse(schedule.is_open(at(3, "12:01")))
+        self.assertTrue(schedule.is_open(at(5, "15:30")))
+        self.assertFalse(schedule.is_open(at(6, "15:30")))
+        self.assertTrue(schedule.is_open(at(7, "23:00")))
+        self.assertTrue(schedule.is_open(at(1, "01:59")))  # 周日跨天到周一
+        self.assertFalse(schedule.is_open(at(6, "01:00")))
+
+    def test_legacy_range(self):
+        self.assertTrue(ServiceSchedule(["00:00-24:00"]).is_open(at(2, "23:59")))
+        self.assertFalse(ServiceSchedule(["10:00-10:00"]).is_open(at(2, "10:00")))
+
+    def test_invalid(self):
+        for window in ["9-18", "25:00-10:00", "8 09:00-10:00"]:
+            with self.assertRaises(ValueError):
+                ServiceSchedule([window])
+
+
+class TestTimeChecker(unittest.TestCase):
+    def test_group_schedule(self):
+        """测试群配置优先，非服务时间仍可执行#reconf"""
+        handled = []
+
+        class Msg(object):
+            def __init__(self, content, group=None):
+                self.content = content
+                self.is_group = group is not None
+                self.other_user_nickname = group
+
+        class Channel(object):
+            channel_type = "wx"
+
+            @time_checker
+            def handle(self, cmsg):
+                handled.append(cmsg.content)
+
+        conf = config.Config({
+            "chat_time_module": True,
+            "chat_time_windows": ["00:00-24:00"],
+            "chat_time_group_windows": {"夜间群": ["22:00-23:00"]},
+        })
+        with mock.patch("config.config", conf), mock.patch("time.localtime", return_value=at(1, "10:00")):
+            Channel().handle(Msg("a"))
+            Channel().handle(Msg("b", "夜间群"))
+            Channel().handle(Msg("c #reconf", "夜间群"))
+        self.assertEqual(handled, ["a", "c #reconf"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+
+from channel.chat_channel import check_contain, check_prefix
+from channel.trigger_index import (
+    KeywordMatcher,
+    PrefixMatcher,
+    at_pattern,
+    get_trigger_index,
+)
+from common.aho_corasick import AhoCorasick
+from config import Config, ConfigSnapshot, conf
+
+
+class TestAhoCorasick(unittest.TestCase):
+    def test_findall(self):
+        ac = AhoCorasick(["he", "she", "his", "hers"])
+        self.assertEqual(sorted(ac.findall("ushers")), [(1, "she"), (2, "he"), (2, "hers")])
+        self.assertIsNone(ac.search("xyz"))
+
+
+class TestTriggerIndex(unittest.TestCase):
+    def test_prefix_same_as_check_prefix(self):
+        """测试前缀树与check_prefix结果一致"""
+        cases = [["bot", "b"], ["b", "bot"], [""], ["", "画"], None, []]
+        for prefixes in cases:
+            matcher = PrefixMatcher(prefixes)
+            for content in ["bot hello", "b", "画一只猫", "hello", ""]:
+                self.assertEqual(matcher.match(content), check_prefix(content, prefixes), (prefixes, content))
+
+    def test_keyword_same_as_check_contain(self):
+        """测试关键词匹配与check_contain结果一致，包括使用AC自动机时"""
+        cases = [["机器人"], ["kw{}".format(i) for i in range(100)], [""], None]
+        for keywords in cases:
+            matcher = KeywordMatcher(keywords)
+            for content in ["你好机器人", "xx kw42 yy", "hello", ""]:
+                self.assertEqual(matcher.match(content), bool(check_contain(content, keywords)), (keywords, content))
+
+    def test_rebuild_on_config_change(self):
+        """测试修改配置后重新编译"""
+        old = conf().get("group_name_white_list")
+        try:
+            conf()["group_name_white_list"] = ["测试群"]
+            self.assertTrue(get_trigger_index().is_group_allowed("测试群"))
+            conf()["group_name_white_list"] = ["其他群"]
+            self.assertFalse(get_trigger_index().is_group_allowed("测试群"))
+        finally:
+            conf()["group_name_white_list"] = old
+
+    def test_build_from_snapshot(self):
+        """测试索引由所属的快照编译，而不是当前配置；索引用到的配置不变时沿用"""
+        snapshot = ConfigSnapshot(Config({"group_name_white_list": ["快照群"]}))
+        self.assertTrue(snapshot.triggers.is_group_allowed("快照群"))
+        same = ConfigSnapshot(Config({"group_name_white_list": ["快照群"], "debug": True}))
+        self.assertIs(same.triggers, snapshot.triggers)
+        self.assertFalse(get_trigger_index().is_group_allowed("快照群"))
+
+    def test_at_pattern(self):
+        self.assertEqual(at_pattern("bot").sub("", "@bot 你好"), "你好")
+        self.assertIs(at_pattern("bot"), at_pattern("bot"))
+
+
+if __name__ == "__main__":
+    unittest.main()
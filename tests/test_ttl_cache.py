@@ -0,0 +1,58 @@
+import time
+import unittest
+
+from common.ttl_cache import TTLCache
+
+
+class TestTTLCache(unittest.TestCase):
+    def test_expire(self):
+        """测试过期后无法读取，并触发淘汰回调"""
+        evicted = []
+        cache = TTLCache(0.05, on_evict=lambda k, v, reason: evicted.append((k, v, reason)))
+        cache["a"] = 1
+        self.assertEqual(cache["a"], 1)
+        time.sleep(0.1)
+        self.assertNotIn("a", cache)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(evicted, [("a", 1, "expired")])
+
+    def test_access_refreshes_ttl(self):
+        """测试访问刷新过期时间"""
+        cache = TTLCache(0.2)
+        cache["a"] = 1
+        for _ in range(3):
+            time.sleep(0.1)
+            self.assertEqual(cache["a"], 1)
+
+    def test_capacity_lru(self):
+        """测试超出容量时淘汰最久未访问的元素"""
+        evicted = []
+        cache = TTLCache(60, maxsize=2, on_evict=lambda k, v, reason: evicted.append((k, reason)))
+        cache["a"] = 1
+        cache["b"] = 2
+        cache["a"]
+        cache["c"] = 3
+        self.assertEqual(sorted(cache.keys()), ["a", "c"])
+        self.assertEqual(evicted, [("b", "capacity")])
+
+    def test_expire_sweep(self):
+        """测试批量清理过期元素"""
+        cache = TTLCache(0.05)
+        for i in range(10):
+            cache[i] = i
+        time.sleep(0.1)
+        self.assertEqual(cache.expire(), 10)
+        self.assertEqual(len(cache), 0)
+
+    def test_no_ttl(self):
+        """测试不设置过期时间时作为普通LRU使用"""
+        cache = TTLCache(None, maxsize=1)
+        cache["a"] = 1
+        cache["b"] = 2
+        self.assertEqual(dict(cache.items()), {"b": 2})
+        del cache["b"]
+        self.assertEqual(len(cache), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
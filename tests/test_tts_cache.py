@@ -0,0 +1,118 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import config
+from bridge.reply import Reply, ReplyType
+from common.tmp_dir import TmpDir
+from voice import audio_convert, tts_cache
+from voice.tts_cache import TtsCache, cache_key
+from voice.voice import Voice
+
+
+class FakeVoice(Voice):
+    def __init__(self):
+        self.calls = []
+
+    def cache_params(self, text):
+        return {"voice": "fake"}
+
+    def textToVoice(self, text):
+        self.calls.append(text)
+        path = TmpDir().path() + "fake-{}.mp3".format(len(self.calls))
+        with open(path, "wb") as f:
+            f.write(("voice:" + text).encode("utf-8"))
+        return Reply(ReplyType.VOICE, path)
+
+
+class TestTtsCache(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.voice = FakeVoice()
+
+    def synthesize(self, cache, text):
+        reply = cache.synthesize(self.voice, self.voice.cache_params(text), text)
+        with open(reply.content, "rb") as f:
+            data = f.read()
+        os.remove(reply.content)  # channel发送后会删除文件
+        return data
+
+    def test_hit(self):
+        cache = TtsCache(self.root)
+        self.assertEqual(self.synthesize(cache, "欢迎  光临"), "voice:欢迎  光临".encode("utf-8"))
+        self.assertEqual(self.synthesize(cache, "欢迎 光临 "), "voice:欢迎  光临".encode("utf-8"))
+        self.assertEqual(self.voice.calls, ["欢迎  光临"])
+        self.assertNotEqual(cache_key("FakeVoice", {"voice": "a"}, "hi"), cache_key("FakeVoice", {"voice": "b"}, "hi"))
+        # 重启后从index.json恢复
+        self.synthesize(TtsCache(self.root), "欢迎光临")
+        self.synthesize(TtsCache(self.root), "欢迎 光临")
+        self.assertEqual(self.voice.calls, ["欢迎  光临", "欢迎光临"])
+
+    def test_lru_eviction(self):
+        cache = TtsCache(self.root)
+        with mock.patch.dict(config.conf(), {"tts_cache_max_size": 15 / 1024 / 1024}):
+            self.synthesize(cache, "a")
+            self.synthesize(cache, "b")
+            self.synthesize(cache, "a")  # a最近使用过，写入c时淘汰b
+            self.synthesize(cache, "c")
+        self.assertEqual(len(cache), 2)
+        self.synthesize(cache, "a")
+        self.synthesize(cache, "b")
+        self.assertEqual(self.voice.calls, ["a", "b", "c", "b"])
+
+    def test_concurrent_put(self):
+        """测试同一文本并发合成时只保留一份缓存，不互相删除文件"""
+        cache = TtsCache(self.root)
+        paths = [os.path.join(self.root, "{}.mp3".format(i)) for i in range(2)]
+        for path in paths:
+            with open(path, "wb") as f:
+                f.write(b"voice")
+        copy_into = tts_cache._copy_into
+
+        def racing_copy(src, dst):
+            if src == paths[0]:
+                cache.put("k", paths[1])  # 另一个线程在复制期间先写入
+            copy_into(src, dst)
+
+        with mock.patch.object(tts_cache, "_copy_into", racing_copy):
+            cache.put("k", paths[0])
+        self.assertEqual(len(cache), 1)
+        path = cache.get("k")
+        self.assertIsNotNone(path)
+        os.remove(path)
+        self.assertEqual(len([n for n in os.listdir(self.root) if n.startswith("k-")]), 1)
+
+    def test_silk_by_path(self):
+        """测试按交给channel的文件路径找到缓存条目，silk只编码一次"""
+        cache = TtsCache(self.root)
+
+        def encode(voice_path, silk_path):
+            with open(silk_path, "wb") as f:
+                f.write(b"silk")
+            return 1000
+
+        with mock.patch.object(tts_cache, "any_to_sil", side_effect=encode) as any_to_sil:
+            for path in [cache.synthesize(self.voice, self.voice.cache_params("hi"), "hi").content, cache.get(cache_key("FakeVoice", {"voice": "fake"}, "hi"))]:
+                self.assertEqual(cache.to_silk(path, os.path.join(self.root, "a.silk")), 1000)
+                os.remove(path)
+        self.assertEqual(any_to_sil.call_count, 1)
+
+    @unittest.skipUnless(audio_convert.pysilk or getattr(audio_convert, "pilk", None), "silk encoder not installed")
+    def test_silk_reuse(self):
+        """测试缓存的语音只编码一次silk"""
+        cache = TtsCache(self.root)
+        wav_path = os.path.join(self.root, "a.wav")
+        with open(wav_path, "wb") as f:
+            f.write(audio_convert.pcm_to_wav(b"\x00\x01" * 24000, 24000))
+        cache.put("k", wav_path)
+        with mock.patch("voice.tts_cache.any_to_sil", wraps=audio_convert.any_to_sil) as encode:
+            self.assertEqual(cache.to_silk(cache.get("k"), os.path.join(self.root, "1.silk")), 1000)
+            self.assertEqual(cache.to_silk(cache.get("k"), os.path.join(self.root, "2.silk")), 1000)
+            self.assertEqual(encode.call_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import time
+import unittest
+from unittest import mock
+
+from bridge.context import Context, ContextType
+from bridge.reply import Reply, ReplyType
+from channel.channel import Channel
+from channel.chat_channel import ChatChannel
+from voice.tts_pipeline import plan_segments, split_sentences
+
+
+class VoiceChannel(ChatChannel):
+    NOT_SUPPORT_REPLYTYPE = []
+    VOICE_MAX_DURATION = 5000  # 预估约20个字
+
+    def __init__(self):
+        super().__init__()
+        self.sent = []
+
+    def send(self, reply, context):
+        self.sent.append((reply.type, reply.content))
+
+
+def slow_tts(self, text):
+    time.sleep(0.05 if text.startswith("第一") else 0)  # 第一段最慢，仍应最先发送
+    return Reply(ReplyType.VOICE, text)
+
+
+class TestTtsPipeline(unittest.TestCase):
+    def test_plan_segments(self):
+        self.assertEqual(split_sentences("你好！今天天气不错。Hi there. ok"), ["你好！", "今天天气不错。", "Hi there.", "ok"])
+        text = "第一句。" + "这是比较长的第二句话，" * 3 + "。短句。"
+        segments = plan_segments(text, 5000)
+        self.assertEqual(segments[0], "第一句。")
+        self.assertTrue(all(len(s) <= 20 for s in segments))
+        self.assertEqual("".join(segments), text)
+        self.assertEqual(plan_segments("只有一句", 5000), ["只有一句"])
+
+    def test_send_in_order(self):
+        channel = VoiceChannel()
+        context = Context(ContextType.TEXT, "q", kwargs={"desire_rtype": ReplyType.VOICE})
+        with mock.patch.object(Channel, "build_text_to_voice", slow_tts), mock.patch.dict("config.config", {"voice_reply_pipeline": True}):
+            reply = channel._decorate_reply(context, Reply(ReplyType.TEXT, "第一句。第二句话有点长，需要单独合成一下。第三句。"))
+        self.assertIsNone(reply)
+        self.assertEqual(channel.sent, [(ReplyType.VOICE, "第一句。"), (ReplyType.VOICE, "第二句话有点长，需要单独合成一下。"), (ReplyType.VOICE, "第三句。")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -15,7 +15,7 @@ import time
 
 from bridge.reply import Reply, ReplyType
 from common.log import logger
-from voice.audio_convert import get_pcm_from_wav
+from voice.audio_convert import load_pcm
 from voice.voice import Voice
 from voice.ali.ali_api import AliyunTokenGenerator, speech_to_text_aliyun, text_to_speech_aliyun
 from config import conf
@@ -42,6 +42,9 @@ class AliVoice(Voice):
         except Exception as e:
             logger.warn("AliVoice init failed: %s, ignore " % e)
 
+    def cache_params(self, text):
+        return {"url": self.api_url_text_to_voice, "appkey": self.app_key}
+
     def textToVoice(self, text):
         """
         将文本转换为语音文件。
@@ -72,7 +75,7 @@ class AliVoice(Voice):
         # 提取有效的token
         token_id = self.get_valid_token()
         logger.debug("[Ali] voice file name={}".format(voice_file))
-        pcm = get_pcm_from_wav(voice_file)
+        pcm = load_pcm(voice_file, 16000)
         text = speech_to_text_aliyun(self.api_url_voice_to_text, pcm, self.app_key, token_id)
         if text:
             logger.info("[Ali] VoicetoText = {}".format(text))
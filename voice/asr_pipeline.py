@@ -0,0 +1,71 @@
+# encoding:utf-8
+
+"""
+长语音分段识别
+
+语音超过asr_segment_duration秒时在内存中解码为pcm，按静音切分为不超过该时长的片段，
+在asr_segment线程池中并发识别后按顺序拼接，线程池大小即语音识别接口的最大并发请求数
+"""
+
+import os
+import re
+
+from bridge.reply import Reply, ReplyType
+from common.log import logger
+from common.thread_pool import get_thread_pool
+from config import conf
+from voice.audio_convert import PcmAudio, load_pcm, pcm_duration, split_on_silence
+
+ASR_RATE = 16000
+# 前后文本都不是中日韩文字时拼接处补空格
+_CJK = re.compile(r"[　-ヿ㐀-鿿가-힯＀-￯]")
+
+
+def join_transcripts(texts) -> str:
+    result = ""
+    for text in texts:
+        text = text.strip()
+        if not text:
+            continue
+        if result and not _CJK.match(result[-1]) and not _CJK.match(text[0]):
+            result += " "
+        result += text
+    return result
+
+
+def voice_to_text(voice, voice_file) -> Reply:
+    """
+    语音识别，长语音分段并发识别，未开启分段时直接识别整个文件
+    开启分段后语音只解码一次，短语音以解码后的PcmAudio交给引擎，避免引擎再次解码
+    """
+    max_ms = int(conf().get("asr_segment_duration", 0) * 1000)
+    if max_ms <= 0:
+        return voice.voiceToText(voice_file)
+    try:
+        pcm = load_pcm(voice_file, ASR_RATE)
+    except Exception as e:
+        logger.warning("[ASR] decode {} failed, recognize whole file: {}".format(voice_file, e))
+        return voice.voiceToText(voice_file)
+    if pcm_duration(pcm, ASR_RATE) <= max_ms:
+        return voice.voiceToText(PcmAudio(pcm, ASR_RATE, os.path.splitext(os.path.basename(voice_file))[0]))
+
+    segments = split_on_silence(pcm, ASR_RATE, max_ms)
+    logger.info("[ASR] split {} ({}ms) into {} segments".format(voice_file, pcm_duration(pcm, ASR_RATE), len(segments)))
+    pool = get_thread_pool("asr_segment")
+    futures = [pool.submit(voice.voiceToText, segment) for segment in segments]
+    texts = []
+    error = None
+    for segment, future in zip(segments, futures):
+        try:
+            reply = future.result()
+        except Exception as e:
+            logger.warning("[ASR] recognize {} failed: {}".format(segment, e))
+            reply = None
+        if reply and reply.type == ReplyType.TEXT:
+            texts.append(reply.content)
+        else:
+            error = error or reply
+    text = join_transcripts(texts)
+    if not text:
+        return error or Reply(ReplyType.ERROR, "抱歉，语音识别失败")
+    return Reply(ReplyType.TEXT, text)
@@ -1,12 +1,18 @@
+import io
 import os
 import shutil
+import subprocess
+import sys
+import tempfile
 import wave
+from array import array
 
 from common.log import logger
 
 try:
     import pysilk
 except ImportError:
+    pysilk = None
     logger.debug("import pysilk failed, wechaty voice message will not be supported.")
 
 try:
@@ -49,6 +55,241 @@ def get_pcm_from_wav(wav_path):
     return wav.readframes(wav.getnframes())
 
 
+# 以下为基于内存的转码接口，pcm统一为单声道16位小端(s16le)，各步骤之间只传递bytes，不产生中间文件
+
+SILK_EXTS = (".sil", ".silk", ".slk")
+SILK_RATE = 24000  # 微信silk语音的采样率
+
+
+class PcmAudio(object):
+    """
+    内存中的pcm音频片段，可以代替文件路径传给load_pcm/load_audio/load_for_upload，
+    语音识别引擎不需要改动就能识别内存中的数据
+    """
+
+    def __init__(self, pcm, rate: int = 16000, name: str = "segment"):
+        self.pcm = pcm
+        self.rate = rate
+        self.name = name
+
+    def __str__(self):
+        return "{}({}ms)".format(self.name, pcm_duration(self.pcm, self.rate))
+
+
+def audio_format(path) -> str:
+    """
+    根据文件后缀判断音频格式
+    :return: silk、mp3、wav、amr等小写格式名
+    """
+    if isinstance(path, PcmAudio):
+        return "pcm"
+    ext = os.path.splitext(path)[1].lower()
+    return "silk" if ext in SILK_EXTS else ext.lstrip(".")
+
+
+def pcm_duration(pcm, rate: int) -> int:
+    """
+    :return: pcm时长(毫秒)
+    """
+    return len(pcm) * 1000 // (2 * rate)
+
+
+def pcm_to_wav(pcm, rate: int) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(pcm)
+    return buf.getvalue()
+
+
+def _ffmpeg(input_args, output_args, data=None) -> bytes:
+    """
+    通过管道调用ffmpeg，输入输出都不落盘
+    :param input_args: 输入参数，data为None时需包含 -i 文件路径
+    :param data: 通过stdin传入的音频数据
+    """
+    cmd = [shutil.which("ffmpeg") or "ffmpeg", "-hide_banner", "-loglevel", "error"]
+    if data is None:
+        cmd += ["-nostdin"] + input_args
+    else:
+        cmd += input_args + ["-i", "pipe:0"]
+    cmd += output_args + ["pipe:1"]
+    proc = subprocess.run(cmd, input=None if data is None else bytes(data), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise RuntimeError("ffmpeg failed: {}".format(proc.stderr.decode("utf-8", "ignore").strip()))
+    return proc.stdout
+
+
+def _pcm_args(rate: int) -> list:
+    return ["-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(rate)]
+
+
+def _memory_tmp_dir():
+    # pilk只支持文件路径，优先使用内存文件系统
+    return "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+def silk_decode(data, rate: int = SILK_RATE) -> bytes:
+    """
+    silk 解码为 pcm
+    """
+    if pysilk is not None:
+        return pysilk.decode(bytes(data), to_wav=False, sample_rate=rate)
+    with tempfile.TemporaryDirectory(dir=_memory_tmp_dir()) as tmp:
+        silk_path, pcm_path = os.path.join(tmp, "in.silk"), os.path.join(tmp, "out.pcm")
+        with open(silk_path, "wb") as f:
+            f.write(data)
+        pilk.decode(silk_path, pcm_path, pcm_rate=rate)
+        with open(pcm_path, "rb") as f:
+            return f.read()
+
+
+def silk_encode(pcm, rate: int = SILK_RATE) -> bytes:
+    """
+    pcm 编码为 silk(腾讯格式)
+    """
+    if pysilk is not None:
+        return pysilk.encode(bytes(pcm), data_rate=rate, sample_rate=rate)
+    with tempfile.TemporaryDirectory(dir=_memory_tmp_dir()) as tmp:
+        pcm_path, silk_path = os.path.join(tmp, "in.pcm"), os.path.join(tmp, "out.silk")
+        with open(pcm_path, "wb") as f:
+            f.write(pcm)
+        pilk.encode(pcm_path, silk_path, pcm_rate=rate, tencent=True)
+        with open(silk_path, "rb") as f:
+            return f.read()
+
+
+def decode_pcm(data, fmt: str, rate: int = 16000) -> bytes:
+    """
+    把内存中任意格式的音频解码为指定采样率的 pcm
+    :param fmt: 音频格式，见audio_format
+    """
+    if fmt == "silk":
+        pcm = silk_decode(data, SILK_RATE)
+        return pcm if rate == SILK_RATE else _ffmpeg(_pcm_args(SILK_RATE), _pcm_args(rate), pcm)
+    if fmt == "pcm":
+        return bytes(data)
+    if fmt == "wav":
+        with wave.open(io.BytesIO(data), "rb") as wav:
+            if wav.getnchannels() == 1 and wav.getsampwidth() == 2 and wav.getframerate() == rate:
+                return wav.readframes(wav.getnframes())
+    return _ffmpeg(["-f", fmt] if fmt in ("mp3", "amr", "wav") else [], _pcm_args(rate), data)
+
+
+def encode_pcm(pcm, fmt: str, rate: int) -> bytes:
+    """
+    把 pcm 编码为指定格式
+    :param rate: pcm的采样率
+    """
+    if fmt == "silk":
+        silk_rate = find_closest_sil_supports(rate)
+        return silk_encode(pcm if silk_rate == rate else _ffmpeg(_pcm_args(rate), _pcm_args(silk_rate), pcm), silk_rate)
+    if fmt == "pcm":
+        return bytes(pcm)
+    if fmt == "wav":
+        return pcm_to_wav(pcm, rate)
+    if fmt == "amr":
+        return _ffmpeg(_pcm_args(rate), ["-ar", "8000", "-ac", "1", "-f", "amr"], pcm)  # amr只支持8000采样率
+    return _ffmpeg(_pcm_args(rate), ["-f", fmt], pcm)
+
+
+def load_pcm(path, rate: int = 16000) -> bytes:
+    """
+    读取任意格式的音频文件并解码为 pcm
+    """
+    if isinstance(path, PcmAudio):
+        return path.pcm if path.rate == rate else _ffmpeg(_pcm_args(path.rate), _pcm_args(rate), path.pcm)
+    fmt = audio_format(path)
+    if fmt in ("silk", "wav", "pcm"):
+        with open(path, "rb") as f:
+            return decode_pcm(f.read(), fmt, rate)
+    return _ffmpeg(["-i", path], _pcm_args(rate))  # 由ffmpeg直接读取文件，支持m4a等需要随机访问的格式
+
+
+def load_audio(path, fmt: str, rate: int = 16000) -> bytes:
+    """
+    读取音频文件并在内存中转换为指定格式，格式相同时直接返回文件内容
+    :param fmt: 目标格式，silk、wav、mp3、amr、pcm
+    :param rate: 需要重新编码时使用的采样率
+    """
+    if isinstance(path, PcmAudio):
+        rate = SILK_RATE if fmt == "silk" else rate
+        return encode_pcm(load_pcm(path, rate), fmt, rate)
+    if audio_format(path) == fmt:
+        with open(path, "rb") as f:
+            return f.read()
+    if fmt == "silk":
+        rate = SILK_RATE
+    return encode_pcm(load_pcm(path, rate), fmt, rate)
+
+
+def load_for_upload(path, accepted_formats, fmt: str = "mp3"):
+    """
+    读取待上传给语音识别接口的音频，接口不支持该格式时在内存中转换为fmt
+    :return: (文件名, 音频数据)
+    """
+    if isinstance(path, PcmAudio):
+        fmt = "wav" if "wav" in accepted_formats else fmt  # wav不需要调用ffmpeg编码
+        return path.name + "." + fmt, load_audio(path, fmt, path.rate)
+    name = os.path.basename(path)
+    if audio_format(path) in accepted_formats:
+        with open(path, "rb") as f:
+            return name, f.read()
+    return os.path.splitext(name)[0] + "." + fmt, load_audio(path, fmt)
+
+
+def split_on_silence(pcm, rate: int = 16000, max_segment_ms: int = 15000, min_silence_ms: int = 300, silence_thresh: int = 500) -> list:
+    """
+    按静音切分pcm，每段不超过max_segment_ms，尽量在静音处切开，避免把一个词切成两半
+    :param min_silence_ms: 静音至少持续多久才作为切分点
+    :param silence_thresh: 10ms内采样峰值低于该值视为静音
+    :return: PcmAudio列表，全部为静音的片段会被丢弃
+    """
+    samples = array("h")
+    samples.frombytes(bytes(pcm[: len(pcm) // 2 * 2]))
+    if sys.byteorder == "big":
+        samples.byteswap()
+    frame = rate // 100  # 每帧10ms
+    silent = []
+    for i in range(0, len(samples), frame):
+        chunk = samples[i : i + frame]
+        silent.append(max(chunk) < silence_thresh and -min(chunk) < silence_thresh)
+    # 切分点取每段足够长的静音的中点
+    cuts = []
+    run = 0
+    for i, is_silent in enumerate(silent + [False]):
+        if is_silent:
+            run += 1
+            continue
+        if run * 10 >= min_silence_ms:
+            cuts.append(i - run // 2)
+        run = 0
+    max_frames = max(max_segment_ms // 10, 1)
+    bounds = []
+    start = 0
+    for cut in cuts + [len(silent)]:
+        while cut - start > max_frames:
+            # 最后一个不超长的切分点，没有时直接在最大长度处切开
+            end = max((c for c in cuts if start < c <= start + max_frames), default=start + max_frames)
+            bounds.append((start, end))
+            start = end
+        if cut == len(silent) and cut > start:
+            bounds.append((start, cut))
+    segments = []
+    for i, (begin, end) in enumerate(bounds):
+        if all(silent[begin:end]):
+            continue
+        segments.append(PcmAudio(bytes(pcm[begin * frame * 2 : end * frame * 2]), rate, "segment-{}".format(i + 1)))
+    return segments
+
+
+def _write_file(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
 def any_to_mp3(any_path, mp3_path):
     """
     把任意格式转成mp3文件
@@ -62,67 +303,32 @@ def any_to_mp3(any_path, mp3_path):
         if any_path.endswith(".mp3"):
             shutil.copy2(any_path, mp3_path)
             return
-        
-        # 如果是silk格式，使用pilk转换
-        if any_path.endswith((".sil", ".silk", ".slk")):
-            # 先转成PCM
-            pcm_path = any_path + '.pcm'
-            pilk.decode(any_path, pcm_path)
-            
-            # 再用pydub把PCM转成MP3
-            # TODO: 下面的参数可能需要调整
-            audio = AudioSegment.from_raw(pcm_path, format="raw", 
-                                        frame_rate=24000,
-                                        channels=1,
-                                        sample_width=2)  # 16-bit PCM = 2 bytes
-            audio.export(mp3_path, format="mp3")
-            
-            # 清理临时PCM文件
-            import os
-            os.remove(pcm_path)
-            return
-        
-        # 其他格式使用pydub转换
-        audio = AudioSegment.from_file(any_path)
-        audio.export(mp3_path, format="mp3")
-
+        _write_file(mp3_path, load_audio(any_path, "mp3", SILK_RATE))
     except Exception as e:
         logger.error(f"转换文件到mp3失败: {str(e)}")
         raise
 
 
-def any_to_wav(any_path, wav_path):
+def any_to_wav(any_path, wav_path, rate: int = 16000):
     """
-    把任意格式转成wav文件
+    把任意格式转成wav文件，默认16000采样率单声道，适用于大部分语音识别接口
     """
     if any_path.endswith(".wav"):
         shutil.copy2(any_path, wav_path)
         return
-    if any_path.endswith(".sil") or any_path.endswith(".silk") or any_path.endswith(".slk"):
-        return sil_to_wav(any_path, wav_path)
-    audio = AudioSegment.from_file(any_path)
-    audio.set_frame_rate(8000)    # 百度语音转写支持8000采样率, pcm_s16le, 单通道语音识别
-    audio.set_channels(1)
-    audio.export(wav_path, format="wav", codec='pcm_s16le')
+    _write_file(wav_path, load_audio(any_path, "wav", rate))
 
 
 def any_to_sil(any_path, sil_path):
     """
     把任意格式转成sil文件
     """
-    if any_path.endswith(".sil") or any_path.endswith(".silk") or any_path.endswith(".slk"):
+    if any_path.endswith(SILK_EXTS):
         shutil.copy2(any_path, sil_path)
         return 10000
-    audio = AudioSegment.from_file(any_path)
-    rate = find_closest_sil_supports(audio.frame_rate)
-    # Convert to PCM_s16
-    pcm_s16 = audio.set_sample_width(2)
-    pcm_s16 = pcm_s16.set_frame_rate(rate)
-    wav_data = pcm_s16.raw_data
-    silk_data = pysilk.encode(wav_data, data_rate=rate, sample_rate=rate)
-    with open(sil_path, "wb") as f:
-        f.write(silk_data)
-    return audio.duration_seconds * 1000
+    pcm = load_pcm(any_path, SILK_RATE)
+    _write_file(sil_path, silk_encode(pcm, SILK_RATE))
+    return pcm_duration(pcm, SILK_RATE)
 
 def mp3_to_silk(mp3_path: str, silk_path: str) -> int:
     """Convert MP3 file to SILK format
@@ -132,27 +338,9 @@ def mp3_to_silk(mp3_path: str, silk_path: str) -> int:
     Returns:
         Duration of the SILK file in milliseconds
     """
-    # First load the MP3 file
-    audio = AudioSegment.from_file(mp3_path)
-    
-    # Convert to mono and set sample rate to 24000Hz
-    # TODO: 下面的参数可能需要调整
-    audio = audio.set_channels(1)
-    audio = audio.set_frame_rate(24000)
-    
-    # Export to PCM
-    pcm_path = os.path.splitext(mp3_path)[0] + '.pcm'
-    audio.export(pcm_path, format='s16le')
-    
-    # Convert PCM to SILK
-    pilk.encode(pcm_path, silk_path, pcm_rate=24000, tencent=True)
-    
-    # Clean up temporary PCM file
-    os.remove(pcm_path)
-    
-    # Get duration of the SILK file
-    duration = pilk.get_duration(silk_path)
-    return duration
+    pcm = load_pcm(mp3_path, SILK_RATE)
+    _write_file(silk_path, silk_encode(pcm, SILK_RATE))
+    return pcm_duration(pcm, SILK_RATE)
 
 def any_to_amr(any_path, amr_path):
     """
@@ -161,21 +349,17 @@ def any_to_amr(any_path, amr_path):
     if any_path.endswith(".amr"):
         shutil.copy2(any_path, amr_path)
         return
-    if any_path.endswith(".sil") or any_path.endswith(".silk") or any_path.endswith(".slk"):
+    if any_path.endswith(SILK_EXTS):
         raise NotImplementedError("Not support file type: {}".format(any_path))
-    audio = AudioSegment.from_file(any_path)
-    audio = audio.set_frame_rate(8000)  # only support 8000
-    audio.export(amr_path, format="amr")
-    return audio.duration_seconds * 1000
+    pcm = load_pcm(any_path, 8000)  # only support 8000
+    _write_file(amr_path, encode_pcm(pcm, "amr", 8000))
+    return pcm_duration(pcm, 8000)
 
-# TODO: 删除pysilk，改用pilk
 def sil_to_wav(silk_path, wav_path, rate: int = 24000):
     """
     silk 文件转 wav
     """
-    wav_data = pysilk.decode_file(silk_path, to_wav=True, sample_rate=rate)
-    with open(wav_path, "wb") as f:
-        f.write(wav_data)
+    _write_file(wav_path, load_audio(silk_path, "wav", rate))
 
 
 def split_audio(file_path, max_segment_length_ms=60000):
@@ -12,6 +12,7 @@ from bridge.reply import Reply, ReplyType
 from common.log import logger
 from common.tmp_dir import TmpDir
 from config import conf
+from voice.audio_convert import load_pcm
 from voice.voice import Voice
 
 """
@@ -57,7 +58,11 @@ class AzureVoice(Voice):
             logger.warn("AzureVoice init failed: %s, ignore " % e)
 
     def voiceToText(self, voice_file):
-        audio_config = speechsdk.AudioConfig(filename=voice_file)
+        # 在内存中解码为16k的pcm，通过推流方式识别
+        stream = speechsdk.audio.PushAudioInputStream(speechsdk.audio.AudioStreamFormat(samples_per_second=16000, bits_per_sample=16, channels=1))
+        stream.write(load_pcm(voice_file, 16000))
+        stream.close()
+        audio_config = speechsdk.AudioConfig(stream=stream)
         speech_recognizer = speechsdk.SpeechRecognizer(speech_config=self.speech_config, audio_config=audio_config)
         result = speech_recognizer.recognize_once()
         if result.reason == speechsdk.ResultReason.RecognizedSpeech:
@@ -69,17 +74,20 @@ class AzureVoice(Voice):
             reply = Reply(ReplyType.ERROR, "抱歉，语音识别失败")
         return reply
 
-    def textToVoice(self, text):
+    def _voice_name(self, text):
         if self.config.get("auto_detect"):
             lang = classify(text)[0]
             key = "speech_synthesis_" + lang
             if key in self.config:
                 logger.info("[Azure] textToVoice auto detect language={}, voice={}".format(lang, self.config[key]))
-                self.speech_config.speech_synthesis_voice_name = self.config[key]
-            else:
-                self.speech_config.speech_synthesis_voice_name = self.config["speech_synthesis_voice_name"]
-        else:
-            self.speech_config.speech_synthesis_voice_name = self.config["speech_synthesis_voice_name"]
+                return self.config[key]
+        return self.config["speech_synthesis_voice_name"]
+
+    def cache_params(self, text):
+        return {"voice": self._voice_name(text)}
+
+    def textToVoice(self, text):
+        self.speech_config.speech_synthesis_voice_name = self._voice_name(text)
         # Avoid the same filename under multithreading
         fileName = TmpDir().path() + "reply-" + str(int(time.time())) + "-" + str(hash(text) & 0x7FFFFFFF) + ".wav"
         audio_config = speechsdk.AudioConfig(filename=fileName)
@@ -11,7 +11,7 @@ from bridge.reply import Reply, ReplyType
 from common.log import logger
 from common.tmp_dir import TmpDir
 from config import conf
-from voice.audio_convert import get_pcm_from_wav
+from voice.audio_convert import load_pcm
 from voice.voice import Voice
 
 """
@@ -61,7 +61,7 @@ class BaiduVoice(Voice):
     def voiceToText(self, voice_file):
         # 识别本地文件
         logger.debug("[Baidu] voice file name={}".format(voice_file))
-        pcm = get_pcm_from_wav(voice_file)
+        pcm = load_pcm(voice_file, 16000)
         res = self.client.asr(pcm, "pcm", 16000, {"dev_pid": self.dev_id})
         if res["err_no"] == 0:
             logger.info("百度语音识别到了：{}".format(res["result"]))
@@ -74,6 +74,9 @@ class BaiduVoice(Voice):
             reply = Reply(ReplyType.ERROR, "百度语音识别出错了；{0}".format(res["err_msg"]))
         return reply
 
+    def cache_params(self, text):
+        return {"lang": self.lang, "ctp": self.ctp, "spd": self.spd, "pit": self.pit, "vol": self.vol, "per": self.per}
+
     def textToVoice(self, text):
         result = self.client.synthesis(
             text,
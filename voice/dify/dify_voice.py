@@ -4,7 +4,7 @@ from bridge.reply import Reply, ReplyType
 from common.log import logger
 from config import conf
 from voice.voice import Voice
-from voice.audio_convert import any_to_mp3
+from voice.audio_convert import load_for_upload
 import datetime
 import random
 
@@ -12,15 +12,10 @@ class DifyVoice(Voice):
     def voiceToText(self, voice_file):
         logger.debug("[DIFY VOICE] voice file name={}".format(voice_file))
         try:
-            # 测试发现dify不支持wav格式，支持mp3格式，统一转为mp3格式
-            filepath, ext = os.path.splitext(voice_file)
-            if ext != ".mp3":
-                old_voice_file = voice_file
-                voice_file = filepath + ".mp3"
-                if os.path.exists(old_voice_file):
-                    any_to_mp3(old_voice_file, voice_file)
+            # 测试发现dify不支持wav格式，支持mp3格式，统一在内存中转为mp3格式
+            file_name, data = load_for_upload(voice_file, ("mp3",))
             files = {
-                'file': (os.path.basename(voice_file), open(voice_file, 'rb'), 'audio/mp3')
+                'file': (file_name, data, 'audio/mp3')
             }
             headers = {
                 'Authorization': 'Bearer ' + conf().get("dify_api_key")
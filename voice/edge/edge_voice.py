@@ -1,15 +1,14 @@
 import time
 
 import edge_tts
-import asyncio
 
 from bridge.reply import Reply, ReplyType
 from common.log import logger
 from common.tmp_dir import TmpDir
-from voice.voice import Voice
+from voice.voice import AsyncVoice
 
 
-class EdgeVoice(Voice):
+class EdgeVoice(AsyncVoice):
 
     def __init__(self):
         '''
@@ -37,14 +36,22 @@ class EdgeVoice(Voice):
     def voiceToText(self, voice_file):
         pass
 
-    async def gen_voice(self, text, fileName):
-        communicate = edge_tts.Communicate(text, self.voice)
-        await communicate.save(fileName)
+    def cache_params(self, text):
+        return {"voice": self.voice}
 
-    def textToVoice(self, text):
-        fileName = TmpDir().path() + "reply-" + str(int(time.time())) + "-" + str(hash(text) & 0x7FFFFFFF) + ".mp3"
+    async def gen_voice(self, text):
+        # 音频在内存中拼接，合成完成后一次写入文件
+        audio = bytearray()
+        async for chunk in edge_tts.Communicate(text, self.voice).stream():
+            if chunk["type"] == "audio":
+                audio.extend(chunk["data"])
+        return audio
 
-        asyncio.run(self.gen_voice(text, fileName))
+    async def atextToVoice(self, text):
+        fileName = TmpDir().path() + "reply-" + str(int(time.time())) + "-" + str(hash(text) & 0x7FFFFFFF) + ".mp3"
+        audio = await self.gen_voice(text)
+        with open(fileName, "wb") as f:
+            f.write(audio)
 
         logger.info("[EdgeTTS] textToVoice text={} voice file name={}".format(text, fileName))
         return Reply(ReplyType.VOICE, fileName)
@@ -2,6 +2,7 @@
 google voice service
 """
 
+import io
 import time
 
 import speech_recognition
@@ -10,6 +11,7 @@ from gtts import gTTS
 from bridge.reply import Reply, ReplyType
 from common.log import logger
 from common.tmp_dir import TmpDir
+from voice.audio_convert import load_audio
 from voice.voice import Voice
 
 
@@ -20,7 +22,7 @@ class GoogleVoice(Voice):
         pass
 
     def voiceToText(self, voice_file):
-        with speech_recognition.AudioFile(voice_file) as source:
+        with speech_recognition.AudioFile(io.BytesIO(load_audio(voice_file, "wav", 16000))) as source:
             audio = self.recognizer.record(source)
         try:
             text = self.recognizer.recognize_google(audio, language="zh-CN")
@@ -33,6 +35,9 @@ class GoogleVoice(Voice):
         finally:
             return reply
 
+    def cache_params(self, text):
+        return {"lang": "zh"}
+
     def textToVoice(self, text):
         try:
             # Avoid the same filename under multithreading
@@ -24,14 +24,14 @@ class LinkAIVoice(Voice):
             model = None
             if not conf().get("text_to_voice") or conf().get("voice_to_text") == "openai":
                 model = const.WHISPER_1
-            if voice_file.endswith(".amr"):
-                try:
-                    mp3_file = os.path.splitext(voice_file)[0] + ".mp3"
-                    audio_convert.any_to_mp3(voice_file, mp3_file)
-                    voice_file = mp3_file
-                except Exception as e:
-                    logger.warn(f"[LinkVoice] amr file transfer failed, directly send amr voice file: {format(e)}")
-            file = open(voice_file, "rb")
+            try:
+                # amr、silk等格式在内存中转为mp3
+                file = audio_convert.load_for_upload(voice_file, ("mp3", "wav", "m4a", "mp4", "mpeg", "mpga", "webm"))
+            except Exception as e:
+                if isinstance(voice_file, audio_convert.PcmAudio):
+                    raise  # 内存中的语音片段没有原始文件可以回退
+                logger.warn(f"[LinkVoice] voice file transfer failed, directly send raw voice file: {format(e)}")
+                file = open(voice_file, "rb")
             file_body = {
                 "file": file
             }
@@ -52,6 +52,12 @@ class LinkAIVoice(Voice):
             return None
         return reply
 
+    def cache_params(self, text):
+        model = const.TTS_1
+        if not conf().get("text_to_voice") or conf().get("text_to_voice") in ["openai", const.TTS_1, const.TTS_1_HD]:
+            model = conf().get("text_to_voice_model") or const.TTS_1
+        return {"model": model, "voice": conf().get("tts_voice_id"), "app_code": conf().get("linkai_app_code")}
+
     def textToVoice(self, text):
         try:
             url = conf().get("linkai_api_base", "https://api.link-ai.tech") + "/v1/audio/speech"
@@ -8,6 +8,7 @@ import openai
 from bridge.reply import Reply, ReplyType
 from common.log import logger
 from config import conf
+from voice.audio_convert import load_for_upload
 from voice.voice import Voice
 import requests
 from common import const
@@ -21,7 +22,8 @@ class OpenaiVoice(Voice):
     def voiceToText(self, voice_file):
         logger.debug("[Openai] voice file name={}".format(voice_file))
         try:
-            file = open(voice_file, "rb")
+            # whisper不支持silk、amr等格式，在内存中转为mp3
+            file = load_for_upload(voice_file, ("flac", "m4a", "mp3", "mp4", "mpeg", "mpga", "oga", "ogg", "wav", "webm"))
             api_base = conf().get("open_ai_api_base") or "https://api.openai.com/v1"
             url = f'{api_base}/audio/transcriptions'
             headers = {
@@ -45,6 +47,9 @@ class OpenaiVoice(Voice):
             return reply
 
 
+    def cache_params(self, text):
+        return {"model": conf().get("text_to_voice_model") or const.TTS_1, "voice": conf().get("tts_voice_id") or "alloy"}
+
     def textToVoice(self, text):
         try:
             api_base = conf().get("open_ai_api_base") or "https://api.openai.com/v1"
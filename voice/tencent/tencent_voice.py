@@ -2,6 +2,7 @@ import json
 import base64
 import os
 import time
+from voice.audio_convert import load_audio
 from voice.voice import Voice
 from common.log import logger
 from tencentcloud.common import credential
@@ -51,9 +52,8 @@ class TencentVoice(Voice):
             # 实例化客户端
             client = asr_client.AsrClient(cred, "ap-guangzhou")
             
-            # 读取音频文件
-            with open(voice_file, 'rb') as f:
-                audio_data = f.read()
+            # 读取音频文件，在内存中转为16k的wav
+            audio_data = load_audio(voice_file, "wav", 16000)
             
             # 进行base64编码
             base64_audio = base64.b64encode(audio_data).decode('utf-8')
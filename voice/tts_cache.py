@@ -0,0 +1,230 @@
+# encoding:utf-8
+
+"""
+语音合成结果缓存
+
+按(语音引擎, 音色等合成参数, 归一化后的文本)寻址，保存合成出的语音文件和编码好的silk文件及时长，
+欢迎语、关键词回复、报错提示等固定文本只需合成一次，命中时跳过合成和silk编码。
+缓存目录: <appdata>/tts_cache，超过tts_cache_max_size后按最近最少使用淘汰。
+交给channel的语音文件路径会记录对应的缓存key，channel转换silk时据此找到缓存条目
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import unicodedata
+import uuid
+from collections import OrderedDict
+
+from bridge.reply import Reply, ReplyType
+from common.log import logger
+from common.tmp_dir import TmpDir
+from common.ttl_cache import TTLCache
+from config import conf, get_appdata_dir
+from voice.audio_convert import any_to_sil
+
+
+def normalize_text(text):
+    """
+    归一化待合成文本：统一全角半角、合并连续空白，只有格式差异的文本命中同一条缓存
+    """
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def cache_key(provider, params, text):
+    raw = json.dumps([provider, params, normalize_text(text)], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _link(src, dst):
+    # 优先硬链接，channel发送后删除dst不影响缓存文件
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def _copy_into(src, dst):
+    tmp_path = "{}.{}.tmp".format(dst, threading.get_ident())
+    shutil.copyfile(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+
+class TtsCache(object):
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        self._index_path = os.path.join(root, "index.json")
+        self._entries = OrderedDict()  # key -> 缓存条目，按最近使用排序，最久未使用的在最前
+        self._paths = TTLCache(3600, 1000)  # 交给channel的语音文件路径 -> key，用于识别channel拿到的语音是否来自缓存
+        self._size = 0
+        os.makedirs(root, exist_ok=True)
+        try:
+            with open(self._index_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            entries = []
+        for key, entry in entries:
+            if not os.path.exists(self._path(entry["audio"])):
+                continue
+            if entry.get("silk") and not os.path.exists(self._path(entry["silk"])):
+                entry["silk"] = None
+            self._add(key, entry)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _path(self, name):
+        return os.path.join(self.root, name)
+
+    def _add(self, key, entry):
+        entry["size"] = sum(os.path.getsize(self._path(name)) for name in (entry["audio"], entry.get("silk")) if name)
+        self._entries[key] = entry
+        self._size += entry["size"]
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._size -= entry["size"]
+        for name in (entry["audio"], entry.get("silk")):
+            if name:
+                try:
+                    os.remove(self._path(name))
+                except OSError:
+                    pass
+
+    def _evict(self):
+        max_size = conf().get("tts_cache_max_size", 200) * 1024 * 1024
+        while self._entries and self._size > max_size:
+            key = next(iter(self._entries))
+            logger.debug("[TtsCache] evict {}".format(key))
+            self._remove(key)
+
+    def _save_index(self):
+        tmp_path = self._index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(list(self._entries.items()), f)
+        os.replace(tmp_path, self._index_path)
+
+    def get(self, key):
+        """
+        :return: 缓存语音的临时文件路径，可以直接交给channel发送和删除，未缓存时返回None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)  # 只在内存中调整顺序，下次写入时一起落盘
+            src = self._path(entry["audio"])
+        path = "{}reply-{}-{}{}".format(TmpDir().path(), int(time.time()), uuid.uuid4().hex[:8], os.path.splitext(src)[1])
+        try:
+            _link(src, path)
+        except OSError:  # 文件在加锁外被淘汰
+            return None
+        self._paths[path] = key
+        return path
+
+    def put(self, key, voice_path):
+        """
+        缓存合成出的语音文件，同一文本被并发合成时只保留先写入的一份
+        """
+        self._paths[voice_path] = key
+        with self._lock:
+            if key in self._entries:
+                return
+        # 文件名带随机后缀，并发写入同一key时互不覆盖
+        name = "{}-{}{}".format(key, uuid.uuid4().hex[:8], os.path.splitext(voice_path)[1])
+        _copy_into(voice_path, self._path(name))
+        entry = {"audio": name, "silk": None, "duration": None}
+        with self._lock:
+            if key not in self._entries:
+                self._add(key, entry)
+                self._evict()
+                self._save_index()
+                return
+        os.remove(self._path(name))
+
+    def synthesize(self, voice, params, text) -> Reply:
+        """
+        命中缓存时直接返回缓存的语音，否则调用引擎合成并缓存结果
+        """
+        key = cache_key(type(voice).__name__, params, text)
+        path = self.get(key)
+        if path:
+            logger.info("[TtsCache] hit text={} voice file name={}".format(text, path))
+            return Reply(ReplyType.VOICE, path)
+        reply = voice.textToVoice(text)
+        if reply and reply.type == ReplyType.VOICE and isinstance(reply.content, str) and os.path.isfile(reply.content):
+            try:
+                self.put(key, reply.content)
+            except Exception as e:
+                logger.warning("[TtsCache] cache voice failed: {}".format(e))
+        return reply
+
+    def to_silk(self, voice_path, silk_path):
+        """
+        转换为silk文件，语音来自缓存时复用编码好的silk，首次编码后存入缓存
+        :return: 语音时长(毫秒)
+        """
+        key = self._paths.pop(voice_path, None)
+        with self._lock:
+            entry = self._entries.get(key) if key else None
+            if entry and entry.get("silk"):
+                try:
+                    _link(self._path(entry["silk"]), silk_path)
+                    return entry["duration"]
+                except OSError:
+                    pass
+        duration = any_to_sil(voice_path, silk_path)
+        if entry:
+            try:
+                name = "{}-{}.silk".format(key, uuid.uuid4().hex[:8])
+                _copy_into(silk_path, self._path(name))
+                with self._lock:
+                    stored = self._entries.get(key) is entry and not entry.get("silk")
+                    if stored:
+                        self._size -= entry["size"]
+                        entry["silk"], entry["duration"] = name, duration
+                        self._add(key, entry)
+                        self._evict()
+                        self._save_index()
+                if not stored:  # 条目已被淘汰，或其他线程已写入silk
+                    os.remove(self._path(name))
+            except Exception as e:
+                logger.warning("[TtsCache] cache silk failed: {}".format(e))
+        return duration
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_tts_cache() -> TtsCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = TtsCache(os.path.join(get_appdata_dir(), "tts_cache"))
+    return _cache
+
+
+def text_to_voice(voice, text) -> Reply:
+    """
+    带缓存的语音合成，未开启缓存或引擎不支持缓存(cache_params返回None)时直接合成
+    """
+    params = voice.cache_params(text) if conf().get("tts_cache") else None
+    if params is None:
+        return voice.textToVoice(text)
+    return get_tts_cache().synthesize(voice, params, text)
+
+
+def voice_to_silk(voice_path, silk_path):
+    """
+    把语音回复转换为silk文件，语音来自合成缓存时跳过编码
+    :return: 语音时长(毫秒)
+    """
+    if conf().get("tts_cache"):
+        return get_tts_cache().to_silk(voice_path, silk_path)
+    return any_to_sil(voice_path, silk_path)
@@ -0,0 +1,61 @@
+# encoding:utf-8
+
+"""
+长文本分段语音合成
+
+回复按句切分后分组，每组的预估时长不超过channel单条语音的最大时长，
+各组在tts_segment线程池中并发合成，按顺序返回，前面的语音发送时后面的仍在合成
+"""
+
+import re
+
+from bridge.reply import Reply, ReplyType
+from common.log import logger
+from common.thread_pool import get_thread_pool
+
+CHARS_PER_SECOND = 4  # 预估语速，中文约每秒4个字
+_SENTENCE = re.compile(r".+?(?:[。！？!?；;…]+[”’\"')）]?|\.(?=\s)|\n+|$)", re.S)
+
+
+def split_sentences(text) -> list:
+    return [s.strip() for s in _SENTENCE.findall(text) if s.strip()]
+
+
+def plan_segments(text, max_duration_ms: int) -> list:
+    """
+    按句切分并合并为多段，第一段只包含第一句，尽快开始发送
+    :param max_duration_ms: 单条语音的最大时长，按CHARS_PER_SECOND预估
+    """
+    max_chars = max(max_duration_ms * CHARS_PER_SECOND // 1000, 1)
+    segments = []
+    current = ""
+    for sentence in split_sentences(text):
+        if current and (not segments or len(current) + len(sentence) > max_chars):
+            segments.append(current)
+            current = ""
+        while len(sentence) > max_chars:  # 单句超长时直接截断
+            segments.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        current += sentence
+    if current:
+        segments.append(current)
+    return segments
+
+
+def _synthesize(text_to_voice, text) -> Reply:
+    try:
+        return text_to_voice(text)
+    except Exception as e:
+        logger.exception("[TTS] synthesize segment failed: {}".format(e))
+        return Reply(ReplyType.ERROR, "抱歉，语音合成失败")
+
+
+def synthesize_segments(text_to_voice, segments):
+    """
+    并发合成各段语音，按顺序逐个返回
+    :param text_to_voice: 单段文本的语音合成函数，返回Reply
+    """
+    pool = get_thread_pool("tts_segment")
+    futures = [pool.submit(_synthesize, text_to_voice, segment) for segment in segments]
+    for future in futures:
+        yield future.result()
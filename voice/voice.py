@@ -2,6 +2,13 @@
 Voice service abstract class
 """
 
+from concurrent.futures import TimeoutError
+
+from bridge.reply import Reply, ReplyType
+from common.async_loop import AsyncLoop
+from common.log import logger
+from config import conf
+
 
 class Voice(object):
     def voiceToText(self, voice_file):
@@ -15,3 +22,30 @@ class Voice(object):
         Send text to voice service and get voice
         """
         raise NotImplementedError
+
+    def cache_params(self, text):
+        """
+        Parameters that affect the synthesized voice besides the text, used as tts cache key.
+        Return None to disable caching for this voice service
+        """
+        return None
+
+
+class AsyncVoice(Voice):
+    """
+    基于协程SDK的语音服务，在全局共享的事件循环中执行，不再每次调用都创建和销毁事件循环
+    """
+
+    def textToVoice(self, text):
+        timeout = conf().get("text_to_voice_timeout", 60)
+        try:
+            return AsyncLoop().run(self.atextToVoice(text), timeout)
+        except TimeoutError:
+            logger.error("[{}] textToVoice timed out after {}s, text={}".format(type(self).__name__, timeout, text))
+            return Reply(ReplyType.ERROR, "抱歉，语音合成超时")
+
+    async def atextToVoice(self, text):
+        """
+        Send text to voice service and get voice in coroutine
+        """
+        raise NotImplementedError
@@ -38,9 +38,7 @@ STATUS_LAST_FRAME = 2  # 最后一帧的标识
 
 #############
 #whole_dict 是用来存储返回值的，由于带语音修正，所以用dict来存储，有更新的化pop之前的值，最后再合并
-global whole_dict
-#这个文档是官方文档改的，这个参数是用来做函数调用时用的
-global wsParam
+#whole_dict和wsParam保存在每次调用的ws对象上，多段语音可以并发识别
 ##############
 
 
@@ -93,7 +91,7 @@ class Ws_Param(object):
 
 # 收到websocket消息的处理
 def on_message(ws, message):
-    global whole_dict
+    whole_dict = ws.whole_dict
     try:
         code = json.loads(message)["code"]
         sid = json.loads(message)["sid"]
@@ -143,7 +141,7 @@ def on_close(ws,a,b):
 
 # 收到websocket连接建立的处理
 def on_open(ws):
-    global wsParam
+    wsParam = ws.wsParam
     def run(*args):
         frameSize = 8000  # 每一帧的音频大小
         intervel = 0.04  # 发送音频间隔(单位:s)
@@ -187,23 +185,20 @@ def on_open(ws):
 
 #提供给xunfei_voice调用的函数
 def xunfei_asr(APPID,APISecret,APIKey,BusinessArgsASR,AudioFile):
-    global whole_dict
-    global wsParam
-    whole_dict = {}
-    wsParam1 = Ws_Param(APPID=APPID, APISecret=APISecret,
+    wsParam = Ws_Param(APPID=APPID, APISecret=APISecret,
                        APIKey=APIKey,BusinessArgs=BusinessArgsASR,
                        AudioFile=AudioFile)
-    #wsParam是global变量，给上面on_open函数调用使用的
-    wsParam = wsParam1
     websocket.enableTrace(False)
     wsUrl = wsParam.create_url()
     ws = websocket.WebSocketApp(wsUrl, on_message=on_message, on_error=on_error, on_close=on_close)
     ws.on_open = on_open
+    ws.wsParam = wsParam
+    ws.whole_dict = {}
     ws.run_forever(sslopt={"cert_reqs": ssl.CERT_NONE})
     #把字典的值合并起来做最后识别的输出
     whole_words = ""
-    for i in sorted(whole_dict.keys()):
-        whole_words += whole_dict[i]
+    for i in sorted(ws.whole_dict.keys()):
+        whole_words += ws.whole_dict[i]
     return whole_words
 
      
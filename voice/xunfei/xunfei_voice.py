@@ -17,6 +17,7 @@
 # }
 #####################################################################
 
+import io
 import json
 import os
 import time
@@ -28,7 +29,7 @@ from config import conf
 from voice.voice import Voice
 from .xunfei_asr import xunfei_asr
 from .xunfei_tts import xunfei_tts
-from voice.audio_convert import any_to_mp3
+from voice.audio_convert import load_audio
 import shutil
 from pydub import AudioSegment
 
@@ -65,7 +66,8 @@ class XunfeiVoice(Voice):
             #shutil.copy2(voice_file, 'tmp/test1.wav')
             #shutil.copy2(mp3_file, 'tmp/test1.mp3')
             #print("voice and mp3 file",voice_file,mp3_file)
-            text = xunfei_asr(self.APPID,self.APISecret,self.APIKey,self.BusinessArgsASR,voice_file)
+            # 在内存中转为16k的wav，xunfei_asr通过wave读取
+            text = xunfei_asr(self.APPID, self.APISecret, self.APIKey, self.BusinessArgsASR, io.BytesIO(load_audio(voice_file, "wav", 16000)))
             logger.info("讯飞语音识别到了: {}".format(text))
             reply = Reply(ReplyType.TEXT, text)
         except Exception as e: